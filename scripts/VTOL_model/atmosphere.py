@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+'''
+ISA standard atmosphere with a temperature offset
+
+gives the air density at a pressure altitude in the troposphere, with
+the air temperature offset from the ISA temperature by temp_offset deg
+C, as on a hot or cold day. The pressure at an altitude is the ISA
+pressure whatever the offset, and the density follows from the ideal
+gas law at the offset temperature. Functions use plain arithmetic, so
+they take floats or NumPy arrays, and density() is a backend kernel:
+
+  rho = atmosphere.density(backend.scalar, 2000.0, 20.0)  # 2000 m on an ISA+20 day
+'''
+
+from util import gravity, rho
+
+sea_level_temp = 288.15 # ISA sea level temperature (K)
+sea_level_pressure = 101325.0 # ISA sea level pressure (Pa)
+lapse_rate = 0.0065 # ISA temperature lapse rate in the troposphere (K/m)
+gas_constant = 287.05287 # specific gas constant of dry air (J/(Kg K))
+pressure_exponent = gravity / (lapse_rate * gas_constant)
+zero_celsius = 273.15
+
+# altitude range of the model, from below the lowest land to the tropopause (m)
+altitude_min = -500.0
+altitude_max = 11000.0
+
+def temperature_ratio(altitude):
+    '''ISA temperature at altitude as a fraction of the sea level temperature'''
+    return (sea_level_temp - lapse_rate * altitude) / sea_level_temp
+
+def temperature(altitude, temp_offset=0.0):
+    '''air temperature at altitude in deg C'''
+    return sea_level_temp - lapse_rate * altitude + temp_offset - zero_celsius
+
+def temp_offset_for(altitude, temp):
+    '''return the ISA temperature offset giving an air temperature of temp deg C at altitude'''
+    return temp + zero_celsius - (sea_level_temp - lapse_rate * altitude)
+
+def pressure(altitude):
+    '''air pressure at altitude in Pa'''
+    return sea_level_pressure * temperature_ratio(altitude) ** pressure_exponent
+
+def density(xp, altitude, temp_offset):
+    '''
+    air density at altitude in Kg/m^3 with the temperature offset from
+    ISA by temp_offset, on backend xp. At sea level on an ISA day it is
+    exactly util.rho
+    '''
+    theta = temperature_ratio(altitude)
+    delta = xp.power(theta, pressure_exponent)
+    return rho * delta * sea_level_temp / (sea_level_temp - lapse_rate * altitude + temp_offset)
+
+def density_altitude(density):
+    '''return the altitude in m at which the ISA day density is density'''
+    sigma = density / rho
+    return sea_level_temp / lapse_rate * (1.0 - sigma ** (1.0 / (pressure_exponent - 1.0)))
+
+def in_range(altitude, temp_offset):
+    '''return whether the atmosphere is modelled at altitude and temp_offset, for floats or arrays'''
+    return ((altitude >= altitude_min) & (altitude <= altitude_max) &
+            (sea_level_temp - lapse_rate * altitude + temp_offset > 0.0))
+
+range_error = 'altitude must be between %.0f and %.0f m, with a temperature above absolute zero' % (altitude_min, altitude_max)
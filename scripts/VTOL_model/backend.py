@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+'''
+scalar and array backends for the physics kernels
+
+the physics kernels in wing.py, motor.py, battery.py, atmosphere.py
+and vtol_model.py are written once against this small interface,
+taking the backend as their first argument, xp. The scalar backend
+works on Python floats, for the lowest latency single evaluations, and
+the array backend on NumPy arrays, for batches. Kernels use plain arithmetic, writing
+squares and cubes as products, and only these functions otherwise, so
+both backends carry out the same IEEE operations in the same order and
+give identical results. check_backends.py checks that they do
+'''
+
+import math
+import numpy as np
+
+class scalar_backend(object):
+    '''kernels on Python floats'''
+
+    name = 'scalar'
+
+    def sqrt(self, x):
+        '''square root, NaN for negative x'''
+        return math.sqrt(x) if x >= 0 else float('nan')
+
+    def minimum(self, a, b):
+        '''smaller of a and b, NaN if either is NaN'''
+        return a if a <= b or a != a else b
+
+    def maximum(self, a, b):
+        '''larger of a and b, NaN if either is NaN'''
+        return a if a >= b or a != a else b
+
+    def where(self, condition, a, b):
+        '''a where condition is true, else b'''
+        return a if condition else b
+
+    def abs(self, x):
+        '''absolute value'''
+        return abs(x)
+
+    def power(self, x, y):
+        '''x to the power y, with NumPy's pow as math.pow can differ in the last bit'''
+        return float(np.power(x, y))
+
+    def polyval(self, coefs, x):
+        '''evaluate a polynomial with Horner's rule, coefs a list with the highest power first'''
+        y = 0.0
+        for c in coefs:
+            y = y * x + c
+        return y
+
+class array_backend(object):
+    '''kernels on NumPy arrays, element by element'''
+
+    name = 'array'
+
+    def sqrt(self, x):
+        '''square root, NaN for negative x'''
+        with np.errstate(invalid='ignore'):
+            return np.sqrt(x)
+
+    def minimum(self, a, b):
+        '''smaller of a and b, NaN if either is NaN'''
+        return np.minimum(a, b)
+
+    def maximum(self, a, b):
+        '''larger of a and b, NaN if either is NaN'''
+        return np.maximum(a, b)
+
+    def where(self, condition, a, b):
+        '''a where condition is true, else b'''
+        return np.where(condition, a, b)
+
+    def abs(self, x):
+        '''absolute value'''
+        return np.abs(x)
+
+    def power(self, x, y):
+        '''x to the power y'''
+        return np.power(x, y)
+
+    def polyval(self, coefs, x):
+        '''
+        evaluate polynomials with Horner's rule. coefs is an (order+1,)
+        array for one polynomial, or (N, order+1) for one per element,
+        highest power first as in numpy.poly1d
+        '''
+        coefs = np.asarray(coefs)
+        y = np.zeros_like(np.asarray(x, dtype=float))
+        columns = coefs if coefs.ndim == 1 else coefs.T
+        for c in columns:
+            y = y * x + c
+        return y
+
+scalar = scalar_backend()
+array = array_backend()
@@ -0,0 +1,883 @@
+#!/usr/bin/env python
+
+'''
+vectorized VTOL model evaluation
+
+evaluates a whole batch of vtol_model.vtol_config configurations at
+once. The cruise, climb and hover solvers run in lockstep
+across the batch, with per-element convergence masks, so the cost of
+an iteration is a handful of NumPy operations instead of a Python
+loop per configuration
+'''
+
+import numpy as np
+import propeller
+import battery
+import motor
+import wing
+import atmosphere
+import backend
+import solver
+import vtol_model
+from util import *
+from vtol_model import cruise_power, calc_climb_rate, hover_endurance
+
+best_ETA_step = 0.01 # J step used when searching for the best prop efficiency, as in vtol_model.py
+
+# iteration limits of the scalar solvers
+cruise_max_iterations = 10000
+climb_max_iterations = 1000
+hover_max_iterations = 1000
+
+# per-element inputs of a config_batch that can be changed before
+# evaluation, calling update() afterwards, as (name, description)
+parameters = [
+    ('wing_span', 'wing span'),
+    ('aspect_ratio', 'wing aspect ratio'),
+    ('mission_speed', 'mission min speed'),
+    ('hover_time', 'hover time'),
+    ('mass_payload', 'payload mass'),
+    ('mass_avionics', 'avionics mass'),
+    ('mass_structure', 'structure mass'),
+    ('prop_diameter', 'prop diameter'),
+    ('prop_CT_factor', 'prop CT correction factor'),
+    ('prop_CP_factor', 'prop CP correction factor'),
+    ('CD0_wing', 'wing section zero lift drag coefficient'),
+    ('fus_drag_coef', 'fuselage drag coefficient'),
+    ('CL_max', 'maximum lift coefficient'),
+    ('span_efficiency', 'span efficiency factor'),
+    ('motor_kV', 'motor kV'),
+    ('motor_esr', 'motor armature resistance'),
+    ('motor_supply_esr', 'motor supply resistance'),
+    ('motor_i0_current', 'motor zero-load current'),
+    ('batt_cell_energy_density', 'cell energy density'),
+    ('batt_cell_age_factor', 'cell age factor'),
+    ('altitude', 'site pressure altitude'),
+    ('temp_offset', 'temperature offset from ISA'),
+]
+
+parameter_names = [p[0] for p in parameters]
+
+def polyval(coefs, x):
+    '''
+    evaluate one polynomial per element using Horner's rule. coefs is
+    an (N, order+1) array, highest power first, as in numpy.poly1d
+    '''
+    return backend.array.polyval(coefs, x)
+
+class prop_tables(object):
+    '''
+    one row of the dense tables of a set of propeller.coef_table objects,
+    concatenated into a single contiguous array for vectorized lookups
+    '''
+
+    def __init__(self, tables, row):
+        self.values = np.ascontiguousarray(np.concatenate([t.values[row] for t in tables]))
+        self.points = np.array([t.points for t in tables], dtype=np.intp)
+        self.offset = np.concatenate([[0], np.cumsum(self.points)[:-1]]).astype(np.intp)
+        self.J_min = np.array([t.J_min for t in tables])
+        self.inv_dJ = np.array([t.inv_dJ for t in tables])
+
+    def lookup(self, rows, J):
+        '''return the interpolated values at J of the tables numbered rows'''
+        last = self.points[rows] - 1
+        x = np.minimum(np.maximum((J - self.J_min[rows]) * self.inv_dJ[rows], 0.0), last)
+        i = np.minimum(x.astype(np.intp), last - 1)
+        k = self.offset[rows] + i
+        v = self.values[k]
+        return v + (x - i) * (self.values[k+1] - v)
+
+class prop_curve(object):
+    '''
+    a prop coefficient curve (CT or CP, or a derivative) per element,
+    evaluated from per-element polynomial coefficients or, for elements
+    with a table row, by lookup in shared dense tables, and multiplied
+    by a per-element correction factor if given. Indexing selects
+    elements as for an array, so working_set can compress it
+    '''
+
+    def __init__(self, coefs, tables=None, rows=None, factor=None):
+        self.coefs = coefs   # (N, order+1) polynomial coefficients
+        self.tables = tables # prop_tables, or None if no element uses tables
+        self.rows = rows     # per-element table row, -1 for polynomial elements
+        self.factor = factor # per-element correction factor, or None
+
+    def __getitem__(self, i):
+        return prop_curve(self.coefs[i], self.tables,
+                          None if self.rows is None else self.rows[i],
+                          None if self.factor is None else self.factor[i])
+
+    def __call__(self, J):
+        y = self.evaluate(J)
+        if self.factor is None:
+            return y
+        return self.factor * y
+
+    def evaluate(self, J):
+        '''return the uncorrected curve values at J'''
+        if self.rows is None:
+            return polyval(self.coefs, J)
+        tabled = self.rows >= 0
+        if tabled.all():
+            return self.tables.lookup(self.rows, J)
+        y = polyval(self.coefs, J)
+        if tabled.any():
+            y[tabled] = self.tables.lookup(self.rows[tabled], J[tabled])
+        return y
+
+class config_batch(object):
+    '''a batch of configurations, held as one NumPy array per parameter'''
+
+    def __init__(self, configs):
+        configs = list(configs)
+        self.size = len(configs)
+
+        def column(name, dtype=float):
+            return np.array([getattr(c, name) for c in configs], dtype=dtype)
+
+        self.prop_model = [c.prop_model for c in configs]
+        self.motor_type = [c.motor_type for c in configs]
+        self.battery_model = [c.battery_model for c in configs]
+        for c in configs:
+            if c.solver not in solver.solvers:
+                raise model_error("Unknown solver %s. Choices are %s" % (c.solver, solver.solvers))
+        self.newton = np.array([c.solver == 'newton' for c in configs], dtype=bool)
+        self.prop_table_points = [c.prop_table_points for c in configs]
+
+        self.prop_diameter = column('prop_diameter')
+        self.cell_series = column('cell_series')
+        self.cell_parallel = column('cell_parallel')
+        self.wing_span = column('wing_span')
+        self.aspect_ratio = column('aspect_ratio')
+        self.mission_speed = column('mission_speed')
+        self.hover_time = column('hover_time')
+        self.mass_payload = column('mass_payload')
+        self.mass_avionics = column('mass_avionics')
+        self.mass_structure = column('mass_structure')
+        self.num_motors_cruise = column('num_motors_cruise')
+        self.num_motors_hover = column('num_motors_hover')
+        self.num_motors_total = column('num_motors_total')
+        self.altitude = column('altitude')
+        self.temp_offset = column('temp_offset')
+
+        # prop data correction factors, and wing and fuselage
+        # coefficients, per element so they can be varied
+        self.prop_CT_factor = np.full(self.size, vtol_model.CT_correction_factor)
+        self.prop_CP_factor = np.full(self.size, vtol_model.CP_correction_factor)
+        self.CD0_wing = np.full(self.size, wing.CD0_wing)
+        self.fus_drag_coef = np.full(self.size, wing.fus_drag_coef)
+        self.CL_max = np.full(self.size, wing.CL_max)
+        self.span_efficiency = np.full(self.size, wing.span_efficiency)
+
+        self.load_props()
+        self.load_motors()
+        self.load_batteries()
+        self.update()
+
+    def update(self):
+        '''
+        recalculate the parameters derived from others, after changing
+        any of prop_diameter, the prop correction factors, motor_kV, the
+        cell counts, the batt_cell_ columns, altitude or temp_offset
+        '''
+        self.prop_CT = prop_curve(self.prop_CT_coefs, self.prop_CT_tables, self.prop_table_row, self.prop_CT_factor)
+        self.prop_CP = prop_curve(self.prop_CP_coefs, self.prop_CP_tables, self.prop_table_row, self.prop_CP_factor)
+        self.prop_dCT = prop_curve(self.prop_dCT_coefs, factor=self.prop_CT_factor)
+        self.prop_dCP = prop_curve(self.prop_dCP_coefs, factor=self.prop_CP_factor)
+        self.prop_dia_m = self.prop_diameter * 0.0254
+        self.motor_torque_constant = motor.torque_constant(self.motor_kV)
+        self.batt_mass = self.cell_series * self.cell_parallel * self.batt_cell_mass / self.batt_cell_packaging_factor
+        energy_density = self.batt_cell_energy_density * self.batt_cell_packaging_factor * self.batt_cell_age_factor
+        self.batt_watt_hours = self.batt_mass * energy_density
+        self.batt_voltage_min = self.batt_cell_voltage_min * self.cell_series
+        self.batt_voltage_max = self.batt_cell_voltage_max * self.cell_series
+        with np.errstate(invalid='ignore'):
+            self.rho = atmosphere.density(backend.array, self.altitude, self.temp_offset)
+
+    def gather(self, names):
+        '''return the sorted unique names and the index of each element's name in that list'''
+        unique = sorted(set(names))
+        rows = dict((name, i) for i, name in enumerate(unique))
+        idx = np.array([rows[name] for name in names], dtype=int)
+        return unique, idx
+
+    def load_props(self):
+        '''fit each unique prop once and gather per-element coefficient arrays and tables'''
+        unique, idx = self.gather(list(zip(self.prop_model, self.prop_table_points)))
+        props = [propeller.propeller(name, 1.0, points) for (name, points) in unique]
+        CT = np.array([p.poly_CT.coeffs for p in props])[idx]
+        CP = np.array([p.poly_CP.coeffs for p in props])[idx]
+        tabled = [p for p in props if p.table is not None]
+        self.prop_CT_coefs = CT
+        self.prop_CP_coefs = CP
+        self.prop_CT_tables = self.prop_CP_tables = self.prop_table_row = None
+        if tabled:
+            table_row = np.array([-1] * len(props))
+            table_row[[k for k, p in enumerate(props) if p.table is not None]] = np.arange(len(tabled))
+            tables = [p.table for p in tabled]
+            self.prop_CT_tables = prop_tables(tables, 0)
+            self.prop_CP_tables = prop_tables(tables, 1)
+            self.prop_table_row = table_row[idx]
+        self.prop_dCT_coefs = np.array([p.poly_dCT.coeffs for p in props])[idx]
+        self.prop_dCP_coefs = np.array([p.poly_dCP.coeffs for p in props])[idx]
+        self.prop_J_min = np.array([p.get_J_min() for p in props])[idx]
+        self.prop_J_max = np.array([p.get_J_max() for p in props])[idx]
+        self.prop_best_J = propeller.find_best_ETA_batch([name for (name, points) in unique], best_ETA_step)[idx]
+        self.prop_mass = np.array([p.get_mass() for p in props])[idx]
+        self.prop_pitch_ratio = np.array([p.data_pitch_ratio for p in props])[idx]
+
+    def load_motors(self):
+        '''gather per-element motor parameters'''
+        unique, idx = self.gather(self.motor_type)
+        motors = [motor.motor(name) for name in unique]
+        def column(getter):
+            return np.array([getter(m) for m in motors], dtype=float)[idx]
+        self.motor_mass = column(lambda m: m.get_mass())
+        self.motor_kV = column(lambda m: m.get_kV())
+        self.motor_esr = column(lambda m: m.get_esr())
+        self.motor_supply_esr = column(lambda m: m.get_supply_esr())
+        self.motor_i0_current = column(lambda m: m.get_i0_current())
+        self.motor_i0_voltage = column(lambda m: m.get_i0_voltage())
+        self.motor_current_lim = column(lambda m: m.get_current_lim())
+
+    def load_batteries(self):
+        '''gather per-element battery parameters'''
+        unique, idx = self.gather(self.battery_model)
+        cells = [battery.battery(name, 1, 1).cell for name in unique]
+        def column(name):
+            return np.array([getattr(c, name) for c in cells], dtype=float)[idx]
+        self.batt_cell_mass = column('mass')
+        self.batt_cell_packaging_factor = column('packaging_factor')
+        self.batt_cell_energy_density = column('energy_density')
+        self.batt_cell_age_factor = column('age_factor')
+        self.batt_cell_voltage_min = column('voltage_min')
+        self.batt_cell_voltage_max = column('voltage_max')
+
+
+class batch_status(object):
+    '''per-element success flags and error messages'''
+
+    def __init__(self, size):
+        self.ok = np.ones(size, dtype=bool)
+        self.errors = [None] * size
+
+    def fail(self, mask, msg, idx=None):
+        '''
+        mark elements selected by a boolean mask as failed, keeping the
+        first error. If idx is given the mask selects from those indices
+        '''
+        selected = np.flatnonzero(mask) if idx is None else idx[mask]
+        for i in selected:
+            if self.ok[i]:
+                self.ok[i] = False
+                self.errors[i] = msg
+
+
+def calc_wing(b):
+    '''vectorized wing and drag polar calculations'''
+    p = wing.polar(backend.array, b.wing_span, b.aspect_ratio, b.mass_auw, b.rho,
+                   b.CD0_wing, b.fus_drag_coef, b.CL_max, b.span_efficiency)
+    speed_mission = wing.speed_mission(backend.array, p.speed_stall, p.speed_min_pwr, b.mission_speed)
+    d = wing.drag_polar(backend.array, p.coef_A, p.coef_B, p.speed_min_drag, b.mass_auw, speed_mission)
+    return struct(MAC = b.wing_span / b.aspect_ratio,
+                  speed_stall = p.speed_stall,
+                  speed_min_drag = p.speed_min_drag,
+                  speed_min_pwr = p.speed_min_pwr,
+                  speed_mission = speed_mission,
+                  drag_best_LD = d.drag_best_LD,
+                  LD_max = d.LD_max,
+                  drag_max_endurance = d.drag_max_endurance,
+                  LD_mission = d.LD_mission)
+
+class working_set(object):
+    '''
+    compact copies of the per-element arrays a solver needs, for the
+    elements that are still iterating. Converged elements are dropped
+    with compress() so each iteration only touches live elements
+    '''
+
+    def __init__(self, idx, **arrays):
+        self.idx = idx
+        self.names = list(arrays.keys())
+        self.__dict__.update(arrays)
+
+    def add(self, **arrays):
+        '''add more per-element arrays'''
+        self.names.extend(arrays.keys())
+        self.__dict__.update(arrays)
+
+    def size(self):
+        '''return number of live elements'''
+        return len(self.idx)
+
+    def compress(self, keep):
+        '''keep only the elements where keep is True'''
+        self.idx = self.idx[keep]
+        for name in self.names:
+            setattr(self, name, getattr(self, name)[keep])
+
+def calc_cruise_RPM(b, w, status, select):
+    '''
+    vectorized calc_cruise_RPM: solve for the RPM giving the thrust
+    needed to balance drag at mission speed, for the elements in select
+    '''
+    D = b.prop_dia_m
+    speed = w.speed_mission
+
+    rpm = 60 * (speed / b.prop_best_J) / D
+    nD = np.zeros(b.size)
+    J = np.zeros(b.size)
+    CT = np.zeros(b.size)
+    thrust = np.zeros(b.size)
+
+    i = np.flatnonzero(status.ok & select)
+    ws = working_set(i,
+                     rpm = rpm[i],
+                     D = D[i],
+                     speed = speed[i],
+                     drag = w.drag_max_endurance[i],
+                     n_motors = b.num_motors_cruise[i],
+                     J_min = b.prop_J_min[i],
+                     J_max = b.prop_J_max[i],
+                     rho = b.rho[i],
+                     CT = b.prop_CT[i])
+    counter = 0
+    while ws.size() > 0:
+        # calculate advance ratio
+        nD_ws = (ws.rpm / 60) * ws.D
+        J_ws = np.maximum(np.minimum(ws.speed / nD_ws, ws.J_max), ws.J_min)
+
+        # get thrust coefficient
+        CT_ws = ws.CT(J_ws)
+        thrust_ws = propeller.thrust(CT_ws, nD_ws, ws.D, ws.rho)
+        thrust_error = ws.n_motors * thrust_ws - ws.drag
+        ws.rpm = ws.rpm * (1.0 - 0.01 * thrust_error / thrust_ws)
+
+        # check for convergence, recording converged elements
+        counter += 1
+        done = np.abs(thrust_error) < (0.001 * ws.drag)
+        if counter > cruise_max_iterations:
+            status.fail(~done, 'endurance prop calculation could not converge', ws.idx)
+            done[:] = True
+        if done.any():
+            j = ws.idx[done]
+            rpm[j] = ws.rpm[done]
+            nD[j] = nD_ws[done]
+            J[j] = J_ws[done]
+            CT[j] = CT_ws[done]
+            thrust[j] = thrust_ws[done]
+            ws.compress(~done)
+
+    # calculate power required
+    CP = b.prop_CP(J)
+    power = propeller.power(CP, nD, D, b.rho)
+
+    return struct(RPM = rpm,
+                  power = power,
+                  J = J,
+                  thrust = thrust,
+                  CP = CP,
+                  CT = CT)
+
+def calc_cruise_data(b, w, cruise, status):
+    '''vectorized calc_cruise_data: cruise power, current and endurance'''
+    c = cruise_power(backend.array, cruise.power, cruise.RPM, cruise.thrust, w.speed_mission, b.num_motors_cruise,
+                     b.motor_kV, b.motor_esr, b.motor_supply_esr, b.motor_i0_current,
+                     b.motor_i0_voltage, b.motor_torque_constant, b.batt_watt_hours)
+
+    status.fail(status.ok & (c.motor_voltage > b.batt_voltage_min),
+                'insufficient battery voltage or prop too small')
+
+    cruise.motor_current_best_eff = c.motor_current_best_eff
+    cruise.batt_power = c.batt_power
+    cruise.endurance_minutes = c.endurance_minutes
+    cruise.range_still_air = c.range_still_air
+    cruise.thrust_power = c.thrust_power
+    cruise.motor_power_out = c.motor_power_out
+    cruise.motor_power_in = c.motor_power_in
+    cruise.motor_current = c.motor_current
+
+def calc_cruise_sag(b, cruise, status):
+    '''
+    vectorized calc_cruise_sag: endurance at cruise power with voltage
+    sag, from packs with the batch's battery energies. Failed elements
+    get NaN
+    '''
+    ok = np.flatnonzero(status.ok)
+    packs = battery.battery_batch([b.battery_model[k] for k in ok], b.cell_series[ok], b.cell_parallel[ok],
+                                  b.batt_watt_hours[ok])
+    s = packs.sag_endurance(cruise.batt_power[ok])
+    def column(value):
+        c = np.full(b.size, np.nan)
+        c[ok] = value
+        return c
+    return struct(endurance_minutes = column(s.seconds / 60.0),
+                  voltage_start = column(s.voltage_start),
+                  voltage_end = column(s.voltage_end),
+                  soc_end = column(s.soc_end))
+
+def motor_params(b, i, supply_esr, speed):
+    '''
+    gather the per-element prop and motor constants used by the climb
+    and hover torque balance into a working_set for elements i
+    '''
+    D = b.prop_dia_m[i]
+    return working_set(i,
+                       D = D,
+                       kV = b.motor_kV[i],
+                       esr = b.motor_esr[i] + supply_esr[i],
+                       current_lim = b.motor_current_lim[i],
+                       i0_current = b.motor_i0_current[i],
+                       i0_voltage = b.motor_i0_voltage[i],
+                       torque_constant = b.motor_torque_constant[i],
+                       rho = b.rho[i],
+                       rpm_gain = 1000 * (speed[i] / D))
+
+def motor_torque_balance(ws, CP, supply_voltage):
+    '''
+    calculate the excess motor torque over the prop torque load for the
+    live elements of a working_set created by motor_params, at the
+    elements' current RPM. This is the inner step shared by the climb
+    and hover solvers
+    '''
+    t = motor.torque_balance(backend.array, ws.rpm, ws.D, CP, ws.rho, supply_voltage, ws.kV, ws.esr, ws.current_lim,
+                             ws.i0_current, ws.i0_voltage, ws.torque_constant)
+    t.converged = np.abs(t.excess_torque / t.prop_torque) < 0.001
+    return t
+
+def motor_torque_slope(ws, t, CP, JdCP):
+    '''
+    derivative with respect to RPM of the excess torque t returned by
+    motor_torque_balance, for the Newton solvers. JdCP is J times the
+    derivative of CP with respect to J, or zero when J is fixed
+    '''
+    return motor.torque_slope(backend.array, t, ws.rpm, ws.D, CP, JdCP, ws.rho, ws.kV, ws.esr,
+                              ws.i0_current, ws.i0_voltage, ws.torque_constant)
+
+def calc_climb(b, w, cruise, battery_voltage, status, select):
+    '''
+    vectorized calc_climb: max sustained climb rate at the given battery
+    voltage, for the elements in select
+    '''
+    speed = w.speed_mission
+
+    rpm = cruise.RPM.copy()
+    nD = np.zeros(b.size)
+    J = np.zeros(b.size)
+    motor_current = np.zeros(b.size)
+
+    i = np.flatnonzero(status.ok & select)
+    ws = motor_params(b, i, b.num_motors_cruise * b.motor_supply_esr, speed)
+    ws.add(rpm = rpm[i],
+           speed = speed[i],
+           voltage = battery_voltage[i],
+           J_min = b.prop_J_min[i],
+           J_max = b.prop_J_max[i],
+           CP = b.prop_CP[i])
+
+    counter = 0
+    while ws.size() > 0:
+        nD_ws = (ws.rpm / 60) * ws.D
+        J_ws = np.maximum(np.minimum(ws.speed / nD_ws, ws.J_max), ws.J_min)
+        t = motor_torque_balance(ws, ws.CP(J_ws), ws.voltage)
+
+        # increment RPM proportional to excess torque coefficient
+        ws.rpm = ws.rpm + ws.rpm_gain * t.excess_CQ
+
+        # check for convergence, recording converged elements
+        counter += 1
+        done = t.converged
+        if counter > climb_max_iterations:
+            status.fail(~done, 'full battery climb calculation failed to converge', ws.idx)
+            done[:] = True
+        if done.any():
+            j = ws.idx[done]
+            rpm[j] = ws.rpm[done]
+            nD[j] = nD_ws[done]
+            J[j] = J_ws[done]
+            motor_current[j] = t.motor_current[done]
+            ws.compress(~done)
+
+    return climb_result(b, w, rpm, nD, J, motor_current)
+
+def climb_result(b, w, rpm, nD, J, motor_current):
+    '''calculate climb rate using mission speed from the solved climb condition'''
+    CT = b.prop_CT(J)
+    thrust_climb = b.num_motors_cruise * propeller.thrust(CT, nD, b.prop_dia_m, b.rho)
+    climb_rate = calc_climb_rate(backend.array, thrust_climb, w.drag_max_endurance, b.mass_auw, w.speed_mission)
+
+    return struct(RPM = rpm,
+                  climb_rate = climb_rate,
+                  motor_current = motor_current)
+
+def calc_hover(b, w, cruise, battery_voltage, status, select):
+    '''
+    vectorized calc_hover: supply voltage and armature current required
+    to hover with the given battery voltage, for the elements in select
+    '''
+    D = b.prop_dia_m
+    speed = w.speed_mission
+    weight = b.mass_auw * gravity
+    J0 = np.zeros(b.size)
+
+    supply_voltage = battery_voltage.copy()
+    CP_test = b.prop_CP(J0)
+    CT_test = b.prop_CT(J0)
+    rpm = (2/3.0) * supply_voltage * b.motor_kV
+    nD = np.zeros(b.size)
+    emf = np.zeros(b.size)
+    motor_current = np.zeros(b.size)
+    thrust = np.zeros(b.size)
+
+    thrust_active = status.ok & select
+    thrust_counter = 0
+    while thrust_active.any():
+        # solve the torque balance at the current supply voltage
+        i = np.flatnonzero(thrust_active)
+        ws = motor_params(b, i, J0, speed)
+        ws.add(rpm = rpm[i],
+               voltage = supply_voltage[i],
+               CP = CP_test[i])
+
+        torque_counter = 0
+        while ws.size() > 0:
+            t = motor_torque_balance(ws, ws.CP, ws.voltage)
+
+            # increment RPM proportional to excess torque coefficient
+            ws.rpm = ws.rpm + ws.rpm_gain * t.excess_CQ
+
+            torque_counter += 1
+            done = t.converged
+            if torque_counter > hover_max_iterations:
+                status.fail(~done, 'hover test torque failed to converge', ws.idx)
+                thrust_active[ws.idx[~done]] = False
+                done[:] = True
+            if done.any():
+                j = ws.idx[done]
+                rpm[j] = ws.rpm[done]
+                nD[j] = t.nD[done]
+                emf[j] = t.emf[done]
+                motor_current[j] = t.motor_current[done]
+                ws.compress(~done)
+
+        # calculate thrust from test and adjust the supply voltage
+        i = np.flatnonzero(thrust_active)
+        thrust[i] = propeller.thrust(CT_test[i], nD[i], D[i], b.rho[i])
+        thrust_error = (thrust[i] * b.num_motors_hover[i]) - weight[i]
+        supply_voltage[i] = supply_voltage[i] * (1.0 - 0.1*thrust_error/weight[i])
+
+        # check for convergence
+        thrust_counter += 1
+        thrust_active[i[np.abs(thrust_error) < (0.01 * weight[i])]] = False
+        if thrust_counter > hover_max_iterations:
+            status.fail(thrust_active, 'hover test thrust failed to converge')
+            break
+
+    return hover_result(b, w, cruise, rpm, supply_voltage, emf, motor_current, thrust)
+
+def hover_result(b, w, cruise, rpm, supply_voltage, emf, motor_current, thrust):
+    '''record power supply requirements and endurance from the solved hover condition'''
+    motor_voltage = motor_current * b.motor_esr + emf
+    motor_power = motor_current * motor_voltage
+
+    corrected_endurance_minutes, corrected_range = hover_endurance(
+        b.batt_watt_hours, motor_power, b.num_motors_hover, b.hover_time, cruise.batt_power, w.speed_mission)
+
+    return struct(RPM = rpm,
+                  thrust_grams = thrust / gravity * 1000,
+                  voltage = supply_voltage,
+                  motor_voltage = motor_voltage,
+                  motor_current = motor_current,
+                  motor_power = motor_power,
+                  corrected_endurance_minutes = corrected_endurance_minutes,
+                  corrected_range = corrected_range)
+
+def calc_cruise_RPM_newton(b, w, status, select):
+    '''
+    calc_cruise_RPM using vectorized safeguarded Newton iteration on the
+    thrust balance, for the elements in select
+    '''
+    D = b.prop_dia_m
+    speed = w.speed_mission
+
+    rpm = 60 * (speed / b.prop_best_J) / D
+    nD = np.zeros(b.size)
+    J = np.zeros(b.size)
+    CT = np.zeros(b.size)
+    thrust = np.zeros(b.size)
+
+    i = np.flatnonzero(status.ok & select)
+    ws = working_set(i,
+                     rpm = rpm[i],
+                     lower = np.zeros(len(i)),
+                     upper = np.full(len(i), np.inf),
+                     D = D[i],
+                     speed = speed[i],
+                     drag = w.drag_max_endurance[i],
+                     n_motors = b.num_motors_cruise[i],
+                     J_min = b.prop_J_min[i],
+                     J_max = b.prop_J_max[i],
+                     rho = b.rho[i],
+                     CT = b.prop_CT[i],
+                     dCT = b.prop_dCT[i])
+    counter = 0
+    while ws.size() > 0:
+        # calculate advance ratio, J falls as RPM rises
+        nD_ws = (ws.rpm / 60) * ws.D
+        J_ws = ws.speed / nD_ws
+        dCT_ws = np.where((J_ws >= ws.J_min) & (J_ws <= ws.J_max), ws.dCT(J_ws), 0.0)
+        J_ws = np.maximum(np.minimum(J_ws, ws.J_max), ws.J_min)
+
+        CT_ws = ws.CT(J_ws)
+        thrust_ws = propeller.thrust(CT_ws, nD_ws, ws.D, ws.rho)
+        dthrust = propeller.thrust(2.0 * CT_ws - J_ws * dCT_ws, nD_ws, ws.D, ws.rho) / ws.rpm
+        thrust_error = ws.n_motors * thrust_ws - ws.drag
+        rpm_next = solver.newton_step_array(ws.rpm, thrust_error, ws.n_motors * dthrust, ws.lower, ws.upper, True)
+
+        counter += 1
+        done = np.abs(thrust_error) < (0.001 * ws.drag)
+        if counter > cruise_max_iterations:
+            status.fail(~done, 'endurance prop calculation could not converge', ws.idx)
+            done[:] = True
+        if done.any():
+            j = ws.idx[done]
+            rpm[j] = ws.rpm[done]
+            nD[j] = nD_ws[done]
+            J[j] = J_ws[done]
+            CT[j] = CT_ws[done]
+            thrust[j] = thrust_ws[done]
+        ws.rpm = rpm_next
+        ws.compress(~done)
+
+    CP = b.prop_CP(J)
+    return struct(RPM = rpm,
+                  power = propeller.power(CP, nD, D, b.rho),
+                  J = J,
+                  thrust = thrust,
+                  CP = CP,
+                  CT = CT)
+
+def calc_climb_newton(b, w, cruise, battery_voltage, status, select):
+    '''
+    calc_climb using vectorized safeguarded Newton iteration on the
+    torque balance, for the elements in select
+    '''
+    speed = w.speed_mission
+    rpm = cruise.RPM.copy()
+    nD = np.zeros(b.size)
+    J = np.zeros(b.size)
+    motor_current = np.zeros(b.size)
+
+    i = np.flatnonzero(status.ok & select)
+    ws = motor_params(b, i, b.num_motors_cruise * b.motor_supply_esr, speed)
+    ws.add(rpm = rpm[i],
+           lower = np.zeros(len(i)),
+           upper = np.full(len(i), np.inf),
+           speed = speed[i],
+           voltage = battery_voltage[i],
+           J_min = b.prop_J_min[i],
+           J_max = b.prop_J_max[i],
+           CP = b.prop_CP[i],
+           dCP = b.prop_dCP[i])
+
+    counter = 0
+    while ws.size() > 0:
+        nD_ws = (ws.rpm / 60) * ws.D
+        J_ws = ws.speed / nD_ws
+        JdCP = np.where((J_ws >= ws.J_min) & (J_ws <= ws.J_max), J_ws * ws.dCP(J_ws), 0.0)
+        J_ws = np.maximum(np.minimum(J_ws, ws.J_max), ws.J_min)
+        CP_ws = ws.CP(J_ws)
+        t = motor_torque_balance(ws, CP_ws, ws.voltage)
+        slope = motor_torque_slope(ws, t, CP_ws, JdCP)
+        rpm_next = solver.newton_step_array(ws.rpm, t.excess_torque, slope, ws.lower, ws.upper, False)
+
+        counter += 1
+        done = t.converged
+        if counter > climb_max_iterations:
+            status.fail(~done, 'full battery climb calculation failed to converge', ws.idx)
+            done[:] = True
+        if done.any():
+            j = ws.idx[done]
+            rpm[j] = ws.rpm[done]
+            nD[j] = nD_ws[done]
+            J[j] = J_ws[done]
+            motor_current[j] = t.motor_current[done]
+        ws.rpm = rpm_next
+        ws.compress(~done)
+
+    return climb_result(b, w, rpm, nD, J, motor_current)
+
+def calc_hover_newton(b, w, cruise, battery_voltage, status, select):
+    '''
+    calc_hover using nested vectorized safeguarded Newton iterations, on
+    supply voltage for the thrust balance and on RPM for the torque
+    balance, for the elements in select
+    '''
+    J0 = np.zeros(b.size)
+    CP_test = b.prop_CP(J0)
+    CT_test = b.prop_CT(J0)
+
+    supply_voltage = battery_voltage.copy()
+    rpm = (2/3.0) * supply_voltage * b.motor_kV
+    emf = np.zeros(b.size)
+    motor_current = np.zeros(b.size)
+    thrust = np.zeros(b.size)
+
+    i = np.flatnonzero(status.ok & select)
+    ws = motor_params(b, i, J0, w.speed_mission)
+    ws.add(rpm = rpm[i],
+           voltage = supply_voltage[i],
+           voltage_lower = np.zeros(len(i)),
+           voltage_upper = np.full(len(i), np.inf),
+           CP = CP_test[i],
+           CT = CT_test[i],
+           weight = b.mass_auw[i] * gravity,
+           n_motors = b.num_motors_hover[i])
+
+    thrust_counter = 0
+    while ws.size() > 0:
+        # solve the torque balance at the current supply voltages, warm
+        # started from the previous RPM. Converged elements are held
+        rpm_lower = np.zeros(ws.size())
+        rpm_upper = np.full(ws.size(), np.inf)
+        torque_counter = 0
+        while True:
+            t = motor_torque_balance(ws, ws.CP, ws.voltage)
+            slope = motor_torque_slope(ws, t, ws.CP, 0.0)
+            torque_counter += 1
+            if t.converged.all() or torque_counter > hover_max_iterations:
+                break
+            rpm_next = solver.newton_step_array(ws.rpm, t.excess_torque, slope, rpm_lower, rpm_upper, False)
+            ws.rpm = np.where(t.converged, ws.rpm, rpm_next)
+        failed = ~t.converged
+        status.fail(failed, 'hover test torque failed to converge', ws.idx)
+
+        # d(rpm)/d(voltage) holding the torque balance at zero
+        dexcess_dvoltage = np.where(t.current_limited, 0.0, ws.torque_constant / ws.esr)
+        drpm_dvoltage = -dexcess_dvoltage / slope
+
+        thrust_ws = propeller.thrust(ws.CT, t.nD, ws.D, ws.rho)
+        thrust_error = thrust_ws * ws.n_motors - ws.weight
+        dthrust = 2.0 * thrust_ws / ws.rpm * drpm_dvoltage * ws.n_motors
+        voltage_next = solver.newton_step_array(ws.voltage, thrust_error, dthrust, ws.voltage_lower, ws.voltage_upper, True)
+
+        # once the motor current is limited more voltage gives no more
+        # thrust, so there is no hover solution
+        limited = ~failed & t.current_limited & (thrust_error < -0.01 * ws.weight)
+        status.fail(limited, 'hover test thrust failed to converge', ws.idx)
+        failed |= limited
+
+        thrust_counter += 1
+        done = ~failed & (np.abs(thrust_error) < (0.01 * ws.weight))
+        if thrust_counter > hover_max_iterations:
+            status.fail(~done & ~failed, 'hover test thrust failed to converge', ws.idx)
+            done[:] = True
+        if done.any():
+            j = ws.idx[done]
+            rpm[j] = ws.rpm[done]
+            supply_voltage[j] = ws.voltage[done]
+            emf[j] = t.emf[done]
+            motor_current[j] = t.motor_current[done]
+            thrust[j] = thrust_ws[done]
+        ws.voltage = voltage_next
+        ws.compress(~done & ~failed)
+
+    return hover_result(b, w, cruise, rpm, supply_voltage, emf, motor_current, thrust)
+
+def merge(select, a, b):
+    '''return a structure taking each array from a where select is True, and from b elsewhere'''
+    return struct(**dict((k, np.where(select, v, b.__dict__[k])) for (k, v) in a.__dict__.items()))
+
+def evaluate(b, sag=False):
+    '''
+    evaluate a config_batch, returning a structure of per-element
+    result arrays. Elements that fail have ok set to False and the
+    scalar model's error message in errors. The cruise endurance with
+    voltage sag, for sag_output_fields, is only found if sag is True,
+    and cruise.sag is None otherwise
+    '''
+    status = batch_status(b.size)
+    status.fail((b.cell_series < 1) | (b.cell_parallel < 1), battery.cell_count_error)
+    status.fail(b.num_motors_total > b.num_motors_hover + b.num_motors_cruise,
+                "Total number of motors higher than sum of cruise and hover")
+    status.fail(~atmosphere.in_range(b.altitude, b.temp_offset), atmosphere.range_error)
+
+    b.mass_propulsion = b.num_motors_total*(b.motor_mass + b.prop_mass)
+    b.mass_auw = b.batt_mass + b.mass_avionics + b.mass_payload + b.mass_propulsion + b.mass_structure
+
+    w = calc_wing(b)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        newton = b.newton
+        relax = ~newton
+        cruise = merge(newton,
+                       calc_cruise_RPM_newton(b, w, status, newton),
+                       calc_cruise_RPM(b, w, status, relax))
+        calc_cruise_data(b, w, cruise, status)
+        climb_max = merge(newton,
+                          calc_climb_newton(b, w, cruise, b.batt_voltage_max, status, newton),
+                          calc_climb(b, w, cruise, b.batt_voltage_max, status, relax))
+        climb_min = merge(newton,
+                          calc_climb_newton(b, w, cruise, b.batt_voltage_min, status, newton),
+                          calc_climb(b, w, cruise, b.batt_voltage_min, status, relax))
+        hover = merge(newton,
+                      calc_hover_newton(b, w, cruise, b.batt_voltage_min, status, newton),
+                      calc_hover(b, w, cruise, b.batt_voltage_min, status, relax))
+    cruise.sag = calc_cruise_sag(b, cruise, status) if sag else None
+
+    return struct(ok = status.ok,
+                  errors = status.errors,
+                  mass_auw = b.mass_auw,
+                  mass_batt = b.batt_mass,
+                  mass_propulsion = b.mass_propulsion,
+                  batt_voltage_min = b.batt_voltage_min,
+                  wing = w,
+                  cruise = cruise,
+                  climb_max = climb_max,
+                  climb_min = climb_min,
+                  hover = hover)
+
+# per-configuration outputs of an evaluate() result, as (name, function
+# returning the output array)
+output_fields = [
+    ('mass_auw', lambda r: r.mass_auw),
+    ('mass_batt', lambda r: r.mass_batt),
+    ('mass_propulsion', lambda r: r.mass_propulsion),
+    ('speed_stall', lambda r: r.wing.speed_stall),
+    ('speed_mission', lambda r: r.wing.speed_mission),
+    ('LD_max', lambda r: r.wing.LD_max),
+    ('LD_mission', lambda r: r.wing.LD_mission),
+    ('cruise_RPM', lambda r: r.cruise.RPM),
+    ('cruise_power', lambda r: r.cruise.power),
+    ('cruise_J', lambda r: r.cruise.J),
+    ('cruise_batt_power', lambda r: r.cruise.batt_power),
+    ('cruise_motor_current', lambda r: r.cruise.motor_current),
+    ('endurance_minutes', lambda r: r.cruise.endurance_minutes),
+    ('range_km', lambda r: r.cruise.range_still_air/1000.0),
+    ('hover_endurance_minutes', lambda r: r.hover.corrected_endurance_minutes),
+    ('hover_range_km', lambda r: r.hover.corrected_range/1000.0),
+    ('climb_rate_max', lambda r: r.climb_max.climb_rate),
+    ('climb_rate_min', lambda r: r.climb_min.climb_rate),
+    ('hover_RPM', lambda r: r.hover.RPM),
+    ('hover_throttle', lambda r: r.hover.voltage/r.batt_voltage_min),
+    ('hover_motor_current', lambda r: r.hover.motor_current),
+    ('hover_thrust_grams', lambda r: r.hover.thrust_grams),
+]
+
+# outputs of an evaluate() result made with sag=True, as for output_fields
+sag_output_fields = [
+    ('sag_endurance_minutes', lambda r: r.cruise.sag.endurance_minutes),
+]
+
+def result_fields(sag=False):
+    '''return the output fields of an evaluate() result, with sag_output_fields if sag is True'''
+    return output_fields + sag_output_fields if sag else output_fields
+
+def output_rows(r, fields=output_fields):
+    '''
+    return a list of output value lists for an evaluate() result, one
+    per element in the order of fields. Failed elements get None values
+    '''
+    rows = np.column_stack([f(r) for (name, f) in fields]).tolist()
+    for k in np.flatnonzero(~r.ok):
+        rows[k] = [None] * len(fields)
+    return rows
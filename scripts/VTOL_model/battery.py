@@ -4,18 +4,54 @@
 battery model class
 '''
 
-from util import error
+from util import model_error, struct
 
 batteries = {}
 
+# discharge() steps through time one step at a time for batches of at
+# least this many packs, where the per step overhead is small next to
+# the work, and sweeps over the whole flight at once for fewer packs
+discharge_step_packs = 64
+
+# state of charge intervals of the grid sag_endurance() integrates
+# over, a multiple of 20 so every point of the OCV tables is on the grid
+sag_soc_steps = 200
+
+# packs sag_endurance() integrates together, bounding its memory
+sag_block_packs = 1024
+
+cell_count_error = 'battery needs at least one cell in series and one in parallel'
+
+def current_for_power(xp, ocv, resistance, power):
+    '''
+    return the current that delivers power watts at the terminals of a
+    pack with open circuit voltage ocv and internal resistance
+    resistance, solving (ocv - I R) I = P on backend xp. Packs that
+    can't deliver the power get NaN
+    '''
+    disc = ocv*ocv - 4.0 * resistance * power
+    current = 2.0 * power / (ocv + xp.sqrt(xp.maximum(disc, 0.0)))
+    return xp.where(disc >= 0, current, float('nan'))
+
 class battery_cell(object):
-    def __init__(self, energy_density, mass, voltage_max, voltage_min, packaging_factor, age_factor):
+    def __init__(self, energy_density, mass, voltage_max, voltage_min, packaging_factor, age_factor,
+                 ocv_table, resistance):
         self.energy_density = energy_density     # Wh/Kg
         self.mass = mass                         # Kg
         self.voltage_max = voltage_max           # Volts
         self.voltage_min = voltage_min           # Volts
         self.packaging_factor = packaging_factor # extra mass ratio due to packaging
         self.age_factor = age_factor             # reduction in Gravimetric energy due to aging
+        self.ocv_table = ocv_table               # open circuit voltage by state of charge, as (SOC, Volts) pairs
+        self.resistance = resistance             # internal resistance, Ohms
+
+    def get_mean_ocv(self):
+        '''return the open circuit voltage averaged over the state of charge'''
+        total = 0.0
+        for k in range(1, len(self.ocv_table)):
+            (s0, v0), (s1, v1) = self.ocv_table[k-1], self.ocv_table[k]
+            total += 0.5 * (v0 + v1) * (s1 - s0)
+        return total
 
 ###################################
 # battery setup for 5Ah 6S nanotech
@@ -25,7 +61,10 @@ batteries['5Ah_6S_Nanotech'] = battery_cell(
     voltage_max = 4.15,
     voltage_min = 3.1,
     packaging_factor = 1.0,
-    age_factor = 0.85)
+    age_factor = 0.85,
+    ocv_table = [(0.0, 3.1), (0.05, 3.45), (0.1, 3.6), (0.2, 3.7), (0.3, 3.74), (0.4, 3.77),
+                 (0.5, 3.8), (0.6, 3.84), (0.7, 3.9), (0.8, 3.97), (0.9, 4.05), (1.0, 4.15)],
+    resistance = 0.004)
 
 ###########################################
 # cell model for Panasonic NCR18650GA cells
@@ -35,7 +74,10 @@ batteries['NCR18650GA'] = battery_cell(
     voltage_max = 4.15,
     voltage_min = 2.7,
     packaging_factor = 0.9,
-    age_factor = 0.85)
+    age_factor = 0.85,
+    ocv_table = [(0.0, 2.7), (0.05, 3.1), (0.1, 3.3), (0.2, 3.45), (0.3, 3.55), (0.4, 3.62),
+                 (0.5, 3.7), (0.6, 3.78), (0.7, 3.87), (0.8, 3.96), (0.9, 4.05), (1.0, 4.15)],
+    resistance = 0.035)
 
 
 class battery(object):
@@ -43,7 +85,9 @@ class battery(object):
 
     def __init__(self, battery_type, n_series, n_parallel):
         if battery_type not in batteries:
-            error("Unknown battery type %s. Choices are %s" % (battery_type, batteries.keys()))
+            raise model_error("Unknown battery type %s. Choices are %s" % (battery_type, batteries.keys()))
+        if n_series < 1 or n_parallel < 1:
+            raise model_error(cell_count_error)
         self.battery_type = battery_type
         self.cell_series_count = n_series
         self.cell_parallel_count = n_parallel
@@ -82,3 +126,249 @@ class battery(object):
     def get_watt_hours(self):
         '''return battery capacity in Watt hours'''
         return self.get_mass() * self.get_energy_density()
+
+    def get_capacity_Ah(self):
+        '''return battery capacity in Amp hours, consistent with get_watt_hours() over the OCV curve'''
+        return self.get_watt_hours() / (self.cell.get_mean_ocv() * self.cell_series_count)
+
+    def get_resistance(self):
+        '''return pack internal resistance in Ohms'''
+        return self.cell.resistance * self.cell_series_count / self.cell_parallel_count
+
+    def discharge(self, power, dt, soc_start=1.0):
+        '''
+        discharge the battery with power watts for steps of dt seconds,
+        returning per step arrays as for battery_batch.discharge
+        '''
+        b = battery_batch([self.battery_type], [self.cell_series_count], [self.cell_parallel_count])
+        r = b.discharge(power, dt, soc_start)
+        return struct(soc = r.soc[:,0],
+                      voltage = r.voltage[:,0],
+                      current = r.current[:,0],
+                      empty = r.empty[:,0],
+                      end_step = int(r.end_step[0]))
+
+    def sag_endurance(self, power):
+        '''
+        return the endurance in seconds at a constant power watts with
+        voltage sag, as for battery_batch.sag_endurance
+        '''
+        b = battery_batch([self.battery_type], [self.cell_series_count], [self.cell_parallel_count])
+        r = b.sag_endurance(power)
+        return struct(seconds = float(r.seconds[0]),
+                      voltage_start = float(r.voltage_start[0]),
+                      voltage_end = float(r.voltage_end[0]),
+                      soc_end = float(r.soc_end[0]))
+
+class battery_batch(object):
+    '''
+    many battery packs as arrays, with a state of charge model: open
+    circuit voltage interpolated from the cell's OCV table, and voltage
+    sag across the internal resistance
+    '''
+
+    def __init__(self, battery_types, n_series, n_parallel, watt_hours=None):
+        '''
+        packs of battery_types cells with n_series and n_parallel cells.
+        watt_hours, if given, replaces the catalogue energy of each pack,
+        as for batches with varied cell parameters
+        '''
+        import numpy as np
+        keys = list(zip(battery_types, n_series, n_parallel))
+        unique = sorted(set(keys))
+        rows = dict((key, i) for i, key in enumerate(unique))
+        idx = np.array([rows[key] for key in keys], dtype=int)
+        packs = [battery(t, s, p) for (t, s, p) in unique]
+        def column(getter):
+            return np.array([getter(p) for p in packs], dtype=float)[idx]
+        self.size = len(keys)
+        self.battery_type = list(battery_types)
+        self.n_series = np.array(n_series, dtype=float)
+        self.resistance = column(lambda p: p.get_resistance())
+        self.voltage_min = column(lambda p: p.get_voltage_min())
+        self.voltage_max = column(lambda p: p.get_voltage_max())
+        if watt_hours is None:
+            self.watt_hours = column(lambda p: p.get_watt_hours())
+            self.capacity_Ah = column(lambda p: p.get_capacity_Ah())
+        else:
+            # as battery.get_capacity_Ah()
+            self.watt_hours = np.array(watt_hours, dtype=float)
+            self.capacity_Ah = self.watt_hours / (column(lambda p: p.cell.get_mean_ocv()) * self.n_series)
+        # packs grouped by cell type, for interpolating each OCV table once
+        self.groups = [(batteries[t], np.array([k for k in range(self.size) if self.battery_type[k] == t]))
+                       for t in sorted(set(self.battery_type))]
+
+    def ocv(self, soc):
+        '''return pack open circuit voltages for soc, an array with packs on the last axis'''
+        import numpy as np
+        soc = np.asarray(soc, dtype=float)
+        soc = np.broadcast_to(soc, np.broadcast_shapes(soc.shape, (self.size,)))
+        v = np.empty(soc.shape)
+        for (cell, idx) in self.groups:
+            table_soc = [x[0] for x in cell.ocv_table]
+            table_v = [x[1] for x in cell.ocv_table]
+            v[...,idx] = np.interp(soc[...,idx], table_soc, table_v)
+        return v * self.n_series
+
+    def terminal_voltage(self, soc, current):
+        '''return pack terminal voltages while delivering current amps'''
+        return self.ocv(soc) - current * self.resistance
+
+    def current_for_power(self, soc, power):
+        '''
+        return the pack current that delivers power watts at the
+        terminals, solving (ocv - I R) I = P. Packs that can't deliver
+        the power get NaN
+        '''
+        import backend
+        return current_for_power(backend.array, self.ocv(soc), self.resistance, power)
+
+    def discharge(self, power, dt, soc_start=1.0, tolerance=1.0e-9):
+        '''
+        integrate the state of charge over a flight, with power an array
+        of watts of shape (steps, packs) or (steps,) for the same power
+        from every pack, and steps of dt seconds (a
+        scalar or per step array). The current of each step comes from
+        the state of charge at its start.
+
+        For small batches the whole flight is stepped at once: the state
+        of charge is found by repeated sweeps over every step, each
+        computing all the currents from the previous sweep's state of
+        charge and accumulating charge with a cumulative sum. Sweep k
+        gets the first k steps exactly, and as the current depends only
+        weakly on the state of charge the sweeps usually settle in about
+        ten. Large batches are stepped through time with arrays over the
+        packs, which gives the same result
+
+        returns per step arrays of the state of charge at the end of
+        the step, terminal voltage and current, a mask of steps where
+        the pack is empty (below minimum voltage, out of charge or
+        unable to deliver the power) and the first empty step of each
+        pack, or the number of steps if it never empties
+        '''
+        import numpy as np
+        power = np.asarray(power, dtype=float)
+        steps = power.shape[0]
+        if steps == 0:
+            return struct(soc = np.empty((0, self.size)),
+                          voltage = np.empty((0, self.size)),
+                          current = np.empty((0, self.size)),
+                          empty = np.empty((0, self.size), dtype=bool),
+                          end_step = np.zeros(self.size, dtype=int))
+        power = np.broadcast_to(power.reshape(steps, -1), (steps, self.size))
+        dt = np.broadcast_to(np.asarray(dt, dtype=float).reshape(-1, 1) if np.ndim(dt) else dt, (steps, 1))
+        soc_start = np.broadcast_to(np.asarray(soc_start, dtype=float), (self.size,))
+        coulombs = self.capacity_Ah * 3600.0
+
+        if self.size >= discharge_step_packs:
+            soc = np.empty(power.shape)
+            s = soc_start
+            for k in range(steps):
+                current = self.current_for_power(np.maximum(s, 0.0), power[k])
+                s = s - np.nan_to_num(current, nan=0.0) * dt[k] / coulombs
+                soc[k] = s
+            sweeps = 0
+        else:
+            soc = np.broadcast_to(soc_start, power.shape).copy()
+            sweeps = steps + 1
+        for sweep in range(sweeps):
+            before = np.vstack([soc_start[None,:], soc[:-1]])
+            current = self.current_for_power(np.maximum(before, 0.0), power)
+            new_soc = soc_start - np.cumsum(np.nan_to_num(current, nan=0.0) * dt, axis=0) / coulombs
+            change = np.max(np.abs(new_soc - soc)) if new_soc.size else 0.0
+            soc = new_soc
+            if change < tolerance:
+                break
+
+        before = np.vstack([soc_start[None,:], soc[:-1]])
+        current = self.current_for_power(np.maximum(before, 0.0), power)
+        voltage = self.terminal_voltage(np.maximum(before, 0.0), current)
+        with np.errstate(invalid='ignore'):
+            empty = np.isnan(current) | (voltage < self.voltage_min) | (before <= 0.0)
+        empty = np.logical_or.accumulate(empty, axis=0)
+        end_step = np.where(empty.any(axis=0), np.argmax(empty, axis=0), steps)
+        return struct(soc = soc,
+                      voltage = voltage,
+                      current = current,
+                      empty = empty,
+                      end_step = end_step)
+
+    def sag_endurance(self, power):
+        '''
+        return the time each pack can deliver a constant power watts,
+        an array over the packs or a scalar for all, until it is empty
+        as for discharge(). Rather than stepping through time this
+        integrates dt = Q dsoc / I(soc) down a fixed state of charge grid
+        from full to where the pack empties, found by interpolating the
+        terminal voltage down to the minimum between grid points. The
+        open circuit voltage of each cell type is tabulated on the grid
+        once, and packs are done sag_block_packs at a time with arrays of
+        shape (grid, packs), so the cost doesn't depend on the endurance
+        and the memory doesn't grow with the batch.
+
+        returns per pack arrays of the endurance in seconds, the
+        terminal voltage at the start and end, and the state of charge
+        left when empty
+        '''
+        import numpy as np
+        power = np.broadcast_to(np.asarray(power, dtype=float), (self.size,))
+        soc = np.linspace(0.0, 1.0, sag_soc_steps + 1)
+        table = np.empty((len(soc), len(self.groups)))
+        cell_index = np.empty(self.size, dtype=int)
+        for g, (cell, idx) in enumerate(self.groups):
+            table[:,g] = np.interp(soc, [x[0] for x in cell.ocv_table], [x[1] for x in cell.ocv_table])
+            cell_index[idx] = g
+        r = struct(seconds = np.empty(self.size),
+                   voltage_start = np.empty(self.size),
+                   voltage_end = np.empty(self.size),
+                   soc_end = np.empty(self.size))
+        for start in range(0, self.size, sag_block_packs):
+            packs = slice(start, start + sag_block_packs)
+            ocv = table[:,cell_index[packs]] * self.n_series[packs]
+            block = self.sag_block(soc, ocv, self.resistance[packs], self.voltage_min[packs], power[packs])
+            for (name, value) in block.__dict__.items():
+                getattr(r, name)[packs] = value
+        r.seconds *= self.capacity_Ah * 3600.0
+        return r
+
+    def sag_block(self, soc, ocv, resistance, voltage_min, power):
+        '''
+        sag_endurance() for a block of packs with open circuit voltages
+        ocv on the grid soc, returning the endurance in units of the
+        pack capacity
+        '''
+        import numpy as np
+        import backend
+        n = ocv.shape[1]
+        current = current_for_power(backend.array, ocv, resistance, power)
+        voltage = ocv - current * resistance
+        with np.errstate(invalid='ignore'):
+            empty = np.isnan(current) | (voltage < voltage_min)
+        empty[0] = True
+        # the terminal voltage rises with the state of charge, so each
+        # pack is empty up to a grid point j, always at least the first
+        # point, and usable above it. It can't deliver the power at all
+        # if it is empty at the top
+        j = sag_soc_steps - np.argmax(empty[::-1], axis=0)
+        usable = j < sag_soc_steps
+        k = np.minimum(j + 1, sag_soc_steps)
+        packs = np.arange(n)
+        v0, v1 = voltage[j,packs], voltage[k,packs]
+        i0, i1 = current[j,packs], current[k,packs]
+        ds = 1.0 / sag_soc_steps
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # the pack empties a fraction f of the way from j to k
+            crossing = usable & np.isfinite(v0) & (v0 < voltage_min)
+            f = np.where(crossing, (voltage_min - v0) / (v1 - v0), 1.0)
+            i_end = np.where(crossing, i0 + f * (i1 - i0), i1)
+            # 1/I above j, cumulated from the top so the trapezoid sum
+            # from j+1 up is a lookup
+            inv = 1.0 / current
+            inv[np.arange(sag_soc_steps + 1)[:,None] <= j] = 0.0
+            full = (np.sum(inv, axis=0) - 0.5 * (inv[k,packs] + inv[-1])) * ds
+            full = np.where(usable, full, 0.0)
+            partial = np.where(crossing, 0.5 * (1.0 / i_end + 1.0 / i1) * (1.0 - f) * ds, 0.0)
+        return struct(seconds = full + partial,
+                      voltage_start = voltage[-1],
+                      voltage_end = np.where(crossing, voltage_min, v1),
+                      soc_end = np.where(usable, soc[j] + f * ds, 1.0))
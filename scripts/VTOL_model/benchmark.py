@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+'''
+benchmarks for the VTOL model hot paths
+
+times propeller construction, find_best_ETA, the cruise RPM, climb and
+hover solvers, whole configuration evaluation and batch evaluation over
+a fixed corpus covering every prop in prop_data.py and every motor and
+battery, for each solver type. Reports evaluations per second, solver
+iteration counts and peak traced memory per stage.
+
+results can be saved as JSON with --output and compared against an
+earlier run with --compare, failing if any stage is slower by more than
+--threshold, for example
+  benchmark.py --output before.json
+  benchmark.py --compare before.json --threshold 0.1
+
+released under GPLv3
+'''
+
+import optparse
+import itertools
+import json
+import time
+import tracemalloc
+import platform
+import sys
+import numpy as np
+import prop_data
+import propeller
+import motor
+import battery
+import wing
+import solver
+import batch
+import vtol_model
+from util import *
+
+# prop diameters in inches used for every prop in the corpus
+corpus_diameters = [9.0, 11.0, 13.0]
+
+def make_corpus():
+    '''return the benchmark configurations, every prop, motor, battery and diameter at the default options'''
+    return [vtol_model.vtol_config(prop_model=p, motor_type=m, battery_model=b, prop_diameter=d)
+            for (p, m, b, d) in itertools.product(sorted(prop_data.propellers), sorted(motor.motors),
+                                                  sorted(battery.batteries), corpus_diameters)]
+
+def prepare(config, solver_type):
+    '''
+    run the stages of vtol_model.evaluate for a configuration, keeping
+    the inputs each stage needs. Stages after a failure are left unset
+    '''
+    solve_cruise_RPM = vtol_model.get_solver_functions(solver_type)[0]
+    c = struct(config = config, cruise = None)
+    c.prop = propeller.propeller(config.prop_model, config.prop_diameter)
+    c.battery = battery.battery(config.battery_model, config.cell_series, config.cell_parallel)
+    c.motor = motor.motor(config.motor_type)
+    c.mass = vtol_model.calc_mass(config, c.prop, c.battery, c.motor)
+    c.rho = vtol_model.calc_density(config)
+    c.wing = wing.wing(config.wing_span, config.aspect_ratio, c.mass.auw, c.rho)
+    c.speed_mission = vtol_model.calc_speed_mission(c.wing, config.mission_speed)
+    c.drag = c.wing.calc_drag(c.mass.auw, c.speed_mission)
+    try:
+        cruise = solve_cruise_RPM(c.prop, c.speed_mission, c.drag, config.num_motors_cruise, c.rho)
+        vtol_model.calc_cruise_data(c.prop, c.motor, c.battery, cruise, c.speed_mission, c.drag, config.num_motors_cruise, c.rho)
+        c.cruise = cruise
+    except model_error:
+        pass
+    return c
+
+def stage_calls(solver_type, corpus, cases):
+    '''
+    return (name, list of calls, evaluations) for each benchmarked
+    stage. Each call returns the solver result, or None for stages
+    without iterations. evaluations is None for one per call
+    '''
+    solve_cruise_RPM, solve_climb, solve_hover = vtol_model.get_solver_functions(solver_type)
+    prop_models = sorted(prop_data.propellers)
+    cruising = [c for c in cases if c.cruise is not None]
+
+    def fit_prop(prop_model):
+        # a fresh fit cache so the polynomials are fitted every time
+        fits = propeller.fits
+        propeller.fits = propeller.fit_cache()
+        try:
+            propeller.propeller(prop_model, 11.0)
+        finally:
+            propeller.fits = fits
+
+    def cruise_RPM(c):
+        return solve_cruise_RPM(c.prop, c.speed_mission, c.drag, c.config.num_motors_cruise, c.rho)
+
+    def climb(c):
+        return solve_climb(c.prop, c.motor, c.cruise, c.speed_mission, c.drag, c.mass.auw,
+                           c.config.num_motors_cruise, c.battery.get_voltage_max(), c.rho)
+
+    def hover(c):
+        return solve_hover(c.prop, c.motor, c.battery, c.cruise, c.speed_mission, c.mass.auw,
+                           c.config.num_motors_hover, c.config.hover_time, c.battery.get_voltage_min(), c.rho)
+
+    def evaluate(config):
+        try:
+            vtol_model.evaluate(config)
+        except model_error:
+            pass
+
+    configs = [vtol_model.vtol_config(**dict(config.__dict__, solver=solver_type)) for config in corpus]
+    stages = [
+        ('propeller_fit', [lambda p=p: fit_prop(p) for p in prop_models]),
+        ('propeller', [lambda p=p: propeller.propeller(p, 11.0) for p in prop_models]),
+        ('find_best_ETA', [lambda p=propeller.propeller(p, 11.0): p.calc_best_ETA(0.01) for p in prop_models]),
+        ('cruise_RPM', [lambda c=c: cruise_RPM(c) for c in cases]),
+        ('climb', [lambda c=c: climb(c) for c in cruising]),
+        ('hover', [lambda c=c: hover(c) for c in cruising]),
+        ('evaluate', [lambda c=c: evaluate(c) for c in configs]),
+    ]
+    stages = [('%s/%s' % (name, solver_type), calls, None) for (name, calls) in stages]
+    stages.append(('batch/%s' % solver_type, [lambda: batch.evaluate(batch.config_batch(configs))], len(configs)))
+    return stages
+
+def run_calls(calls):
+    '''run a list of calls, returning their results, with None for calls that raise model_error'''
+    results = []
+    for call in calls:
+        try:
+            results.append(call())
+        except model_error:
+            results.append(None)
+    return results
+
+def measure(calls, repeat, evaluations=None):
+    '''time a list of calls, returning a dictionary of measurements'''
+    best = None
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        results = run_calls(calls)
+        t = time.perf_counter() - t0
+        if best is None or t < best:
+            best = t
+
+    # peak memory is traced on a separate run, as tracing slows the calls down
+    tracemalloc.start()
+    run_calls(calls)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    if evaluations is None:
+        evaluations = len(calls)
+    m = { 'evaluations' : evaluations,
+          'seconds' : best,
+          'evaluations_per_second' : evaluations / best if best > 0 else None,
+          'peak_memory_kb' : peak / 1024.0 }
+    for name in ['iterations', 'torque_iterations']:
+        counts = [getattr(r, name) for r in results if r is not None and hasattr(r, name)]
+        if counts:
+            m[name + '_mean'] = float(np.mean(counts))
+            m[name + '_max'] = int(np.max(counts))
+    return m
+
+def run_benchmarks(repeat, solvers, selected):
+    '''run the benchmarks, returning the results dictionary'''
+    corpus = make_corpus()
+    stages = {}
+    for solver_type in solvers:
+        cases = [prepare(config, solver_type) for config in corpus]
+        for (name, calls, evaluations) in stage_calls(solver_type, corpus, cases):
+            if selected and name.split('/')[0] not in selected:
+                continue
+            stages[name] = measure(calls, repeat, evaluations)
+            sys.stderr.write("%-24s %10.0f evals/s\n" % (name, stages[name]['evaluations_per_second'] or 0))
+
+    return { 'corpus_size' : len(corpus),
+             'repeat' : repeat,
+             'python' : platform.python_version(),
+             'numpy' : np.__version__,
+             'platform' : platform.platform(),
+             'stages' : stages }
+
+def print_results(results):
+    '''print a table of benchmark results'''
+    print('corpus of %u configurations, best of %u runs' % (results['corpus_size'], results['repeat']))
+    print('%-24s %8s %10s %12s %10s %8s %10s' % ('stage', 'evals', 'seconds', 'evals/s', 'iter mean', 'iter max', 'peak KB'))
+    for name in sorted(results['stages']):
+        m = results['stages'][name]
+        print('%-24s %8u %10.4f %12.1f %10s %8s %10.1f' % (
+            name, m['evaluations'], m['seconds'], m['evaluations_per_second'] or 0,
+            '%.1f' % m['iterations_mean'] if 'iterations_mean' in m else '-',
+            m.get('iterations_max', '-'), m['peak_memory_kb']))
+
+def compare(baseline, results, threshold):
+    '''
+    print the speed of each stage relative to a baseline, returning the
+    names of stages more than threshold slower
+    '''
+    regressions = []
+    print('%-24s %12s %12s %8s' % ('stage', 'baseline/s', 'current/s', 'ratio'))
+    for name in sorted(results['stages']):
+        if name not in baseline['stages']:
+            continue
+        old = baseline['stages'][name]['evaluations_per_second']
+        new = results['stages'][name]['evaluations_per_second']
+        if not old or not new:
+            continue
+        ratio = new / old
+        flag = ''
+        if ratio < 1.0 - threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print('%-24s %12.1f %12.1f %8.3f%s' % (name, old, new, ratio, flag))
+    return regressions
+
+def main():
+    parser = optparse.OptionParser("benchmark.py [options]")
+    parser.add_option("--repeat", type='int', default=3, help='runs of each stage, the fastest is kept [default: %default]')
+    parser.add_option("--solver", default=','.join(solver.solvers), help='comma separated solver types [default: %default]')
+    parser.add_option("--stages", default=None, help='comma separated stages to run [default: all]')
+    parser.add_option("--output", default=None, help='JSON file to save results in')
+    parser.add_option("--compare", default=None, help='JSON results file to compare against')
+    parser.add_option("--threshold", type='float', default=0.1, help='fractional slowdown counted as a regression [default: %default]')
+    opts, args = parser.parse_args()
+
+    solvers = opts.solver.split(',')
+    for s in solvers:
+        if s not in solver.solvers:
+            error("Unknown solver %s. Choices are %s" % (s, solver.solvers))
+    selected = opts.stages.split(',') if opts.stages else None
+
+    results = run_benchmarks(opts.repeat, solvers, selected)
+    print_results(results)
+
+    if opts.output is not None:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if opts.compare is not None:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        print(' ')
+        regressions = compare(baseline, results, opts.threshold)
+        if regressions:
+            error("%u stages slower than baseline by more than %.0f%%: %s" % (
+                len(regressions), 100 * opts.threshold, ', '.join(regressions)))
+
+if __name__ == '__main__':
+    main()
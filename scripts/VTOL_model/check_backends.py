@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+'''
+cross-check the scalar and array backends
+
+runs each physics kernel on random inputs, once on arrays with
+backend.array and once per element with backend.scalar, and checks
+that every output is identical, bit for bit. The prop polynomials of
+every prop in the catalogue are checked the same way, comparing
+propeller.get_CT() and friends against batch.polyval()
+
+  ./check_backends.py --samples 10000 --seed 1
+
+released under GPLv3
+'''
+
+import optparse
+import numpy as np
+import backend
+import propeller
+import battery
+import motor
+import wing
+import atmosphere
+import batch
+import vtol_model
+from util import *
+
+def balance_and_slope(xp, rpm, D, CP, JdCP, rho, supply_voltage, kV, esr, current_lim, i0_current, i0_voltage, torque_constant):
+    '''motor.torque_balance() followed by motor.torque_slope(), as the Newton solvers use them'''
+    t = motor.torque_balance(xp, rpm, D, CP, rho, supply_voltage, kV, esr, current_lim, i0_current, i0_voltage, torque_constant)
+    t.dexcess_torque = motor.torque_slope(xp, t, rpm, D, CP, JdCP, rho, kV, esr, i0_current, i0_voltage, torque_constant)
+    return t
+
+# kernels to check, as (name, function, input ranges). Each function
+# takes the backend followed by the inputs as keyword arguments, drawn
+# uniformly from their (lower, upper) ranges
+kernels = [
+    ('atmosphere.density', atmosphere.density,
+     dict(altitude = (atmosphere.altitude_min, atmosphere.altitude_max), temp_offset = (-40.0, 40.0))),
+    ('wing.polar', wing.polar,
+     dict(wing_span = (0.5, 5.0), aspect_ratio = (4.0, 15.0), mass_auw = (1.0, 30.0), rho = (0.4, 1.4), CD0_wing = (0.005, 0.03),
+          fus_drag_coef = (0.3, 1.2), CL_max = (0.8, 1.6), span_efficiency = (0.6, 0.95))),
+    ('wing.speed_mission', wing.speed_mission,
+     dict(speed_stall = (5.0, 20.0), speed_min_pwr = (5.0, 25.0), mission_speed_min = (0.0, 30.0))),
+    ('wing.drag_polar', wing.drag_polar,
+     dict(coef_A = (0.01, 0.5), coef_B = (10.0, 1000.0), speed_min_drag = (5.0, 30.0),
+          mass_auw = (1.0, 30.0), speed_mission = (5.0, 40.0))),
+    ('propeller.thrust', lambda xp, **a: propeller.thrust(**a),
+     dict(CT = (0.0, 0.15), nD = (10.0, 100.0), D = (0.15, 0.5), rho = (0.4, 1.4))),
+    ('propeller.power', lambda xp, **a: propeller.power(**a),
+     dict(CP = (0.0, 0.1), nD = (10.0, 100.0), D = (0.15, 0.5), rho = (0.4, 1.4))),
+    ('motor.io_current', lambda xp, **a: motor.io_current(**a),
+     dict(rpm = (1000.0, 12000.0), i0_current = (0.2, 1.5), i0_voltage = (8.0, 12.0), kV = (200.0, 600.0))),
+    ('motor.torque_balance', balance_and_slope,
+     dict(rpm = (1000.0, 12000.0), D = (0.15, 0.5), CP = (0.01, 0.08), JdCP = (-0.05, 0.05), rho = (0.4, 1.4),
+          supply_voltage = (10.0, 60.0), kV = (200.0, 600.0), esr = (0.02, 0.3), current_lim = (20.0, 40.0),
+          i0_current = (0.2, 1.5), i0_voltage = (8.0, 12.0), torque_constant = (0.015, 0.05))),
+    ('battery.current_for_power', battery.current_for_power,
+     dict(ocv = (10.0, 60.0), resistance = (0.01, 0.2), power = (0.0, 8000.0))),
+    ('vtol_model.cruise_power', vtol_model.cruise_power,
+     dict(power = (50.0, 2000.0), rpm = (1000.0, 12000.0), thrust = (5.0, 50.0), speed_mission = (10.0, 35.0),
+          n_motors_cruise = (1.0, 4.0), kV = (200.0, 600.0), esr = (0.02, 0.3), supply_esr = (0.0, 0.1),
+          i0_current = (0.2, 1.5), i0_voltage = (8.0, 12.0), torque_constant = (0.015, 0.05),
+          watt_hours = (50.0, 2000.0))),
+    ('vtol_model.calc_climb_rate', vtol_model.calc_climb_rate,
+     dict(thrust_climb = (0.0, 400.0), drag = (5.0, 50.0), mass_auw = (1.0, 30.0), speed_mission = (10.0, 35.0))),
+    ('vtol_model.hover_endurance', lambda xp, **a: vtol_model.hover_endurance(**a),
+     dict(watt_hours = (50.0, 2000.0), motor_power = (50.0, 2000.0), n_motors_hover = (1.0, 8.0),
+          mission_hover_time = (0.0, 10.0), batt_power = (50.0, 2000.0), speed_mission = (10.0, 35.0))),
+]
+
+def outputs(result):
+    '''return a kernel result as a dictionary of named outputs'''
+    if isinstance(result, struct):
+        return dict(result.__dict__)
+    if isinstance(result, tuple):
+        return dict((str(k), v) for (k, v) in enumerate(result))
+    return { 'value' : result }
+
+def identical(a, s):
+    '''return a mask of where arrays a and s are the same IEEE value, treating NaN as equal'''
+    a = np.asarray(a, dtype=float)
+    s = np.asarray(s, dtype=float)
+    return ((a == s) & (np.signbit(a) == np.signbit(s))) | (np.isnan(a) & np.isnan(s))
+
+def check_kernel(func, ranges, rng, samples):
+    '''
+    run a kernel with both backends on random inputs, returning a
+    dictionary of output name to the number of mismatching samples
+    '''
+    inputs = dict((name, rng.uniform(lower, upper, samples)) for (name, (lower, upper)) in sorted(ranges.items()))
+    with np.errstate(all='ignore'):
+        a = outputs(func(backend.array, **inputs))
+    s = [outputs(func(backend.scalar, **dict((name, float(v[k])) for (name, v) in inputs.items())))
+         for k in range(samples)]
+    return dict((name, int(samples - np.sum(identical(np.broadcast_to(a[name], (samples,)), [r[name] for r in s]))))
+                for name in sorted(a))
+
+def check_props(rng, samples):
+    '''
+    evaluate the CT, CP, ETA and derivative polynomials of every prop
+    with the scalar propeller methods and with batch.polyval, returning
+    a dictionary of polynomial name to the number of mismatching samples
+    '''
+    getters = [('CT', 'get_CT'), ('CP', 'get_CP'), ('ETA', 'get_ETA'), ('dCT', 'get_CT_deriv'), ('dCP', 'get_CP_deriv')]
+    bad = dict((name, 0) for (name, getter) in getters)
+    for prop_model in propeller.prop_models():
+        p = propeller.propeller(prop_model, 1.0)
+        J = rng.uniform(p.get_J_min(), p.get_J_max(), samples)
+        for (name, getter) in getters:
+            coefs = np.array([getattr(p, 'coefs_' + name)] * samples)
+            a = batch.polyval(coefs, J)
+            s = [getattr(p, getter)(float(x)) for x in J]
+            bad[name] += int(samples - np.sum(identical(a, s)))
+    return bad
+
+def main():
+    parser = optparse.OptionParser("check_backends.py [options]")
+    parser.add_option("--samples", type='int', default=10000, help='random inputs per kernel [default: %default]')
+    parser.add_option("--prop-samples", type='int', default=100, help='random J values per prop [default: %default]')
+    parser.add_option("--seed", type='int', default=1, help='random seed [default: %default]')
+    opts, args = parser.parse_args()
+
+    rng = np.random.default_rng(opts.seed)
+    failed = 0
+    results = [(name, check_kernel(func, ranges, rng, opts.samples)) for (name, func, ranges) in kernels]
+    results.append(('propeller polynomials', check_props(rng, opts.prop_samples)))
+    for (name, bad) in results:
+        mismatches = sum(bad.values())
+        failed += mismatches
+        print("%-28s %s" % (name, 'ok' if mismatches == 0 else
+                                  ' '.join('%s:%u' % (k, v) for (k, v) in sorted(bad.items()) if v)))
+    if failed:
+        error("%u outputs differ between the scalar and array backends" % failed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+'''
+density altitude performance envelope
+
+evaluates a configuration at every site pressure altitude and
+temperature of a grid as one vectorized batch, printing a table per
+output with a row per altitude and a column per temperature:
+
+  ./envelope.py --altitudes 0:4000:500 --temp-offsets -10:30:10
+  ./envelope.py --altitudes 0,1500,3000 --temperatures 15,30,45 --csv envelope.csv
+
+Temperatures are offsets from the ISA temperature at each altitude, or
+air temperatures in degrees C with --temperatures. The hover margin is
+the ESC throttle left when hovering on a fully discharged battery, so
+a negative margin means the motors can't hold a hover at the end of a
+flight. Grid points that fail to evaluate are shown as -
+
+released under GPLv3
+'''
+
+import optparse
+import csv
+import numpy as np
+import atmosphere
+import batch
+import sweep
+import vtol_model
+from util import *
+
+# outputs tabulated, as (name, title, format, function of the
+# config_batch and its batch.evaluate() result)
+outputs = [
+    ('density', 'air density Kg/m^3', '%.3f', lambda b, r: b.rho),
+    ('density_altitude', 'density altitude m', '%.0f', lambda b, r: atmosphere.density_altitude(b.rho)),
+    ('hover_margin', 'hover throttle margin %, fully discharged', '%.1f',
+     lambda b, r: 100.0 * (1.0 - r.hover.voltage / r.batt_voltage_min)),
+    ('hover_motor_current', 'hover motor current A', '%.1f', lambda b, r: r.hover.motor_current),
+    ('endurance_minutes', 'endurance min, no hover', '%.1f', lambda b, r: r.cruise.endurance_minutes),
+    ('hover_endurance_minutes', 'endurance min, with hover', '%.1f', lambda b, r: r.hover.corrected_endurance_minutes),
+    ('climb_rate_max', 'climb rate m/s, fully charged', '%.2f', lambda b, r: r.climb_max.climb_rate),
+    ('climb_rate_min', 'climb rate m/s, fully discharged', '%.2f', lambda b, r: r.climb_min.climb_rate),
+]
+
+output_names = [o[0] for o in outputs]
+
+def envelope(config, altitudes, temps, temperatures=False):
+    '''
+    evaluate config at every altitude in altitudes and temperature in
+    temps, which are ISA offsets or, if temperatures is True, air
+    temperatures in deg C, as one batch. Returns a structure with the
+    temperature offset, ok flags, errors and each output in
+    output_names as arrays of shape (altitudes, temps), with NaN outputs
+    where the evaluation failed
+    '''
+    altitude, temp = np.meshgrid(np.asarray(altitudes, dtype=float), np.asarray(temps, dtype=float), indexing='ij')
+    temp_offset = atmosphere.temp_offset_for(altitude, temp) if temperatures else temp
+    b = batch.config_batch([config] * altitude.size)
+    b.altitude[:] = altitude.ravel()
+    b.temp_offset[:] = temp_offset.ravel()
+    b.update()
+    r = batch.evaluate(b)
+    shape = altitude.shape
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = dict((name, np.where(r.ok, f(b, r), np.nan).reshape(shape)) for (name, title, fmt, f) in outputs)
+    return struct(altitudes = list(altitudes),
+                  temps = list(temps),
+                  temperatures = temperatures,
+                  altitude = altitude,
+                  temp_offset = temp_offset,
+                  temperature = atmosphere.temperature(altitude, temp_offset),
+                  ok = r.ok.reshape(shape),
+                  errors = np.array(r.errors, dtype=object).reshape(shape),
+                  values = values)
+
+def print_tables(e, names):
+    '''print one table per output, a row per altitude and a column per temperature'''
+    if e.temperatures:
+        headers = ['%g C' % t for t in e.temps]
+    else:
+        headers = ['ISA%+g' % t for t in e.temps]
+    for name in names:
+        title, fmt = [(o[1], o[2]) for o in outputs if o[0] == name][0]
+        print(title)
+        print('%10s' % 'altitude' + ''.join('%10s' % h for h in headers))
+        for i, altitude in enumerate(e.altitudes):
+            cells = [fmt % v if e.ok[i,j] else '-' for (j, v) in enumerate(e.values[name][i])]
+            print('%10.0f' % altitude + ''.join('%10s' % c for c in cells))
+        print('')
+    errors = {}
+    for msg in e.errors[~e.ok]:
+        errors[msg] = errors.get(msg, 0) + 1
+    for msg in sorted(errors):
+        print('%u grid points failed: %s' % (errors[msg], msg))
+
+def write_csv(e, filename):
+    '''write every grid point as a CSV row'''
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['altitude', 'temperature', 'temp_offset', 'ok', 'error'] + output_names)
+        for i in range(len(e.altitudes)):
+            for j in range(len(e.temps)):
+                writer.writerow([e.altitude[i,j], e.temperature[i,j], e.temp_offset[i,j], int(e.ok[i,j]), e.errors[i,j] or ''] +
+                                [e.values[name][i,j] if e.ok[i,j] else None for name in output_names])
+
+def main():
+    parser = optparse.OptionParser("envelope.py [options]")
+    vtol_model.add_options(parser)
+    parser.add_option("--altitudes", default='0:3000:500', help='site pressure altitudes in meters, as comma separated values and start:stop:step ranges [default: %default]')
+    parser.add_option("--temp-offsets", default='-10:30:10', help='temperature offsets from ISA in degrees C, as for --altitudes [default: %default]')
+    parser.add_option("--temperatures", default=None, help='air temperatures in degrees C, as for --altitudes, instead of --temp-offsets')
+    parser.add_option("--outputs", default=','.join(output_names), help='comma separated outputs to print [default: %default]')
+    parser.add_option("--csv", default=None, help='file to write every grid point to as CSV')
+    opts, args = parser.parse_args()
+
+    config = vtol_model.vtol_config(**dict((name, getattr(opts, name)) for name in vtol_model.option_names))
+    altitudes = sweep.parse_values('altitude', float, opts.altitudes)
+    temperatures = opts.temperatures is not None
+    temps = sweep.parse_values('temperature', float, opts.temperatures if temperatures else opts.temp_offsets)
+    names = opts.outputs.split(',')
+    for name in names:
+        if name not in output_names:
+            error("Unknown output %s. Choices are %s" % (name, output_names))
+    try:
+        e = envelope(config, altitudes, temps, temperatures)
+    except model_error as ex:
+        error(str(ex))
+    print_tables(e, names)
+    if opts.csv is not None:
+        write_csv(e, opts.csv)
+
+if __name__ == '__main__':
+    main()
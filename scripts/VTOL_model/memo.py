@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+bounded memoization of VTOL model stages
+
+each stage has its own least recently used cache of results keyed by
+the inputs the stage depends on, so repeated sub-problems across a
+grid of configurations are solved once. Failures are remembered too,
+and raised again on a hit. For example
+
+  m = memo.stage_memo(max_entries=10000)
+  vtol_model.set_memo(m)
+  for config in configs:
+      vtol_model.evaluate(config)
+  print(m.report())
+'''
+
+import collections
+from util import model_error
+
+class lru_memo(object):
+    '''results of one stage by key, evicting the least recently used beyond max_entries'''
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, key, func, *args):
+        '''return func(*args), remembered by key'''
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                entry = (func(*args), None)
+            except model_error as e:
+                entry = (None, str(e))
+            self.entries[key] = entry
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        value, msg = entry
+        if msg is not None:
+            raise model_error(msg)
+        return value
+
+    def hit_rate(self):
+        '''return the fraction of calls answered from the cache'''
+        calls = self.hits + self.misses
+        return self.hits / float(calls) if calls else 0.0
+
+class stage_memo(object):
+    '''an lru_memo for each model stage'''
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.stages = collections.OrderedDict()
+
+    def call(self, stage, key, func, *args):
+        '''return func(*args), remembered by key in the cache of a stage'''
+        m = self.stages.get(stage)
+        if m is None:
+            m = self.stages[stage] = lru_memo(self.max_entries)
+        return m.call(key, func, *args)
+
+    def stats(self):
+        '''return hits, misses, entries and hit rate of each stage'''
+        return dict((stage, { 'hits' : m.hits,
+                              'misses' : m.misses,
+                              'entries' : len(m.entries),
+                              'hit_rate' : m.hit_rate() })
+                    for stage, m in self.stages.items())
+
+    def report(self):
+        '''return a printable table of stage hit rates'''
+        lines = ['%-12s %10s %10s %10s %9s' % ('stage', 'hits', 'misses', 'entries', 'hit rate')]
+        for stage, m in self.stages.items():
+            lines.append('%-12s %10u %10u %10u %8.1f%%' % (stage, m.hits, m.misses, len(m.entries), 100 * m.hit_rate()))
+        return '\n'.join(lines)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+'''
+VTOL mission energy simulation
+
+flies a QGC WPL 110 mission file, such as
+Gazebo/missions/sonoma-quadplane.txt, with the cruise, climb and hover
+performance of a vtol_model.py configuration. The mission is split
+into legs with a horizontal distance and altitude change, and each leg
+into VTOL hover, fixed wing climb and cruise segments. Segment times
+and battery energy are calculated for all legs at once with NumPy
+arrays, so the model is only evaluated once however many waypoints
+the mission has.
+
+  mission.py --mission ../../Gazebo/missions/sonoma-quadplane.txt --legs
+
+released under GPLv3
+'''
+
+import optparse
+import numpy as np
+import vtol_model
+import propeller
+from util import *
+from vtol_model import avionics_power
+
+# MAVLink mission commands understood by the simulator
+MAV_CMD_NAV_WAYPOINT = 16
+MAV_CMD_NAV_LOITER_TIME = 19
+MAV_CMD_NAV_RETURN_TO_LAUNCH = 20
+MAV_CMD_NAV_LAND = 21
+MAV_CMD_NAV_TAKEOFF = 22
+MAV_CMD_NAV_VTOL_TAKEOFF = 84
+MAV_CMD_NAV_VTOL_LAND = 85
+MAV_CMD_DO_JUMP = 177
+
+nav_commands = [MAV_CMD_NAV_WAYPOINT, MAV_CMD_NAV_LOITER_TIME, MAV_CMD_NAV_RETURN_TO_LAUNCH,
+                MAV_CMD_NAV_LAND, MAV_CMD_NAV_TAKEOFF, MAV_CMD_NAV_VTOL_TAKEOFF, MAV_CMD_NAV_VTOL_LAND]
+
+# MAVLink frames, global with altitude above mean sea level or relative to home
+MAV_FRAME_GLOBAL = 0
+MAV_FRAME_GLOBAL_RELATIVE_ALT = 3
+
+# limit on the number of legs after expanding DO_JUMP loops
+max_legs = 1000000
+
+earth_radius = 6378100.0 # metres
+
+def parse_wpl(filename):
+    '''
+    parse a QGC WPL 110 file, returning a list of items with seq, frame,
+    command, param1 to param4, lat, lon and alt. Item 0 is home
+    '''
+    items = []
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    if not lines or not lines[0].startswith('QGC WPL 110'):
+        raise model_error("%s is not a QGC WPL 110 mission file" % filename)
+    for line in lines[1:]:
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) != 12:
+            raise model_error("bad mission line in %s: %s" % (filename, line))
+        try:
+            v = [float(x) for x in fields]
+        except ValueError:
+            raise model_error("bad mission line in %s: %s" % (filename, line))
+        items.append(struct(seq = int(v[0]),
+                            frame = int(v[2]),
+                            command = int(v[3]),
+                            param1 = v[4],
+                            param2 = v[5],
+                            param3 = v[6],
+                            param4 = v[7],
+                            lat = v[8],
+                            lon = v[9],
+                            alt = v[10]))
+    if not items:
+        raise model_error("%s has no home position" % filename)
+    return items
+
+def flight_order(items):
+    '''
+    return the navigation items after home in the order they are flown,
+    following DO_JUMP items, and a sorted list of ignored commands
+    '''
+    by_seq = dict((item.seq, k) for k, item in enumerate(items))
+    jumps_done = {}
+    flown = []
+    ignored = set()
+    k = 1
+    while k < len(items):
+        item = items[k]
+        if item.command == MAV_CMD_DO_JUMP:
+            target = int(item.param1)
+            repeat = int(item.param2)
+            if target not in by_seq:
+                raise model_error("DO_JUMP at item %u to missing item %u" % (item.seq, target))
+            if repeat < 0:
+                raise model_error("DO_JUMP at item %u repeats forever" % item.seq)
+            done = jumps_done.get(k, 0)
+            if done < repeat:
+                jumps_done[k] = done + 1
+                k = by_seq[target]
+                continue
+        elif item.command in nav_commands:
+            flown.append(item)
+            if len(flown) > max_legs:
+                raise model_error("mission has more than %u legs" % max_legs)
+        else:
+            ignored.add(item.command)
+        k += 1
+    return flown, sorted(ignored)
+
+def mission_legs(items):
+    '''
+    return a structure of per-leg arrays for a parsed mission: the
+    command, horizontal distance (m), start and end altitude above home
+    (m) and hold time (s), and the list of ignored commands
+    '''
+    home = items[0]
+    flown, ignored = flight_order(items)
+    n = len(flown)
+    command = np.array([item.command for item in flown], dtype=int)
+    frame = np.array([item.frame for item in flown], dtype=int)
+    lat = np.array([item.lat for item in flown])
+    lon = np.array([item.lon for item in flown])
+    alt = np.array([item.alt for item in flown])
+    param1 = np.array([item.param1 for item in flown])
+
+    # altitudes relative to home
+    alt = np.where(frame == MAV_FRAME_GLOBAL, alt - home.alt, alt)
+
+    # RTL flies home at the current altitude, and landings end on the ground
+    rtl = command == MAV_CMD_NAV_RETURN_TO_LAUNCH
+    lat[rtl] = home.lat
+    lon[rtl] = home.lon
+
+    # a zero position means the current position, and takeoffs climb in place
+    here = ((lat == 0) & (lon == 0)) | (command == MAV_CMD_NAV_VTOL_TAKEOFF)
+    index = np.where(here, -1, np.arange(n))
+    index = np.maximum.accumulate(index)
+    lat = np.where(index >= 0, lat[np.maximum(index, 0)], home.lat)
+    lon = np.where(index >= 0, lon[np.maximum(index, 0)], home.lon)
+
+    # legs start at the altitude the previous leg ended at. Landings end
+    # on the ground, VTOL landings and RTL flying at their starting
+    # altitude then descending vertically
+    landing = (command == MAV_CMD_NAV_LAND) | (command == MAV_CMD_NAV_VTOL_LAND) | rtl
+    end_alt = np.where(landing, 0.0, alt)
+    start_alt = np.concatenate([[0.0], end_alt[:-1]])
+    cruise_alt = np.where((command == MAV_CMD_NAV_VTOL_LAND) | rtl, start_alt, end_alt)
+
+    prev_lat = np.concatenate([[home.lat], lat[:-1]])
+    prev_lon = np.concatenate([[home.lon], lon[:-1]])
+    distance = ground_distance(prev_lat, prev_lon, lat, lon)
+
+    hold = np.where(command == MAV_CMD_NAV_LOITER_TIME, param1, 0.0)
+
+    return struct(command = command,
+                  distance = distance,
+                  start_alt = start_alt,
+                  cruise_alt = cruise_alt,
+                  end_alt = end_alt,
+                  hold_time = hold,
+                  ignored = ignored)
+
+def ground_distance(lat1, lon1, lat2, lon2):
+    '''great circle distance in meters between arrays of positions in degrees'''
+    lat1, lon1, lat2, lon2 = [np.radians(x) for x in (lat1, lon1, lat2, lon2)]
+    a = np.sin(0.5*(lat2 - lat1))**2 + np.cos(lat1) * np.cos(lat2) * np.sin(0.5*(lon2 - lon1))**2
+    return 2.0 * earth_radius * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def simulate(r, legs, vtol_climb_rate, vtol_descent_rate):
+    '''
+    fly mission legs with the performance of a vtol_result, returning
+    per-leg arrays of segment times (s), energy (Wh) and the battery
+    energy left at the end of each leg (Wh)
+
+    VTOL takeoffs climb and VTOL landings and RTL descend vertically at
+    hover power. Other legs are flown at mission speed with cruise
+    power, climbing at the fully discharged climb rate and power. Legs
+    that need more height than the climb covers over their distance
+    are extended by circling while climbing
+    '''
+    config = r.config
+    speed = r.speed_mission
+    hover_power = r.hover.motor_power * config.num_motors_hover + avionics_power
+    climb_power = r.climb_min.motor_power * config.num_motors_cruise + avionics_power
+    cruise_power = r.cruise.batt_power
+    climb_rate = r.climb_min.climb_rate
+    if climb_rate <= 0:
+        raise model_error("no fixed wing climb rate, can't fly the mission")
+
+    vtol_takeoff = legs.command == MAV_CMD_NAV_VTOL_TAKEOFF
+    vtol_land = (legs.command == MAV_CMD_NAV_VTOL_LAND) | (legs.command == MAV_CMD_NAV_RETURN_TO_LAUNCH)
+
+    # vertical segments
+    vtol_up = np.where(vtol_takeoff, np.maximum(legs.end_alt - legs.start_alt, 0.0), 0.0)
+    vtol_down = np.where(vtol_land, np.maximum(legs.cruise_alt - legs.end_alt, 0.0), 0.0)
+    hover_time = vtol_up / vtol_climb_rate + vtol_down / vtol_descent_rate
+
+    # fixed wing segments, climbing first then cruising the rest of the leg
+    fw_climb = np.where(vtol_takeoff | vtol_land, 0.0, np.maximum(legs.cruise_alt - legs.start_alt, 0.0))
+    climb_time = fw_climb / climb_rate
+    cruise_distance = np.where(vtol_takeoff, 0.0, np.maximum(legs.distance - climb_time * speed, 0.0))
+    cruise_time = cruise_distance / speed + legs.hold_time
+
+    energy = (hover_time * hover_power + climb_time * climb_power + cruise_time * cruise_power) / 3600.0
+    remaining = r.battery.get_watt_hours() - np.cumsum(energy)
+
+    return struct(hover_time = hover_time,
+                  climb_time = climb_time,
+                  cruise_time = cruise_time,
+                  time = hover_time + climb_time + cruise_time,
+                  energy = energy,
+                  remaining = remaining,
+                  hover_power = hover_power,
+                  climb_power = climb_power,
+                  cruise_power = cruise_power)
+
+def print_legs(legs, sim):
+    '''print a table of legs'''
+    print('%5s %7s %9s %7s %7s %8s %8s %8s %8s' % ('leg', 'command', 'dist m', 'alt m', 'time s', 'hover s', 'climb s', 'used Wh', 'left Wh'))
+    for k in range(len(legs.command)):
+        print('%5u %7u %9.1f %7.1f %7.1f %8.1f %8.1f %8.2f %8.2f' % (
+            k, legs.command[k], legs.distance[k], legs.end_alt[k], sim.time[k],
+            sim.hover_time[k], sim.climb_time[k], sim.energy[k], sim.remaining[k]))
+
+def print_summary(r, legs, sim, reserve):
+    '''print a summary of a simulated mission'''
+    batt_Wh = r.battery.get_watt_hours()
+    used = batt_Wh - sim.remaining[-1] if len(sim.remaining) else 0.0
+    print('mission legs = %u' % len(legs.command))
+    if legs.ignored:
+        print('ignored commands = %s' % ', '.join(str(c) for c in legs.ignored))
+    print('mission distance = %.2f km' % (np.sum(legs.distance) / 1000.0))
+    print('mission time = %.1f min' % (np.sum(sim.time) / 60.0))
+    print('hover time = %.1f s at %.0f W' % (np.sum(sim.hover_time), sim.hover_power))
+    print('climb time = %.1f s at %.0f W' % (np.sum(sim.climb_time), sim.climb_power))
+    print('cruise time = %.1f s at %.0f W' % (np.sum(sim.cruise_time), sim.cruise_power))
+    print('energy used = %.1f Wh of %.1f Wh (%.1f %%)' % (used, batt_Wh, 100.0 * used / batt_Wh))
+    short = np.flatnonzero(sim.remaining < reserve * batt_Wh)
+    if len(short):
+        print('battery below %.0f %% reserve on leg %u' % (100 * reserve, short[0]))
+    else:
+        print('mission is flyable with %.1f %% battery left' % (100.0 * sim.remaining[-1] / batt_Wh if len(sim.remaining) else 100.0))
+
+def main():
+    parser = optparse.OptionParser("mission.py [options]")
+    vtol_model.add_options(parser)
+    parser.add_option("--mission", default=None, help='QGC WPL 110 mission file')
+    parser.add_option("--vtol-climb-rate", type='float', default=2.5, help='VTOL climb rate in m/s [default: %default]')
+    parser.add_option("--vtol-descent-rate", type='float', default=1.5, help='VTOL descent rate in m/s [default: %default]')
+    parser.add_option("--reserve", type='float', default=0.2, help='battery reserve as a fraction of capacity [default: %default]')
+    parser.add_option("--legs", action='store_true', default=False, help='print a table of legs')
+    parser.add_option("--prop-cache", default=None, help='file to keep fitted prop polynomials in between runs')
+    opts, args = parser.parse_args()
+
+    if opts.mission is None:
+        error("a --mission file is needed")
+    if opts.prop_cache is not None:
+        propeller.fits.set_file(opts.prop_cache)
+
+    config = vtol_model.vtol_config(**dict((name, getattr(opts, name)) for name in vtol_model.option_names))
+    try:
+        r = vtol_model.evaluate(config)
+        legs = mission_legs(parse_wpl(opts.mission))
+        sim = simulate(r, legs, opts.vtol_climb_rate, opts.vtol_descent_rate)
+    except model_error as e:
+        error(str(e))
+    except IOError as e:
+        error(str(e))
+
+    if opts.legs:
+        print_legs(legs, sim)
+    print_summary(r, legs, sim, opts.reserve)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+'''
+incremental VTOL model evaluation
+
+the stages of vtol_model.evaluate as nodes of a dependency graph, from
+the component models through masses, wing, drag, cruise, climb and
+hover to the result. A session keeps the value of every node, and
+changing an option only recomputes the nodes downstream of it, so
+changing the hover time only recomputes the hover endurance:
+
+  s = model_graph.session(vtol_model.vtol_config())
+  r = s.result()
+  s.set(hover_time=8.0)
+  r = s.result()
+  print(s.last_run)  # ['hover_endurance', 'result']
+
+run from the command line it reads lines of name=value changes and
+prints the main outputs and the stages that were recomputed. An empty
+line or 'report' prints the full report
+
+released under GPLv3
+'''
+
+import optparse
+import sys
+import propeller
+import battery
+import motor
+import wing
+import memo
+import vtol_model
+from util import *
+
+class stage(object):
+    '''a node of the graph, computed by func(config, values) from options and upstream stages'''
+
+    def __init__(self, name, options, depends, func):
+        self.name = name
+        self.options = options
+        self.depends = depends
+        self.func = func
+
+def calc_drag(config, v):
+    '''mission speed and drag polar'''
+    speed_mission = vtol_model.calc_speed_mission(v.wing, config.mission_speed)
+    return struct(speed_mission = speed_mission,
+                  drag = v.wing.calc_drag(v.mass.auw, speed_mission))
+
+def calc_cruise_data(config, v):
+    '''cruise RPM result with the cruise data added, leaving the cruise stage value unchanged'''
+    cruise = struct(**v.cruise.__dict__)
+    vtol_model.calc_cruise_data(v.prop, v.motor, v.battery, cruise, v.drag.speed_mission,
+                                v.drag.drag, config.num_motors_cruise, v.density)
+    return cruise
+
+def calc_climb(config, v, voltage):
+    '''climb for a battery voltage'''
+    return vtol_model.memo_climb(v.solvers.climb, config, v.prop, v.motor, v.cruise_data, v.drag.speed_mission,
+                                 v.drag.drag, v.mass.auw, voltage, v.density)
+
+def calc_hover_endurance(config, v):
+    '''hover solution with the endurance after hovering for the hover time'''
+    hover = struct(**v.hover.__dict__)
+    vtol_model.calc_hover_endurance(hover, v.battery, v.cruise_data, v.drag.speed_mission,
+                                    config.num_motors_hover, config.hover_time)
+    return hover
+
+def calc_result(config, v):
+    '''assemble a vtol_result'''
+    return vtol_model.vtol_result(config = config,
+                                  prop = v.prop,
+                                  battery = v.battery,
+                                  motor = v.motor,
+                                  wing = v.wing,
+                                  mass = v.mass,
+                                  drag = v.drag.drag,
+                                  speed_mission = v.drag.speed_mission,
+                                  cruise = v.cruise_data,
+                                  climb_max = v.climb_max,
+                                  climb_min = v.climb_min,
+                                  hover = v.hover_endurance)
+
+def solver_stages(config, v):
+    '''the solver functions for the solver type'''
+    cruise, climb, hover = vtol_model.get_solver_functions(config.solver)
+    return struct(cruise = cruise, climb = climb, hover = hover)
+
+# the model stages in evaluation order
+stages = [
+    stage('prop', ['prop_model', 'prop_diameter', 'prop_table_points'], [],
+          lambda c, v: propeller.propeller(c.prop_model, c.prop_diameter, c.prop_table_points,
+                                           vtol_model.CT_correction_factor, vtol_model.CP_correction_factor)),
+    stage('battery', ['battery_model', 'cell_series', 'cell_parallel'], [],
+          lambda c, v: battery.battery(c.battery_model, c.cell_series, c.cell_parallel)),
+    stage('motor', ['motor_type'], [],
+          lambda c, v: motor.motor(c.motor_type)),
+    stage('solvers', ['solver'], [], solver_stages),
+    stage('density', ['altitude', 'temp_offset'], [],
+          lambda c, v: vtol_model.calc_density(c)),
+    stage('mass', ['mass_structure', 'mass_avionics', 'mass_payload',
+                   'num_motors_total', 'num_motors_cruise', 'num_motors_hover'], ['prop', 'battery', 'motor'],
+          lambda c, v: vtol_model.calc_mass(c, v.prop, v.battery, v.motor)),
+    stage('wing', ['wing_span', 'aspect_ratio'], ['mass', 'density'],
+          lambda c, v: wing.wing(c.wing_span, c.aspect_ratio, v.mass.auw, v.density)),
+    stage('drag', ['mission_speed'], ['wing', 'mass'], calc_drag),
+    stage('cruise', ['num_motors_cruise'], ['solvers', 'prop', 'drag', 'density'],
+          lambda c, v: vtol_model.memo_cruise_RPM(v.solvers.cruise, c, v.prop, v.drag.speed_mission, v.drag.drag, v.density)),
+    stage('cruise_data', ['num_motors_cruise'], ['cruise', 'prop', 'motor', 'battery', 'drag', 'density'], calc_cruise_data),
+    stage('climb_max', ['num_motors_cruise'], ['solvers', 'prop', 'motor', 'battery', 'cruise_data', 'drag', 'mass', 'density'],
+          lambda c, v: calc_climb(c, v, v.battery.get_voltage_max())),
+    stage('climb_min', ['num_motors_cruise'], ['solvers', 'prop', 'motor', 'battery', 'cruise_data', 'drag', 'mass', 'density'],
+          lambda c, v: calc_climb(c, v, v.battery.get_voltage_min())),
+    stage('hover', ['num_motors_hover'], ['solvers', 'prop', 'motor', 'battery', 'cruise_data', 'drag', 'mass', 'density'],
+          lambda c, v: vtol_model.memo_hover(v.solvers.hover, c, v.prop, v.motor, v.battery, v.cruise_data,
+                                             v.drag.speed_mission, v.mass.auw, v.battery.get_voltage_min(), v.density)),
+    stage('hover_endurance', ['hover_time', 'num_motors_hover'], ['hover', 'battery', 'cruise_data', 'drag'],
+          calc_hover_endurance),
+    stage('result', [], ['prop', 'battery', 'motor', 'wing', 'mass', 'drag', 'cruise_data',
+                         'climb_max', 'climb_min', 'hover_endurance'], calc_result),
+]
+
+class graph(object):
+    '''a dependency graph of stages, which must be listed after the stages they depend on'''
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.by_name = dict((s.name, s) for s in stages)
+        self.order = [s.name for s in stages]
+        for k, s in enumerate(stages):
+            for d in s.depends:
+                if d not in self.order[:k]:
+                    raise model_error("stage %s depends on %s, which is not before it" % (s.name, d))
+        # stages directly using each option, and directly downstream of each stage
+        self.option_users = {}
+        self.dependents = dict((s.name, []) for s in stages)
+        for s in stages:
+            for o in s.options:
+                self.option_users.setdefault(o, []).append(s.name)
+            for d in s.depends:
+                self.dependents[d].append(s.name)
+
+    def downstream(self, names):
+        '''return the set of stages in names and every stage downstream of them'''
+        found = set()
+        todo = list(names)
+        while todo:
+            name = todo.pop()
+            if name in found:
+                continue
+            found.add(name)
+            todo.extend(self.dependents[name])
+        return found
+
+model = graph(stages)
+
+class session(object):
+    '''
+    a configuration with the value of every stage, recomputing only
+    the stages downstream of changed options. last_run lists the
+    stages computed by the last result() call, and runs counts how
+    often each stage has been computed
+    '''
+
+    def __init__(self, config=None, g=model):
+        self.graph = g
+        self.config = config if config is not None else vtol_model.vtol_config()
+        self.values = {}
+        self.errors = {}
+        self.dirty = set(g.order)
+        self.runs = dict((name, 0) for name in g.order)
+        self.last_run = []
+
+    def set(self, **changes):
+        '''change options, marking the stages downstream of them for recomputing'''
+        changed = []
+        for name, value in changes.items():
+            if name not in vtol_model.option_names:
+                raise model_error("Unknown option %s. Choices are %s" % (name, vtol_model.option_names))
+            if getattr(self.config, name) != value:
+                setattr(self.config, name, value)
+                changed.append(name)
+        users = []
+        for name in changed:
+            users.extend(self.graph.option_users.get(name, []))
+        self.dirty |= self.graph.downstream(users)
+
+    def get(self, name):
+        '''return the value of a stage, computing it and its dirty upstream stages if needed'''
+        self.last_run = []
+        return self.compute(name)
+
+    def compute(self, name):
+        '''compute a stage if dirty, raising model_error if it or an upstream stage fails'''
+        if name in self.dirty:
+            s = self.graph.by_name[name]
+            self.values.pop(name, None)
+            self.errors.pop(name, None)
+            try:
+                v = struct(**dict((d, self.compute(d)) for d in s.depends))
+                self.values[name] = s.func(self.config, v)
+            except model_error as e:
+                self.errors[name] = str(e)
+            self.dirty.discard(name)
+            self.runs[name] += 1
+            self.last_run.append(name)
+        if name in self.errors:
+            raise model_error(self.errors[name])
+        return self.values[name]
+
+    def result(self):
+        '''return the vtol_result for the current options'''
+        return self.get('result')
+
+def parse_change(item):
+    '''parse a name=value option change, returning (name, value)'''
+    if '=' not in item:
+        raise model_error("expected name=value, not %s" % item)
+    name, value = item.split('=', 1)
+    name = name.strip().replace('-', '_')
+    option_types = dict((o[0], o[1]) for o in vtol_model.options)
+    if name not in option_types:
+        raise model_error("Unknown option %s. Choices are %s" % (name, vtol_model.option_names))
+    try:
+        return name, option_types[name](value.strip())
+    except ValueError:
+        raise model_error("bad value %s for option %s" % (value, name))
+
+def print_summary(s):
+    '''print the main outputs of a session and the stages last recomputed'''
+    try:
+        r = s.result()
+        print('endurance %.1f min (with hover %.1f min) range %.2f km climb %.2f m/s hover current %.1f A' % (
+            r.cruise.endurance_minutes, r.hover.corrected_endurance_minutes, r.hover.corrected_range/1000.0,
+            r.climb_min.climb_rate, r.hover.motor_current))
+    except model_error as e:
+        print('Error: %s' % e)
+    print('recomputed: %s' % (' '.join(s.last_run) or 'nothing'))
+
+def main():
+    parser = optparse.OptionParser("model_graph.py [options]")
+    vtol_model.add_options(parser)
+    parser.add_option("--memo", type='int', default=0, help='remember up to this many cruise, climb and hover solutions, so returning to earlier options skips the solvers, and print the hit rates at the end [default: off]')
+    opts, args = parser.parse_args()
+
+    if opts.memo > 0:
+        vtol_model.set_memo(memo.stage_memo(opts.memo))
+    config = vtol_model.vtol_config(**dict((name, getattr(opts, name)) for name in vtol_model.option_names))
+    s = session(config)
+    print_summary(s)
+    for line in sys.stdin:
+        line = line.strip()
+        if line in ('', 'report'):
+            try:
+                vtol_model.print_report(s.result())
+            except model_error as e:
+                print('Error: %s' % e)
+            continue
+        try:
+            s.set(**dict(parse_change(item) for item in line.split()))
+        except model_error as e:
+            print('Error: %s' % e)
+            continue
+        print_summary(s)
+    if vtol_model.memo is not None:
+        print(vtol_model.memo.report())
+
+if __name__ == '__main__':
+    main()
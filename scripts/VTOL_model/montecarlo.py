@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+'''
+Monte Carlo uncertainty propagation
+
+draws samples of uncertain inputs around a base configuration and
+evaluates them as vectorized batches, reporting percentiles of the
+endurance, range, hover current and climb rate. Each input is its base
+value multiplied by a factor drawn from a distribution given as
+name=distribution:arguments, one of
+
+  normal:mean,sd  uniform:low,high  triangular:low,mode,high
+
+for example
+
+  ./montecarlo.py --samples 100000 --vary prop_CT_factor=normal:1,0.05 --vary mass_structure=uniform:0.95,1.1
+
+Samples are drawn in chunks of --chunk-size, chunk k from its own
+stream spawned from --seed, so the results depend only on the seed,
+sample count and chunk size, not on the number of worker processes
+
+released under GPLv3
+'''
+
+import optparse
+import multiprocessing
+import csv
+import numpy as np
+import propeller
+import batch
+import vtol_model
+from util import *
+
+# distributions as name : (argument count, function(rng, args, size))
+distributions = {
+    'normal' : (2, lambda rng, a, n: rng.normal(a[0], a[1], n)),
+    'uniform' : (2, lambda rng, a, n: rng.uniform(a[0], a[1], n)),
+    'triangular' : (3, lambda rng, a, n: rng.triangular(a[0], a[1], a[2], n)),
+}
+
+# inputs varied when no --vary option is given. The motor efficiency in
+# the motor catalogue only feeds an unused first estimate, so the
+# motor losses are varied through the armature resistance and no-load
+# current instead
+default_vary = [
+    'prop_CT_factor=normal:1,0.05',
+    'prop_CP_factor=normal:1,0.05',
+    'motor_esr=normal:1,0.1',
+    'motor_i0_current=normal:1,0.1',
+    'batt_cell_age_factor=triangular:0.85,1,1.1',
+    'mass_structure=normal:1,0.05',
+]
+
+# outputs summarised, from batch.output_fields
+output_names = ['endurance_minutes', 'range_km', 'hover_endurance_minutes', 'hover_range_km',
+                'hover_motor_current', 'climb_rate_max', 'climb_rate_min']
+
+def parse_vary(spec):
+    '''parse name=distribution:arguments, returning (name, distribution, arguments)'''
+    if '=' not in spec or ':' not in spec:
+        raise model_error("bad distribution %s, expected name=distribution:arguments" % spec)
+    name, dist = spec.split('=', 1)
+    dist, args = dist.split(':', 1)
+    if name not in batch.parameter_names:
+        raise model_error("Unknown parameter %s. Choices are %s" % (name, batch.parameter_names))
+    if dist not in distributions:
+        raise model_error("Unknown distribution %s. Choices are %s" % (dist, sorted(distributions)))
+    try:
+        args = [float(x) for x in args.split(',')]
+    except ValueError:
+        raise model_error("bad arguments %s for %s" % (args, name))
+    if len(args) != distributions[dist][0]:
+        raise model_error("%s takes %u arguments" % (dist, distributions[dist][0]))
+    return (name, dist, args)
+
+def chunk_rng(seed, chunk):
+    '''return the random generator of chunk number chunk, spawned from seed'''
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk,)))
+
+def draw(vary, rng, size):
+    '''return a dictionary of input name to sampled factors, drawn in the order of vary'''
+    factors = {}
+    for (name, dist, args) in vary:
+        factors[name] = distributions[dist][1](rng, args, size)
+    return factors
+
+def evaluate_samples(config, factors, size):
+    '''
+    evaluate size copies of config with each input in factors scaled
+    per sample, returning the batch and its batch.evaluate() result
+    '''
+    b = batch.config_batch([config] * size)
+    for (name, f) in factors.items():
+        column = getattr(b, name)
+        column *= f
+    b.update()
+    return b, batch.evaluate(b)
+
+# the run settings, set in each worker by init_worker
+run = None
+
+def init_worker(settings, prop_cache):
+    '''process pool initialiser'''
+    global run
+    run = settings
+    if prop_cache is not None:
+        propeller.fits.set_file(prop_cache)
+
+def evaluate_chunk(chunk):
+    '''sample and evaluate chunk number chunk, returning (factors, ok, outputs)'''
+    k, size = chunk
+    factors = draw(run.vary, chunk_rng(run.seed, k), size)
+    b, r = evaluate_samples(run.config, factors, size)
+    fields = dict(batch.output_fields)
+    outputs = np.column_stack([fields[name](r) for name in output_names])
+    return factors, r.ok, outputs
+
+def simulate(config, vary, samples, seed=1, chunk_size=10000, processes=1, prop_cache=None):
+    '''
+    draw and evaluate samples, returning a structure of the sampled
+    factors by input name, the per-sample ok flags, and the outputs as an
+    array of shape (samples, outputs) in output_names order
+    '''
+    settings = struct(config = config, vary = vary, seed = seed)
+    chunks = [(k, min(chunk_size, samples - start)) for (k, start) in enumerate(range(0, samples, chunk_size))]
+    if processes <= 1:
+        init_worker(settings, prop_cache)
+        results = list(map(evaluate_chunk, chunks))
+    else:
+        pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(settings, prop_cache))
+        results = pool.map(evaluate_chunk, chunks)
+        pool.close()
+        pool.join()
+    return struct(factors = dict((name, np.concatenate([f[name] for (f, ok, out) in results]))
+                                 for (name, dist, args) in vary),
+                  ok = np.concatenate([ok for (f, ok, out) in results]),
+                  outputs = np.concatenate([out for (f, ok, out) in results]))
+
+def print_report(s, percentiles):
+    '''print the percentiles, mean and standard deviation of each output over the successful samples'''
+    good = s.outputs[s.ok]
+    print('samples %u, failed %u (%.2f%%)' % (len(s.ok), np.sum(~s.ok), 100.0 * np.mean(~s.ok)))
+    if len(good) == 0:
+        return
+    print('%-24s' % 'output' + ''.join('%10s' % ('P%g' % p) for p in percentiles) + '%10s%10s' % ('mean', 'std'))
+    values = np.percentile(good, percentiles, axis=0)
+    for j, name in enumerate(output_names):
+        print('%-24s' % name + ''.join('%10.3f' % v for v in values[:,j]) +
+              '%10.3f%10.3f' % (np.mean(good[:,j]), np.std(good[:,j])))
+
+def write_csv(s, filename):
+    '''write every sample's factors, ok flag and outputs'''
+    names = sorted(s.factors)
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(names + ['ok'] + output_names)
+        for k in range(len(s.ok)):
+            writer.writerow([s.factors[name][k] for name in names] + [int(s.ok[k])] +
+                            (s.outputs[k].tolist() if s.ok[k] else [None] * len(output_names)))
+
+def main():
+    parser = optparse.OptionParser("montecarlo.py [options]")
+    vtol_model.add_options(parser)
+    parser.add_option("--vary", action='append', default=None, help='input and factor distribution, as name=distribution:arguments, repeatable [default: %s]' % ' '.join(default_vary))
+    parser.add_option("--samples", type='int', default=100000, help='number of samples [default: %default]')
+    parser.add_option("--seed", type='int', default=1, help='random seed [default: %default]')
+    parser.add_option("--chunk-size", type='int', default=10000, help='samples per batch [default: %default]')
+    parser.add_option("--processes", type='int', default=multiprocessing.cpu_count(), help='number of worker processes [default: %default]')
+    parser.add_option("--percentiles", default='5,25,50,75,95', help='percentiles to report [default: %default]')
+    parser.add_option("--csv", default=None, help='file to write every sample to as CSV')
+    parser.add_option("--prop-cache", default=None, help='file to keep fitted prop polynomials in between runs')
+    opts, args = parser.parse_args()
+
+    config = vtol_model.vtol_config(**dict((name, getattr(opts, name)) for name in vtol_model.option_names))
+    try:
+        vary = [parse_vary(spec) for spec in (opts.vary or default_vary)]
+        percentiles = [float(p) for p in opts.percentiles.split(',')]
+    except ValueError:
+        error("bad percentiles %s" % opts.percentiles)
+    except model_error as e:
+        error(str(e))
+    if opts.samples < 1 or opts.chunk_size < 1:
+        error("samples and chunk size must be positive")
+    if not all(0 <= p <= 100 for p in percentiles):
+        error("percentiles must be between 0 and 100")
+    s = simulate(config, vary, opts.samples, opts.seed, opts.chunk_size, opts.processes, opts.prop_cache)
+    print_report(s, percentiles)
+    if opts.csv is not None:
+        write_csv(s, opts.csv)
+
+if __name__ == '__main__':
+    main()
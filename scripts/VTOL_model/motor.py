@@ -4,13 +4,15 @@
 motor model class
 '''
 
-from util import error
+from util import model_error, struct
 from math import *
 
 motors = {}
 
 class motor_data(object):
-    def __init__(self, efficiency, supply_esr, i0_current, i0_voltage, kV, esr, mass, esc_mass, current_lim):
+    def __init__(self, efficiency, supply_esr, i0_current, i0_voltage, kV, esr, mass, esc_mass, current_lim,
+                 winding_heat_capacity, winding_thermal_resistance, winding_temp_max,
+                 esc_resistance, esc_heat_capacity, esc_thermal_resistance, esc_temp_max):
         self.efficiency = efficiency # rough motor efficiency
         self.supply_esr = supply_esr # supply resistance Ohms
         self.i0_current = i0_current # zero-load current Amps
@@ -20,6 +22,13 @@ class motor_data(object):
         self.mass = mass             # mass in Kg
         self.esc_mass = esc_mass     # mass of ESC
         self.current_lim = current_lim # current limit in Amps
+        self.winding_heat_capacity = winding_heat_capacity           # heat capacity of the windings and stator, J/K
+        self.winding_thermal_resistance = winding_thermal_resistance # windings to ambient air in flight, K/W
+        self.winding_temp_max = winding_temp_max                     # max winding temperature, deg C
+        self.esc_resistance = esc_resistance                         # ESC conduction resistance (ohm)
+        self.esc_heat_capacity = esc_heat_capacity                   # heat capacity of the ESC, J/K
+        self.esc_thermal_resistance = esc_thermal_resistance         # ESC to ambient air, K/W
+        self.esc_temp_max = esc_temp_max                             # max ESC temperature, deg C
 
 #############################################
 # T-motor MT3520-11 400Kv with YPG HV 14S ESC
@@ -32,7 +41,14 @@ motors['MT3520-11-400kV'] = motor_data(
     esr = 0.032,
     mass = 0.205,
     esc_mass = 0.170,
-    current_lim = 38.0)
+    current_lim = 38.0,
+    winding_heat_capacity = 95.0,
+    winding_thermal_resistance = 0.5,
+    winding_temp_max = 150.0,
+    esc_resistance = 0.003,
+    esc_heat_capacity = 80.0,
+    esc_thermal_resistance = 2.0,
+    esc_temp_max = 100.0)
 
 ###################################################################
 # T-motor U5-KV400 with Castle Creations PHOENIX EDGE HV 40 AMP ESC
@@ -45,15 +61,70 @@ motors['U5-400'] = motor_data(
     esr = 0.116,
     mass = 0.195,
     esc_mass = 0.031,
-    current_lim = 30.0)
-
+    current_lim = 30.0,
+    winding_heat_capacity = 90.0,
+    winding_thermal_resistance = 0.6,
+    winding_temp_max = 150.0,
+    esc_resistance = 0.004,
+    esc_heat_capacity = 15.0,
+    esc_thermal_resistance = 6.0,
+    esc_temp_max = 100.0)
+
+
+def torque_constant(kV):
+    '''return torque constant in Nm/Amp of a motor of the given kV, on any backend'''
+    return 60.0 / (2.0 * pi * kV)
+
+def io_current(rpm, i0_current, i0_voltage, kV):
+    '''return the base current for a motor at a given RPM, as i0 scaled linearly with RPM'''
+    return i0_current * (rpm / (i0_voltage * kV))
+
+def torque_balance(xp, rpm, D, CP, rho, supply_voltage, kV, esr, current_lim, i0_current, i0_voltage, torque_constant):
+    '''
+    calculate the excess of motor torque over the torque load of a prop
+    of diameter D metres and power coefficient CP in air of density rho
+    at the given RPM, on backend xp. esr includes any supply resistance
+    '''
+    # calculate propeller torque load
+    nD = (rpm / 60) * D
+    prop_power = CP * (rho * (nD*nD*nD) * (D*D))
+    prop_torque = prop_power / (2.0 * pi * rpm / 60)
+
+    # calculate motor torque, limiting motor current if necessary
+    emf = rpm / kV
+    motor_current = (supply_voltage - emf) / esr
+    current_limited = motor_current > current_lim
+    motor_current = xp.where(current_limited, current_lim, motor_current)
+
+    # calculate excess torque - assume motor i0 varies linearly with back emf
+    excess_torque = (motor_current - i0_current * emf / i0_voltage) * torque_constant - prop_torque
+    return struct(nD = nD,
+                  emf = emf,
+                  motor_current = motor_current,
+                  current_limited = current_limited,
+                  prop_torque = prop_torque,
+                  excess_torque = excess_torque,
+                  excess_CQ = excess_torque / (rho * (nD*nD) * (D*D)))
+
+def torque_slope(xp, t, rpm, D, CP, JdCP, rho, kV, esr, i0_current, i0_voltage, torque_constant):
+    '''
+    derivative with respect to RPM of the excess torque of a
+    torque_balance() result t, for the Newton solvers, on backend xp.
+    JdCP is J times the derivative of CP with respect to J, or zero
+    when J is fixed
+    '''
+    # propeller torque is proportional to CP * RPM^2
+    torque_per_CP = (rho * (t.nD*t.nD*t.nD) * (D*D)) / (2.0 * pi * rpm / 60)
+    dprop_torque = torque_per_CP * (2.0 * CP - JdCP) / rpm
+    dmotor_current = xp.where(t.current_limited, 0.0, -1.0 / (kV * esr))
+    return (dmotor_current - i0_current / (i0_voltage * kV)) * torque_constant - dprop_torque
 
 class motor(object):
     '''model a motor'''
 
     def __init__(self, motor_type):
         if motor_type not in motors:
-            error("Unknown motor type %s. Choices are %s" % (motor_type, motors.keys()))
+            raise model_error("Unknown motor type %s. Choices are %s" % (motor_type, motors.keys()))
         self.motor_type = motor_type
         self.data = motors[motor_type]
 
@@ -95,8 +166,8 @@ class motor(object):
 
     def get_io_current_rpm(self, rpm):
         '''return the base current for a motor at a given RPM'''
-        return self.get_i0_current() * (rpm / (self.get_i0_voltage() * self.get_kV()))
+        return io_current(rpm, self.get_i0_current(), self.get_i0_voltage(), self.get_kV())
 
     def get_torque_constant(self):
         '''return torque constant in Nm/Amp'''
-        return 60.0 / (2.0 *  pi * self.get_kV())
+        return torque_constant(self.get_kV())
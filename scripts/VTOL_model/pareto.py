@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+'''
+multi-objective search for VTOL propulsion configurations
+
+explores the prop, motor and battery catalogues together with
+continuous parameters such as wing span, aspect ratio, cell counts and
+prop diameter, keeping only the configurations that are not dominated
+on every objective by another one. The search is evolutionary, with
+non-dominated sorting and crowding distance used to pick survivors
+(as in NSGA-II), so the front is found without evaluating the whole
+cartesian product.
+
+list options take comma separated values, or 'all' for every entry in
+the catalogue. Numeric options take a single value, comma separated
+values, or a lower:upper range to search continuously, for example
+  pareto.py --prop-model all --wing-span 2:4 --cell-series 6:14
+
+objectives are output names from batch.output_fields with :min or :max.
+Changes to the front are streamed to stdout as CSV rows as each
+generation improves it
+
+released under GPLv3
+'''
+
+import optparse
+import random
+import csv
+import sys
+import os
+import numpy as np
+import batch
+import sweep
+import propeller
+import vtol_model
+from util import *
+
+# options searched by default, the rest stay at their vtol_model.py defaults
+default_space = {
+    'prop_model' : 'all',
+    'motor_type' : 'all',
+    'battery_model' : 'all',
+    'prop_diameter' : '8:14',
+    'cell_series' : '6:14',
+    'cell_parallel' : '1:4',
+    'wing_span' : '2:4',
+    'aspect_ratio' : '6:12',
+}
+
+default_objectives = 'hover_endurance_minutes:max,hover_motor_current:min,mass_auw:min,climb_rate_min:max'
+
+class parameter(object):
+    '''one model option of the search space, either a list of choices or a continuous range'''
+
+    def __init__(self, name, otype, spec):
+        self.name = name
+        self.otype = otype
+        self.choices = None
+        r = spec.split(':')
+        if otype is not str and len(r) == 2:
+            self.lower, self.upper = [otype(x) for x in r]
+            if self.upper < self.lower:
+                error("bad range %s for %s, expected lower:upper" % (spec, name))
+        else:
+            self.choices = sweep.parse_values(name, otype, spec)
+
+    def is_fixed(self):
+        '''return True if there is only one possible value'''
+        if self.choices is not None:
+            return len(self.choices) == 1
+        return self.lower == self.upper
+
+    def sample(self, rng):
+        '''return a random value'''
+        if self.choices is not None:
+            return rng.choice(self.choices)
+        if self.otype is int:
+            return rng.randint(self.lower, self.upper)
+        return rng.uniform(self.lower, self.upper)
+
+    def mutate(self, value, rng):
+        '''return a value near value, or any choice for a list'''
+        if self.choices is not None:
+            return rng.choice(self.choices)
+        value += rng.gauss(0.0, 0.1 * (self.upper - self.lower))
+        if self.otype is int:
+            value = int(round(value))
+        return min(max(value, self.lower), self.upper)
+
+def parse_objectives(spec):
+    '''parse a comma separated list of name:min or name:max objectives, returning (name, sign) pairs'''
+    names = [f[0] for f in batch.output_fields]
+    objectives = []
+    for item in spec.split(','):
+        r = item.split(':')
+        if len(r) != 2 or r[1] not in ('min', 'max'):
+            error("bad objective %s, expected name:min or name:max" % item)
+        if r[0] not in names:
+            error("Unknown objective %s. Choices are %s" % (r[0], names))
+        # objectives are all minimised internally
+        objectives.append((r[0], 1.0 if r[1] == 'min' else -1.0))
+    return objectives
+
+def dominance(F, G=None):
+    '''
+    return a boolean matrix D with D[i,j] True if row i of F dominates
+    row j of G (F if G is None), minimising every column
+    '''
+    if G is None:
+        G = F
+    le = np.all(F[:,None,:] <= G[None,:,:], axis=2)
+    lt = np.any(F[:,None,:] < G[None,:,:], axis=2)
+    return le & lt
+
+def nondominated_sort(F):
+    '''return the front number of each row of F, 0 for the non-dominated rows'''
+    D = dominance(F)
+    dominated_by = D.sum(axis=0)
+    rank = np.full(len(F), -1)
+    front = 0
+    current = np.flatnonzero(dominated_by == 0)
+    while len(current) > 0:
+        rank[current] = front
+        dominated_by = dominated_by - D[current].sum(axis=0)
+        dominated_by[rank >= 0] = -1
+        current = np.flatnonzero(dominated_by == 0)
+        front += 1
+    return rank
+
+def crowding_distance(F):
+    '''return the crowding distance of each row of F within its front'''
+    n = len(F)
+    distance = np.zeros(n)
+    if n <= 2:
+        distance[:] = np.inf
+        return distance
+    for k in range(F.shape[1]):
+        order = np.argsort(F[:,k], kind='stable')
+        f = F[order,k]
+        distance[order[0]] = distance[order[-1]] = np.inf
+        if not np.isfinite(f[-1]):
+            continue
+        span = f[-1] - f[0]
+        if span > 0:
+            distance[order[1:-1]] += (f[2:] - f[:-2]) / span
+    return distance
+
+class search(object):
+    '''evolutionary multi-objective search over a space of model options'''
+
+    def __init__(self, space, objectives, population_size, seed):
+        self.space = space
+        self.objectives = objectives
+        self.population_size = population_size
+        self.rng = random.Random(seed)
+        self.variable = [k for k, p in enumerate(space) if not p.is_fixed()]
+        self.mutation_rate = 1.0 / max(len(self.variable), 1)
+        self.output_names = [f[0] for f in batch.output_fields]
+        self.objective_columns = [self.output_names.index(name) for (name, sign) in objectives]
+        self.signs = np.array([sign for (name, sign) in objectives])
+        self.evaluated = set()
+        self.evaluations = 0
+        # population and non-dominated archive, as lists of values, output rows and objective matrices
+        self.population = struct(values = [], outputs = [], F = np.zeros((0, len(objectives))))
+        self.front = struct(values = [], outputs = [], F = np.zeros((0, len(objectives))))
+
+    def evaluate(self, candidates):
+        '''evaluate a list of candidate value lists, returning output rows and the objective matrix'''
+        names = [p.name for p in self.space]
+        configs = [vtol_model.vtol_config(**dict(zip(names, v))) for v in candidates]
+        r = batch.evaluate(batch.config_batch(configs))
+        self.evaluations += len(candidates)
+        outputs = batch.output_rows(r)
+        F = np.full((len(candidates), len(self.objectives)), np.inf)
+        for k in np.flatnonzero(r.ok):
+            F[k] = [outputs[k][c] for c in self.objective_columns]
+            F[k] *= self.signs
+        F[~np.all(np.isfinite(F), axis=1)] = np.inf
+        return outputs, F
+
+    def new_candidates(self, count, make):
+        '''return up to count candidates from make() that have not been evaluated before'''
+        candidates = []
+        tries = 0
+        while len(candidates) < count and tries < 20 * count:
+            tries += 1
+            v = make()
+            key = tuple(v)
+            if key in self.evaluated:
+                continue
+            self.evaluated.add(key)
+            candidates.append(v)
+        return candidates
+
+    def random_candidate(self):
+        '''return a random candidate'''
+        return [p.sample(self.rng) for p in self.space]
+
+    def tournament(self, rank, distance):
+        '''binary tournament on front number, then crowding distance'''
+        a = self.rng.randrange(len(rank))
+        b = self.rng.randrange(len(rank))
+        if rank[a] != rank[b]:
+            return a if rank[a] < rank[b] else b
+        return a if distance[a] >= distance[b] else b
+
+    def offspring(self, rank, distance):
+        '''return a candidate bred from two parents by uniform crossover and mutation'''
+        a = self.population.values[self.tournament(rank, distance)]
+        b = self.population.values[self.tournament(rank, distance)]
+        child = [a[k] if self.rng.random() < 0.5 else b[k] for k in range(len(a))]
+        for k in self.variable:
+            if self.rng.random() < self.mutation_rate:
+                child[k] = self.space[k].mutate(child[k], self.rng)
+        return child
+
+    def select(self, values, outputs, F):
+        '''keep the best population_size candidates by front number and crowding distance'''
+        rank = nondominated_sort(F)
+        distance = np.zeros(len(F))
+        for front in np.unique(rank):
+            members = np.flatnonzero(rank == front)
+            distance[members] = crowding_distance(F[members])
+        order = np.lexsort((-distance, rank))[:self.population_size]
+        self.population = struct(values = [values[k] for k in order],
+                                 outputs = [outputs[k] for k in order],
+                                 F = F[order])
+        return rank[order], distance[order]
+
+    def update_front(self, values, outputs, F):
+        '''
+        merge new evaluations into the non-dominated archive, pruning
+        members they dominate. Returns the indexes of the added entries
+        in the new front, and the removed entries
+        '''
+        feasible = np.flatnonzero(np.all(np.isfinite(F), axis=1))
+        values = [values[k] for k in feasible]
+        outputs = [outputs[k] for k in feasible]
+        F = F[feasible]
+        if len(F) == 0:
+            return [], []
+
+        # keep the new points not dominated by the front or each other
+        new = np.zeros(len(F), dtype=bool)
+        new[nondominated_sort(F) == 0] = True
+        if len(self.front.F) > 0:
+            new &= ~dominance(self.front.F, F).any(axis=0)
+            # drop points identical to an existing front member
+            new &= ~np.all(self.front.F[:,None,:] == F[None,:,:], axis=2).any(axis=0)
+        new = np.flatnonzero(new)
+        if len(new) == 0:
+            return [], []
+
+        # prune front members dominated by the new points
+        keep = ~dominance(F[new], self.front.F).any(axis=0)
+        removed = [(self.front.values[k], self.front.outputs[k]) for k in np.flatnonzero(~keep)]
+        kept = np.flatnonzero(keep)
+        start = len(kept)
+        self.front = struct(values = [self.front.values[k] for k in kept] + [values[k] for k in new],
+                            outputs = [self.front.outputs[k] for k in kept] + [outputs[k] for k in new],
+                            F = np.vstack([self.front.F[kept], F[new]]))
+        return list(range(start, len(self.front.F))), removed
+
+    def initialise(self):
+        '''evaluate a random initial population, returning the front changes'''
+        candidates = self.new_candidates(self.population_size, self.random_candidate)
+        outputs, F = self.evaluate(candidates)
+        self.select(candidates, outputs, F)
+        return self.update_front(candidates, outputs, F)
+
+    def generation(self):
+        '''breed and evaluate one generation, returning the front changes'''
+        rank, distance = self.select(self.population.values, self.population.outputs, self.population.F)
+        candidates = self.new_candidates(self.population_size, lambda: self.offspring(rank, distance))
+        if len(candidates) == 0:
+            return [], []
+        outputs, F = self.evaluate(candidates)
+        self.select(self.population.values + candidates,
+                    self.population.outputs + outputs,
+                    np.vstack([self.population.F, F]))
+        return self.update_front(candidates, outputs, F)
+
+def write_front(filename, header, front):
+    '''write the current front to a CSV file, replacing it atomically'''
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for k in range(len(front.values)):
+            writer.writerow(front.values[k] + front.outputs[k])
+    os.replace(tmp, filename)
+
+def main():
+    parser = optparse.OptionParser("pareto.py [options]")
+    for (name, otype, default, help_text) in vtol_model.options:
+        parser.add_option("--" + name.replace('_', '-'), default=default_space.get(name, str(default)),
+                          help=help_text + ' values or range [default: %default]')
+    parser.add_option("--objectives", default=default_objectives, help='objectives as name:min or name:max [default: %default]')
+    parser.add_option("--population", type='int', default=200, help='population size [default: %default]')
+    parser.add_option("--generations", type='int', default=50, help='number of generations [default: %default]')
+    parser.add_option("--seed", type='int', default=1, help='random seed [default: %default]')
+    parser.add_option("--front", default=None, help='CSV file to keep the current front in')
+    parser.add_option("--prop-cache", default=None, help='file to keep fitted prop polynomials in between runs')
+    opts, args = parser.parse_args()
+
+    if opts.prop_cache is not None:
+        propeller.fits.set_file(opts.prop_cache)
+
+    space = [parameter(name, otype, getattr(opts, name)) for (name, otype, default, help_text) in vtol_model.options]
+    s = search(space, parse_objectives(opts.objectives), opts.population, opts.seed)
+
+    names = [p.name for p in space]
+    header = names + s.output_names
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['generation', 'change'] + header)
+
+    for gen in range(opts.generations + 1):
+        if gen == 0:
+            added, removed = s.initialise()
+        else:
+            added, removed = s.generation()
+        for (values, outputs) in removed:
+            writer.writerow([gen, 'removed'] + values + outputs)
+        for k in added:
+            writer.writerow([gen, 'added'] + s.front.values[k] + s.front.outputs[k])
+        sys.stdout.flush()
+        if added and opts.front is not None:
+            write_front(opts.front, header, s.front)
+        sys.stderr.write("generation %u: front %u evaluations %u\n" % (gen, len(s.front.values), s.evaluations))
+
+if __name__ == '__main__':
+    main()
@@ -106,7 +106,7 @@ propellers['GWS3x3'] = [
     (0.880591, 0.018599, 0.042128, 0.388786),
     (0.909215, 0.010148, 0.037346, 0.247025),
     (0.941030, 0.000305, 0.031559, 0.009104),
-    (0.968062 -0.007619, 0.026737 -0.275876)
+    (0.968062, -0.007619, 0.026737, -0.275876)
     ]
 
 # define prop data using wind tunnel data from GWS 4x2.5 at 14000 RPM
@@ -140,7 +140,7 @@ propellers['GWS4x2.5'] = [
     (0.552313, 0.015736, 0.023939, 0.363058),
     (0.580812, 0.008231, 0.021221, 0.225300),
     (0.605653, 0.001675, 0.018642, 0.054375),
-    (0.629285 -0.005953, 0.015523 -0.241502)
+    (0.629285, -0.005953, 0.015523, -0.241502)
     ]
 
 # define prop data using wind tunnel data from GWS 4x4 at 10000 RPM
@@ -176,7 +176,7 @@ propellers['GWS4x4'] = [
     (0.842762, 0.024823, 0.043212, 0.484112),
     (0.877076, 0.015516, 0.037583, 0.362080),
     (0.910748, 0.005530, 0.031324, 0.160770),
-    (0.949701 -0.005079, 0.024517 -0.196766)
+    (0.949701, -0.005079, 0.024517, -0.196766)
     ]
 
 # define prop data using wind tunnel data from APC 8x4, 8x6 and 8x8 thin electric at 5000 RPM
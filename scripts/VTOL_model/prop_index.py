@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+'''
+propeller catalogue summary index
+
+a summary of every prop in the catalogue, for choosing candidate props
+before a sweep without constructing each propeller: the nominal
+diameter and pitch parsed from the model name, the J range of the data,
+the peak ETA and its J, and the static CT and CP at J=0. The summaries
+are computed once, when a prop store is compiled or on first use, and
+queried as columns:
+
+  index = prop_index.get_index()
+  models = index.query(diameter_in=(9, 12), ETA_max=(0.7, None), covers_J=0.5)
+
+or from the command line
+
+  ./prop_index.py --where diameter_in=9:12,ETA_max=0.7:,covers_J=0.5
+
+released under GPLv3
+'''
+
+import optparse
+import json
+import numpy as np
+import propeller
+from util import *
+
+# summary fields, as (name, description)
+fields = [
+    ('diameter_in', 'nominal diameter from the model name, inches'),
+    ('pitch_in', 'nominal pitch from the model name, inches'),
+    ('pitch_ratio', 'pitch to diameter ratio'),
+    ('J_min', 'smallest J in the data'),
+    ('J_max', 'largest J in the data'),
+    ('ETA_max', 'peak fitted ETA'),
+    ('J_ETA_max', 'J of peak fitted ETA'),
+    ('CT_static', 'fitted CT at J=0'),
+    ('CP_static', 'fitted CP at J=0'),
+]
+
+field_names = [f[0] for f in fields]
+
+def summarise(prop):
+    '''return the summary of a propeller.propeller as a dictionary of field values'''
+    size = propeller.parse_prop_name(prop.get_prop_model())
+    J_best = prop.find_best_ETA(0.01)
+    return { 'diameter_in' : size[0] if size is not None else float('nan'),
+             'pitch_in' : size[1] if size is not None else float('nan'),
+             'pitch_ratio' : prop.data_pitch_ratio,
+             'J_min' : prop.get_J_min(),
+             'J_max' : prop.get_J_max(),
+             'ETA_max' : float(prop.poly_ETA(J_best)),
+             'J_ETA_max' : J_best,
+             'CT_static' : float(prop.poly_CT(0.0)),
+             'CP_static' : float(prop.poly_CP(0.0)) }
+
+class prop_index(object):
+    '''summaries of a set of prop models, as one array per field'''
+
+    def __init__(self, summaries):
+        self.models = sorted(summaries)
+        self.columns = dict((name, np.array([summaries[m][name] for m in self.models], dtype=float))
+                            for name in field_names)
+
+    def summary(self, prop_model):
+        '''return the summary of one prop model as a dictionary'''
+        k = self.models.index(prop_model)
+        return dict((name, float(self.columns[name][k])) for name in field_names)
+
+    def to_dict(self):
+        '''return the summaries as a dictionary of prop model to field values'''
+        return dict((m, self.summary(m)) for m in self.models)
+
+    def query(self, covers_J=None, **ranges):
+        '''
+        return the sorted prop models with every given field within its
+        (lower, upper) range, where either bound may be None, and with
+        covers_J, if given, inside the J range of the data
+        '''
+        keep = np.ones(len(self.models), dtype=bool)
+        for name, (lower, upper) in ranges.items():
+            if name not in self.columns:
+                raise model_error("Unknown prop index field %s. Choices are %s" % (name, field_names))
+            v = self.columns[name]
+            with np.errstate(invalid='ignore'):
+                if lower is not None:
+                    keep &= v >= lower
+                if upper is not None:
+                    keep &= v <= upper
+        if covers_J is not None:
+            keep &= (self.columns['J_min'] <= covers_J) & (self.columns['J_max'] >= covers_J)
+        return [self.models[k] for k in np.flatnonzero(keep)]
+
+    def save(self, filename):
+        '''write the summaries to a JSON file'''
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+
+def build(models=None):
+    '''build an index by fitting each prop model, by default every prop in the catalogue'''
+    if models is None:
+        models = propeller.prop_models()
+    return prop_index(dict((m, summarise(propeller.propeller(m, 1.0))) for m in models))
+
+def load(filename):
+    '''load an index written by prop_index.save()'''
+    with open(filename) as f:
+        return prop_index(json.load(f))
+
+# the index of the current catalogue and the prop store it is for,
+# remembered by get_index()
+index = None
+index_store = None
+
+def get_index():
+    '''
+    return the index of the current catalogue, taken from the prop
+    store if it has summaries, otherwise built once and remembered
+    '''
+    global index, index_store
+    store = propeller.store
+    if index is None or index_store is not store:
+        summaries = getattr(store, 'summaries', None)
+        index = prop_index(summaries) if summaries else build()
+        index_store = store
+    return index
+
+def parse_where(spec):
+    '''
+    parse comma separated name=lower:upper ranges, where either bound
+    may be empty, and covers_J=J, returning keyword arguments for query()
+    '''
+    kwargs = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            raise model_error("bad condition %s, expected name=lower:upper" % item)
+        name, value = item.split('=', 1)
+        try:
+            if name == 'covers_J':
+                kwargs[name] = float(value)
+                continue
+            r = value.split(':')
+            if len(r) == 1:
+                r = [r[0], r[0]]
+            if len(r) != 2:
+                raise ValueError
+            kwargs[name] = tuple(float(x) if x else None for x in r)
+        except ValueError:
+            raise model_error("bad range %s for %s, expected lower:upper" % (value, name))
+    return kwargs
+
+def main():
+    parser = optparse.OptionParser("prop_index.py [options]")
+    parser.add_option("--where", default=None, help='conditions as name=lower:upper, comma separated, with fields %s and covers_J=J' % field_names)
+    parser.add_option("--prop-store", default=None, help='compiled prop store file to take prop data and summaries from')
+    parser.add_option("--models-only", action='store_true', default=False, help='print just a comma separated list of models, for sweep.py --prop-model')
+    opts, args = parser.parse_args()
+
+    if opts.prop_store is not None:
+        import prop_store
+        propeller.use_store(prop_store.prop_store(opts.prop_store))
+    idx = get_index()
+    try:
+        models = idx.query(**parse_where(opts.where)) if opts.where else idx.models
+    except model_error as e:
+        error(str(e))
+    if opts.models_only:
+        print(','.join(models))
+        return
+    print('%-14s' % 'prop' + ''.join('%12s' % name for name in field_names))
+    for m in models:
+        s = idx.summary(m)
+        print('%-14s' % m + ''.join('%12.3f' % s[name] for name in field_names))
+
+if __name__ == '__main__':
+    main()
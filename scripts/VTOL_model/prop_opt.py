@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+'''
+continuous prop diameter optimizer
+
+for each prop model, finds the diameter that maximises (or minimises)
+one output of vtol_model.evaluate, holding every other option fixed.
+A coarse scan over the diameter range brackets the best point and a
+golden section search refines it. Each candidate starts its cruise and
+hover solvers from the converged solution of the nearest diameter
+already evaluated, so the inner solves take only a few iterations.
+
+The CT and CP data of a prop model are only valid at the pitch to
+diameter ratio of the prop in the wind tunnel, so pitch is chosen by
+comparing the prop models of different pitch ratios, for example
+
+  ./prop_opt.py --prop-model APC9x4.5,APC9x6,APC9x7.5,APC9x9 --diameter-range 8:14
+
+released under GPLv3
+'''
+
+import optparse
+import sweep
+import propeller
+import memo
+import vtol_model
+from util import *
+
+# outputs that can be optimized, as name : function of a vtol_result
+objectives = {
+    'endurance_minutes' : lambda r: r.cruise.endurance_minutes,
+    'sag_endurance_minutes' : lambda r: r.cruise.sag.endurance_minutes,
+    'range_km' : lambda r: r.cruise.range_still_air/1000.0,
+    'hover_endurance_minutes' : lambda r: r.hover.corrected_endurance_minutes,
+    'hover_range_km' : lambda r: r.hover.corrected_range/1000.0,
+    'climb_rate_max' : lambda r: r.climb_max.climb_rate,
+    'climb_rate_min' : lambda r: r.climb_min.climb_rate,
+    'hover_motor_current' : lambda r: r.hover.motor_current,
+    'cruise_batt_power' : lambda r: r.cruise.batt_power,
+}
+
+# golden ratio conjugate, the fraction of the bracket kept each step
+golden = (5 ** 0.5 - 1) / 2
+
+def parse_objective(spec):
+    '''parse name:min or name:max, returning (name, sign) with the objective maximised as sign*value'''
+    r = spec.split(':')
+    if len(r) != 2 or r[1] not in ('min', 'max'):
+        error("bad objective %s, expected name:min or name:max" % spec)
+    if r[0] not in objectives:
+        error("Unknown objective %s. Choices are %s" % (r[0], sorted(objectives)))
+    return r[0], (1.0 if r[1] == 'max' else -1.0)
+
+def solver_iterations(r):
+    '''return the total inner solver iterations of a vtol_result'''
+    return (r.cruise.iterations + r.climb_max.iterations + r.climb_min.iterations +
+            r.hover.iterations + r.hover.torque_iterations)
+
+class diameter_search(object):
+    '''search over the diameter of one prop model'''
+
+    def __init__(self, config, prop_model, lower, upper, objective, sign, warm=True):
+        self.config = config
+        self.prop_model = prop_model
+        self.lower = lower
+        self.upper = upper
+        self.objective = objectives[objective]
+        self.sign = sign
+        self.warm = warm
+        self.evaluated = {} # diameter : (score, vtol_result or None)
+        self.iterations = 0
+
+    def nearest_result(self, diameter):
+        '''return the successful result with the diameter closest to diameter, or None'''
+        best = None
+        for d, (score, r) in self.evaluated.items():
+            if r is not None and (best is None or abs(d - diameter) < abs(best[0] - diameter)):
+                best = (d, r)
+        return best[1] if best is not None else None
+
+    def score(self, diameter):
+        '''return sign*objective at diameter, or -inf if the configuration fails'''
+        if diameter in self.evaluated:
+            return self.evaluated[diameter][0]
+        values = dict((name, getattr(self.config, name)) for name in vtol_model.option_names)
+        values.update(prop_model = self.prop_model, prop_diameter = diameter)
+        start = self.nearest_result(diameter) if self.warm else None
+        try:
+            r = vtol_model.evaluate(vtol_model.vtol_config(**values), start)
+            self.iterations += solver_iterations(r)
+            s = self.sign * self.objective(r)
+        except model_error:
+            r = None
+            s = float('-inf')
+        self.evaluated[diameter] = (s, r)
+        return s
+
+    def run(self, scan_points=7, tolerance=0.01):
+        '''
+        return (diameter, result) at the best score found, scanning
+        scan_points diameters then refining to within tolerance inches.
+        result is None if every diameter failed
+        '''
+        step = (self.upper - self.lower) / float(scan_points - 1)
+        scan = [self.lower + k * step for k in range(scan_points)]
+        scores = [self.score(d) for d in scan]
+        k = max(range(scan_points), key=lambda i: scores[i])
+        if scores[k] == float('-inf'):
+            return None, None
+
+        # golden section search within the scan points either side of the best
+        a = scan[max(k - 1, 0)]
+        b = scan[min(k + 1, scan_points - 1)]
+        c = b - golden * (b - a)
+        d = a + golden * (b - a)
+        fc, fd = self.score(c), self.score(d)
+        while b - a > tolerance:
+            if fc >= fd:
+                b, d, fd = d, c, fc
+                c = b - golden * (b - a)
+                fc = self.score(c)
+            else:
+                a, c, fc = c, d, fd
+                d = a + golden * (b - a)
+                fd = self.score(d)
+
+        best = max(self.evaluated, key=lambda x: self.evaluated[x][0])
+        return best, self.evaluated[best][1]
+
+def main():
+    parser = optparse.OptionParser("prop_opt.py [options]")
+    vtol_model.add_options(parser)
+    parser.add_option("--diameter-range", default='8:14', help='prop diameter range to search, lower:upper inches [default: %default]')
+    parser.add_option("--objective", default='hover_endurance_minutes:max', help='output to optimize, as name:min or name:max [default: %default]')
+    parser.add_option("--scan-points", type='int', default=7, help='diameters scanned before refining [default: %default]')
+    parser.add_option("--tolerance", type='float', default=0.01, help='diameter tolerance in inches [default: %default]')
+    parser.add_option("--no-warm-start", action='store_true', default=False, help='start every solve from scratch')
+    parser.add_option("--prop-cache", default=None, help='file to keep fitted prop polynomials in between runs')
+    parser.add_option("--memo", type='int', default=0, help='remember up to this many results of each model stage and print the stage hit rates [default: off]')
+    opts, args = parser.parse_args()
+
+    if opts.prop_cache is not None:
+        propeller.fits.set_file(opts.prop_cache)
+    if opts.memo > 0:
+        vtol_model.set_memo(memo.stage_memo(opts.memo))
+    r = opts.diameter_range.split(':')
+    if len(r) != 2:
+        error("bad diameter range %s, expected lower:upper" % opts.diameter_range)
+    lower, upper = float(r[0]), float(r[1])
+    if not 0 < lower < upper:
+        error("bad diameter range %s" % opts.diameter_range)
+    if opts.scan_points < 3:
+        error("need at least 3 scan points")
+    objective, sign = parse_objective(opts.objective)
+
+    config = vtol_model.vtol_config(**dict((name, getattr(opts, name)) for name in vtol_model.option_names))
+    prop_models = sweep.parse_values('prop_model', str, opts.prop_model)
+
+    print('%-14s %7s %9s %8s %12s %6s %10s' % ('prop', 'P/D', 'diameter', 'pitch', objective, 'evals', 'iterations'))
+    best = None
+    for prop_model in prop_models:
+        s = diameter_search(config, prop_model, lower, upper, objective, sign, not opts.no_warm_start)
+        diameter, result = s.run(opts.scan_points, opts.tolerance)
+        if result is None:
+            print('%-14s %7.3f %9s %8s %12s %6u %10u' % (prop_model, propeller.get_pitch_ratio(prop_model),
+                                                        '-', '-', 'failed', len(s.evaluated), s.iterations))
+            continue
+        value = objectives[objective](result)
+        print('%-14s %7.3f %9.2f %8.2f %12.3f %6u %10u' % (prop_model, result.prop.data_pitch_ratio, diameter,
+                                                          result.prop.get_pitch_in(), value, len(s.evaluated), s.iterations))
+        if best is None or sign * value > sign * best[2]:
+            best = (prop_model, diameter, value, result)
+    if best is None:
+        error("no prop model gave a solution")
+    print('best: %s at %.2f in diameter, %.2f in pitch, %s = %.3f' % (best[0], best[1], best[3].prop.get_pitch_in(), objective, best[2]))
+    if vtol_model.memo is not None:
+        print(vtol_model.memo.report())
+
+if __name__ == '__main__':
+    main()
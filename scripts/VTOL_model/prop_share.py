@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+'''
+the propeller catalogue packed into one contiguous buffer
+
+the raw J, CT, CP and ETA data of every prop in prop_data.py, or the
+prop store in use, and the fitted CT, CP and ETA polynomial
+coefficients are packed once into a single buffer: a little-endian length, a JSON index, then float64
+values. Worker processes attach to the buffer through
+multiprocessing.shared_memory, or map the same layout from a file, and
+use views into it without copying or refitting anything:
+
+  shared = prop_share.create_shared()
+  # in each worker
+  c = prop_share.attach_shared(shared.name)
+  propeller.use_catalogue(c)
+'''
+
+import json
+import numpy as np
+import propeller
+from multiprocessing import shared_memory
+
+# data columns of each row: J, CT, CP, ETA
+data_columns = 4
+
+def pack():
+    '''fit every prop and return the packed catalogue as a bytearray'''
+    models = propeller.prop_models()
+    props = [propeller.propeller(m, 1.0) for m in models]
+    data = [np.array([tuple(row) for row in p.raw_prop_data], dtype=np.float64) for p in props]
+    rows = []
+    start = 0
+    for d in data:
+        rows.append([start, len(d)])
+        start += len(d)
+    blocks = [np.concatenate(data).ravel()]
+    offsets = {}
+    offset = blocks[0].size
+    for (name, column, order) in propeller.poly_fits:
+        coefs = np.array([getattr(p, 'poly_' + name).coeffs for p in props], dtype=np.float64)
+        offsets[name] = [offset, order + 1]
+        offset += coefs.size
+        blocks.append(coefs.ravel())
+    index = json.dumps({ 'models' : models,
+                         'rows' : rows,
+                         'coefs' : offsets,
+                         'size' : offset }).encode('utf-8')
+    header = 8 + len(index)
+    header += (-header) % 8
+    buf = bytearray(header + 8 * offset)
+    buf[:8] = len(index).to_bytes(8, 'little')
+    buf[8:8+len(index)] = index
+    buf[header:] = np.concatenate(blocks).astype('<f8').tobytes()
+    return buf
+
+class prop_catalogue(object):
+    '''
+    read-only views of a packed catalogue held in any buffer: shared
+    memory, a memory-mapped file or bytes
+    '''
+
+    def __init__(self, buf, owner=None):
+        self.owner = owner # the shared memory or map keeping buf alive
+        length = int.from_bytes(bytes(buf[:8]), 'little')
+        self.index = json.loads(bytes(buf[8:8+length]).decode('utf-8'))
+        header = 8 + length
+        header += (-header) % 8
+        self.values = np.ndarray((self.index['size'],), dtype='<f8', buffer=buf, offset=header)
+        self.values.flags.writeable = False
+        self.model_index = dict((m, k) for k, m in enumerate(self.index['models']))
+        self.coefs = {}
+        for name, (offset, count) in self.index['coefs'].items():
+            n = len(self.index['models'])
+            self.coefs[name] = self.values[offset:offset + n*count].reshape(n, count)
+
+    def has_prop(self, prop_model):
+        '''return True if prop_model is in the catalogue'''
+        return prop_model in self.model_index
+
+    def get_data(self, prop_model):
+        '''return the J, CT, CP, ETA rows of a prop as an array view'''
+        start, count = self.index['rows'][self.model_index[prop_model]]
+        return self.values[start*data_columns:(start+count)*data_columns].reshape(count, data_columns)
+
+    def get_poly(self, prop_model, name):
+        '''return the fitted CT, CP or ETA polynomial of a prop'''
+        return np.poly1d(self.coefs[name][self.model_index[prop_model]])
+
+    def close(self):
+        '''release the views and the underlying buffer'''
+        self.values = None
+        self.coefs = {}
+        if self.owner is not None and hasattr(self.owner, 'close'):
+            self.owner.close()
+        self.owner = None
+
+def create_shared():
+    '''
+    pack the catalogue into a new block of shared memory, returning the
+    SharedMemory. The creator should close() and unlink() it when done
+    '''
+    buf = pack()
+    shm = shared_memory.SharedMemory(create=True, size=len(buf))
+    shm.buf[:len(buf)] = buf
+    return shm
+
+def attach_shared(name):
+    '''
+    attach to a packed catalogue in shared memory from a process
+    started by its creator, returning a prop_catalogue
+    '''
+    # child processes share their parent's resource tracker, so the
+    # block stays registered once and is unlinked by its creator
+    shm = shared_memory.SharedMemory(name=name)
+    return prop_catalogue(shm.buf, shm)
+
+def save(filename):
+    '''pack the catalogue into a file, for memory mapping with load()'''
+    with open(filename, 'wb') as f:
+        f.write(pack())
+
+def load(filename):
+    '''memory map a catalogue file written by save(), returning a prop_catalogue'''
+    m = np.memmap(filename, dtype=np.uint8, mode='r')
+    return prop_catalogue(m, m)
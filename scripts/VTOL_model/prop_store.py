@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+'''
+compact binary propeller database
+
+prop_data.py is the source format. It is compiled into a store file
+holding the J, CT, CP and ETA data of each prop as a NumPy structured
+array, laid out one after another, with a JSON index of name to offset
+and row count and the prop_index.py summary of each prop at the
+start. Opening a store only reads the index, and
+the file is memory mapped so the rows of a prop are read from disk the
+first time that prop is used:
+
+  ./prop_store.py --compile props.bin
+  ./vtol_model.py --prop-store props.bin
+
+or from Python
+
+  propeller.use_store(prop_store.prop_store('props.bin'))
+
+released under GPLv3
+'''
+
+import optparse
+import os
+import json
+import numpy as np
+from util import *
+
+# one row of wind tunnel data
+record_dtype = np.dtype([('J', '<f8'), ('CT', '<f8'), ('CP', '<f8'), ('ETA', '<f8')])
+
+# file identifier and format version
+magic = b'VTOLPRP1'
+
+def compile_store(filename, propellers=None):
+    '''
+    write a store file from a dictionary of prop model to lists of
+    (J, CT, CP, ETA) tuples, by default prop_data.propellers
+    '''
+    if propellers is None:
+        import prop_data
+        propellers = prop_data.propellers
+    models = sorted(propellers)
+    arrays = dict((m, np.array([tuple(row) for row in propellers[m]], dtype=record_dtype)) for m in models)
+    index = {}
+    offset = 0
+    for m in models:
+        index[m] = [offset, len(arrays[m])]
+        offset += arrays[m].nbytes
+
+    # summarise the props from this data rather than the current catalogue
+    import propeller
+    import prop_index
+    saved = propeller.store
+    propeller.use_store(array_store(arrays))
+    try:
+        summaries = prop_index.build(models).to_dict()
+    finally:
+        propeller.use_store(saved)
+
+    header = json.dumps({ 'props' : index, 'summaries' : summaries }).encode('utf-8')
+    start = len(magic) + 8 + len(header)
+    start += (-start) % record_dtype.itemsize
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as f:
+        f.write(magic)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        f.write(b'\0' * (start - len(magic) - 8 - len(header)))
+        for m in models:
+            f.write(arrays[m].tobytes())
+    os.replace(tmpname, filename)
+
+class array_store(object):
+    '''prop data held in memory as structured arrays, with the prop_store interface'''
+
+    def __init__(self, arrays):
+        self.filename = 'memory'
+        self.arrays = arrays
+        self.summaries = None
+
+    def models(self):
+        '''return the sorted prop model names'''
+        return sorted(self.arrays)
+
+    def has_prop(self, prop_model):
+        '''return True if prop_model is held'''
+        return prop_model in self.arrays
+
+    def get_data(self, prop_model):
+        '''return the data of a prop as a structured array'''
+        return self.arrays[prop_model]
+
+class prop_store(object):
+    '''
+    a compiled store file, with each prop's data loaded as a read-only
+    structured array view on first use
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                raise model_error("%s is not a prop store file" % filename)
+            length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(length).decode('utf-8'))
+        self.index = header['props']
+        self.summaries = header.get('summaries')
+        self.start = len(magic) + 8 + length
+        self.start += (-self.start) % record_dtype.itemsize
+        self.map = None
+        self.loaded = {}
+
+    def models(self):
+        '''return the sorted prop model names in the store'''
+        return sorted(self.index)
+
+    def has_prop(self, prop_model):
+        '''return True if prop_model is in the store'''
+        return prop_model in self.index
+
+    def get_data(self, prop_model):
+        '''return the data of a prop as a structured array with J, CT, CP and ETA fields'''
+        data = self.loaded.get(prop_model)
+        if data is None:
+            if prop_model not in self.index:
+                raise model_error("propeller %s not found in %s" % (prop_model, self.filename))
+            if self.map is None:
+                self.map = np.memmap(self.filename, dtype=np.uint8, mode='r')
+            offset, count = self.index[prop_model]
+            data = np.ndarray((count,), dtype=record_dtype, buffer=self.map, offset=self.start + offset)
+            self.loaded[prop_model] = data
+        return data
+
+    def close(self):
+        '''release the loaded views and the file map'''
+        self.loaded = {}
+        self.map = None
+
+def main():
+    parser = optparse.OptionParser("prop_store.py [options]")
+    parser.add_option("--compile", default=None, help='compile prop_data.py into a store file')
+    parser.add_option("--list", default=None, help='list the props in a store file')
+    opts, args = parser.parse_args()
+
+    if opts.compile is not None:
+        compile_store(opts.compile)
+    if opts.list is not None:
+        s = prop_store(opts.list)
+        for m in s.models():
+            d = s.get_data(m)
+            print('%-14s %3u points, J %.3f to %.3f' % (m, len(d), d['J'][0], d['J'][-1]))
+    if opts.compile is None and opts.list is None:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
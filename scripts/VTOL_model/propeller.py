@@ -4,57 +4,289 @@
 propeller model class
 '''
 
-import prop_data
-from util import error
+import os
+import re
+import collections
+import hashlib
+import json
+import fcntl
+import multiprocessing.util
+import backend
+from util import model_error, struct
+
+class fit_cache(object):
+    '''
+    cache of fitted polynomials, keyed by a hash of the raw
+    data, column and order. Recently used fits are kept in memory, with
+    least recently used eviction, and can optionally also be kept in a
+    file, which is discarded when prop_data.py changes. New fits are
+    written to the file in batches of save_every and when the process
+    exits, merged with the fits other processes have saved, so sweep
+    workers can share one file. The raw data lists and arrays are
+    treated as immutable
+    '''
+
+    def __init__(self, max_entries=256, save_every=256):
+        self.max_entries = max_entries
+        self.save_every = save_every
+        self.entries = collections.OrderedDict()
+        self.data_hashes = {}
+        self.filename = None
+        self.file_entries = {}
+        self.dirty = set()
+        self.finalizer_pid = None
+        self.prop_data_hash = None
+        self.hits = 0
+        self.misses = 0
+
+    def data_hash(self, data):
+        '''return a hash of a raw data list, remembered by identity'''
+        h = self.data_hashes.get(id(data))
+        if h is None or h[0] is not data:
+            raw = data.tobytes() if hasattr(data, 'tobytes') else repr(data).encode('utf-8')
+            h = (data, hashlib.sha1(raw).hexdigest())
+            self.data_hashes[id(data)] = h
+        return h[1]
+
+    def get(self, data, column, order, fit):
+        '''
+        return a poly1d for data column fitted to order, calling
+        fit(data, column, order) for the coefficients on a miss
+        '''
+        import numpy as np
+        key = "%s:%u:%u" % (self.data_hash(data), column, order)
+        poly = self.entries.get(key)
+        if poly is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return poly
+        coeffs = self.file_entries.get(key)
+        if coeffs is None:
+            self.misses += 1
+            coeffs = fit(data, column, order)
+            if self.filename is not None:
+                self.file_entries[key] = [float(c) for c in coeffs]
+                self.dirty.add(key)
+                if len(self.dirty) >= self.save_every:
+                    self.save()
+        else:
+            self.hits += 1
+        poly = np.poly1d(coeffs)
+        self.entries[key] = poly
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return poly
+
+    def get_prop_data_hash(self):
+        '''return a hash of the prop_data.py source, used to invalidate the cache file'''
+        if self.prop_data_hash is None:
+            filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prop_data.py')
+            with open(filename, 'rb') as f:
+                self.prop_data_hash = hashlib.sha1(f.read()).hexdigest()
+        return self.prop_data_hash
+
+    def load_file(self):
+        '''return the fits saved in the cache file, or none if it is missing or out of date'''
+        try:
+            with open(self.filename) as f:
+                saved = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        if not isinstance(saved, dict) or saved.get('prop_data_hash') != self.get_prop_data_hash():
+            return {}
+        return saved.get('fits', {})
+
+    def set_file(self, filename):
+        '''keep fits in filename as well as in memory, loading any that are still valid'''
+        self.save()
+        self.filename = filename
+        self.file_entries = self.load_file()
+        self.dirty = set()
+        if self.finalizer_pid != os.getpid():
+            # runs at exit, in the main process and in pool workers that
+            # are closed and joined. Forked workers start without the
+            # parent's finalizers, so each process registers its own
+            multiprocessing.util.Finalize(self, self.save, exitpriority=10)
+            self.finalizer_pid = os.getpid()
+
+    def save(self):
+        '''
+        merge the fits found since the last save into the cache file,
+        under a lock so processes sharing the file keep each other's
+        fits, replacing it atomically
+        '''
+        if self.filename is None or not self.dirty:
+            return
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            saved = self.load_file()
+            saved.update((key, self.file_entries[key]) for key in self.dirty)
+            tmpname = "%s.%u.tmp" % (self.filename, os.getpid())
+            with open(tmpname, 'w') as f:
+                json.dump({ 'prop_data_hash' : self.get_prop_data_hash(),
+                            'fits' : saved }, f)
+            os.replace(tmpname, self.filename)
+        self.file_entries.update(saved)
+        self.dirty = set()
+
+# fits shared by all propellers in this process
+fits = fit_cache()
+
+# polynomial fits of the prop data, as (name, data column, order)
+poly_fits = [('CT', 1, 5), ('CP', 2, 6), ('ETA', 3, 8)]
+
+# a prop_share.prop_catalogue to take prop data and fitted polynomials
+# from instead of prop_data.py, set with use_catalogue()
+catalogue = None
+
+def use_catalogue(c):
+    '''take prop data and fitted polynomials from a prop_share.prop_catalogue, or None to fit them again'''
+    global catalogue
+    catalogue = c
+
+# a prop_store.prop_store to take prop data from instead of prop_data.py,
+# set with use_store(). prop_data.py is only imported if needed
+store = None
+
+def use_store(s):
+    '''take prop data from a prop_store.prop_store, or None to use prop_data.py'''
+    global store
+    store = s
+
+def get_prop_data(prop_model):
+    '''return the raw J, CT, CP, ETA data of a prop model from the store or prop_data.py'''
+    if store is not None:
+        if not store.has_prop(prop_model):
+            raise model_error("propeller %s not found in %s" % (prop_model, store.filename))
+        return store.get_data(prop_model)
+    import prop_data
+    if prop_model not in prop_data.propellers:
+        raise model_error("propeller %s not found in prop_data.py" % prop_model)
+    return prop_data.propellers[prop_model]
+
+def prop_models():
+    '''return the sorted names of every prop model in the store or prop_data.py'''
+    if store is not None:
+        return store.models()
+    import prop_data
+    return sorted(prop_data.propellers)
+
+# pitch to diameter ratio assumed for prop models without a size in their name
+default_pitch_ratio = 7.0/11.0
+
+def parse_prop_name(prop_model):
+    '''
+    return the nominal (diameter, pitch) in inches from a prop model name
+    like APC11x7 or AERO_8.5x6.0, or None if the name has no size
+    '''
+    m = re.search(r'(\d+(?:\.\d+)?)x(\d+(?:\.\d+)?)$', prop_model)
+    if m is None:
+        return None
+    return float(m.group(1)), float(m.group(2))
+
+def get_pitch_ratio(prop_model):
+    '''return the pitch to diameter ratio of the prop used to generate the wind tunnel data'''
+    size = parse_prop_name(prop_model)
+    if size is None or size[0] <= 0:
+        return default_pitch_ratio
+    return size[1] / size[0]
+
+def thrust(CT, nD, D, rho):
+    '''return the thrust in Newtons of a prop of diameter D metres in air of density rho, on any backend'''
+    return CT * (rho * (nD*nD) * (D*D))
+
+def power(CP, nD, D, rho):
+    '''return the shaft power in Watts of a prop of diameter D metres in air of density rho, on any backend'''
+    return CP * (rho * (nD*nD*nD) * (D*D))
 
 class propeller(object):
     '''model a single propeller'''
 
-    def __init__(self, prop_model, prop_diameter):
+    def __init__(self, prop_model, prop_diameter, table_points=None, CT_factor=1.0, CP_factor=1.0):
         self.prop_eff = 0.65 # prop efficiency as a fraction of an ideal momentum disc
         self.prop_mass = 0.025
         self.prop_model = prop_model # select propeller model for efficiency curves
-        self.data_pitch_ratio = 7.0/11.0 # pitch to diameter ratio of the prop used to generate the wind tunnel data
+        self.data_pitch_ratio = get_pitch_ratio(prop_model) # pitch to diameter ratio of the prop used to generate the wind tunnel data
         self.prop_dia_m = prop_diameter*0.0254 # prop diameter specified (m).
         self.prop_pitch_m = self.prop_dia_m*self.data_pitch_ratio # Prop pitch calculated to match ratio of prop used to generate coef data.
+        self.CT_factor = CT_factor # CT from the prop data is multiplied by this correction factor
+        self.CP_factor = CP_factor # CP from the prop data is multiplied by this correction factor
+
+        if catalogue is not None and catalogue.has_prop(prop_model):
+            # views into the shared catalogue, already fitted
+            self.raw_prop_data = catalogue.get_data(prop_model)
+            for (name, column, order) in poly_fits:
+                setattr(self, 'poly_' + name, catalogue.get_poly(prop_model, name))
+        else:
+            self.raw_prop_data = get_prop_data(prop_model)
+
+            # fit polynomials to the prop data
+            for (name, column, order) in poly_fits:
+                setattr(self, 'poly_' + name, self.fit_polynomial(self.raw_prop_data, column, order))
 
-        if prop_model not in prop_data.propellers:
-            error("propeller %s not found in prop_data.py")
+        # derivatives for the Newton solvers
+        self.poly_dCT = self.poly_CT.deriv()
+        self.poly_dCP = self.poly_CP.deriv()
 
-        self.raw_prop_data = prop_data.propellers[prop_model]
+        # coefficient lists, for evaluating the polynomials on the scalar backend
+        for name in ('CT', 'CP', 'ETA', 'dCT', 'dCP'):
+            setattr(self, 'coefs_' + name, getattr(self, 'poly_' + name).coeffs.tolist())
 
-        # fit polynomials to the prop data
-        self.poly_CT = self.fit_polynomial(self.raw_prop_data, 1, 5)
-        self.poly_CP = self.fit_polynomial(self.raw_prop_data, 2, 6)
-        self.poly_ETA = self.fit_polynomial(self.raw_prop_data, 3, 8)
+        # optional dense tables replacing the CT, CP and ETA polynomials
+        self.table = None
+        if table_points:
+            self.table = coef_table(self, table_points)
 
     def fit_polynomial(self, data, column, order):
         '''fit and return a poly1d for a set of data, fitting column with an polynomial of the given order'''
+        return fits.get(data, column, order, self.fit_coefficients)
+
+    def fit_coefficients(self, data, column, order):
+        '''fit column of data with a polynomial of the given order, returning the coefficients'''
         import numpy as np
-        x = np.array([xx[0] for xx in data])
-        y = np.array([xx[column] for xx in data])
-        z = np.polyfit(x, y, order)
-        return np.poly1d(z)
+        names = getattr(getattr(data, 'dtype', None), 'names', None)
+        if names is not None:
+            # a structured array from a prop store
+            x = np.asarray(data[names[0]])
+            y = np.asarray(data[names[column]])
+        else:
+            x = np.array([xx[0] for xx in data])
+            y = np.array([xx[column] for xx in data])
+        return np.polyfit(x, y, order)
 
     def get_CT(self, J):
-        '''return CT value'''
-        return self.poly_CT(J)
+        '''return corrected CT value'''
+        if self.table is not None:
+            return self.CT_factor * self.table.lookup(0, J)
+        return self.CT_factor * backend.scalar.polyval(self.coefs_CT, J)
 
     def get_CP(self, J):
-        '''return CP value'''
-        return self.poly_CP(J)
+        '''return corrected CP value'''
+        if self.table is not None:
+            return self.CP_factor * self.table.lookup(1, J)
+        return self.CP_factor * backend.scalar.polyval(self.coefs_CP, J)
+
+    def get_CT_deriv(self, J):
+        '''return derivative of corrected CT with respect to J'''
+        return self.CT_factor * backend.scalar.polyval(self.coefs_dCT, J)
+
+    def get_CP_deriv(self, J):
+        '''return derivative of corrected CP with respect to J'''
+        return self.CP_factor * backend.scalar.polyval(self.coefs_dCP, J)
 
     def get_ETA(self, J):
         '''return ETA value'''
-        return self.poly_ETA(J)
+        if self.table is not None:
+            return self.table.lookup(2, J)
+        return backend.scalar.polyval(self.coefs_ETA, J)
 
     def get_J_min(self):
         '''return smallest J in data'''
-        return self.raw_prop_data[0][0]
+        return float(self.raw_prop_data[0][0])
 
     def get_J_max(self):
         '''return largest J in data'''
-        return self.raw_prop_data[-1][0]
+        return float(self.raw_prop_data[-1][0])
 
     def get_diameter_m(self):
         '''return prop diameter in meters'''
@@ -80,14 +312,88 @@ class propeller(object):
         '''return prop model string'''
         return self.prop_model
 
-    def find_best_ETA(self, step):
-        '''return the J corresponding to highest ETA'''
-        J = self.get_J_min()
-        max_J = self.get_J_max()
-        best_J = J
-        highest_ETA = self.get_ETA(J)
-        while J < max_J:
-            if self.get_ETA(J+step) > highest_ETA:
-                best_J = J
-            J += step
+    def find_best_ETA(self, step=0.01):
+        '''
+        return the J corresponding to highest ETA within the data range.
+        The maximum is found from the real roots of the derivative of the
+        ETA polynomial, falling back to a search on a grid of the given
+        step. Results are remembered per prop model
+        '''
+        best_J = best_ETA_J.get(self.prop_model)
+        if best_J is None:
+            best_J = self.calc_best_ETA(step)
+            best_ETA_J[self.prop_model] = best_J
         return best_J
+
+    def calc_best_ETA(self, step):
+        '''calculate the J corresponding to highest ETA within the data range'''
+        import numpy as np
+        J_min = self.get_J_min()
+        J_max = self.get_J_max()
+        try:
+            roots = self.poly_ETA.deriv().roots
+            candidates = [J_min, J_max] + [r.real for r in roots if abs(r.imag) < 1.0e-9 and J_min < r.real < J_max]
+        except np.linalg.LinAlgError:
+            candidates = None
+        if candidates is None or not np.all(np.isfinite(self.poly_ETA(np.array(candidates)))):
+            candidates = np.arange(J_min, J_max + step, step)
+        candidates = np.array(candidates)
+        return float(candidates[np.argmax(self.poly_ETA(candidates))])
+
+class coef_table(object):
+    '''
+    CT, CP and ETA of a propeller tabulated on a uniform grid of J over
+    the data range, looked up in constant time by linear interpolation.
+    J outside the data range is clamped to it
+    '''
+
+    def __init__(self, prop, points):
+        import numpy as np
+        if points < 2:
+            raise model_error("prop table needs at least 2 points, not %d" % points)
+        self.points = points
+        self.J_min = prop.get_J_min()
+        self.J_max = prop.get_J_max()
+        self.inv_dJ = (points - 1) / (self.J_max - self.J_min)
+        J = np.linspace(self.J_min, self.J_max, points)
+        # one row each for CT, CP and ETA
+        self.values = np.ascontiguousarray([prop.poly_CT(J), prop.poly_CP(J), prop.poly_ETA(J)], dtype=np.float64)
+        # plain lists are faster than indexing numpy arrays for scalar lookups
+        self.rows = self.values.tolist()
+
+    def lookup(self, row, J):
+        '''return the interpolated value of a table row at J, a scalar or an array'''
+        if isinstance(J, (float, int)):
+            x = (J - self.J_min) * self.inv_dJ
+            x = min(max(x, 0.0), self.points - 1)
+            i = min(int(x), self.points - 2)
+            v = self.rows[row]
+            return v[i] + (x - i) * (v[i+1] - v[i])
+        import numpy as np
+        x = np.clip((np.asarray(J, dtype=np.float64) - self.J_min) * self.inv_dJ, 0.0, self.points - 1)
+        i = np.minimum(x.astype(np.intp), self.points - 2)
+        v = self.values[row]
+        return v[i] + (x - i) * (v[i+1] - v[i])
+
+    def max_error(self, prop, samples=16):
+        '''
+        return the largest absolute difference between the table and the
+        fitted polynomials of CT, CP and ETA, sampled at the given number
+        of points per table interval
+        '''
+        import numpy as np
+        J = np.linspace(self.J_min, self.J_max, (self.points - 1) * samples + 1)
+        return struct(CT = float(np.max(np.abs(self.lookup(0, J) - prop.poly_CT(J)))),
+                      CP = float(np.max(np.abs(self.lookup(1, J) - prop.poly_CP(J)))),
+                      ETA = float(np.max(np.abs(self.lookup(2, J) - prop.poly_ETA(J)))))
+
+# J of highest ETA by prop model, filled in by find_best_ETA
+best_ETA_J = {}
+
+def find_best_ETA_batch(prop_models, step=0.01):
+    '''return an array of the J corresponding to highest ETA for each of a list of prop models'''
+    import numpy as np
+    for prop_model in set(prop_models):
+        if prop_model not in best_ETA_J:
+            propeller(prop_model, 1.0).find_best_ETA(step)
+    return np.array([best_ETA_J[prop_model] for prop_model in prop_models])
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+'''
+batched parameter sensitivity analysis
+
+finds the normalized sensitivity coefficient (x/y) dy/dx of every model
+output y to each of a set of inputs x at a base configuration, by
+central differences. The base configuration and both perturbations of
+every input are built as one batch.config_batch and evaluated together
+in a single vectorized pass, so the cost is close to one evaluation:
+
+  ./sensitivity.py --wing-span 2.5
+  ./sensitivity.py --parameters mass_structure,CD0_wing,batt_cell_age_factor --csv sens.csv
+
+A coefficient of -0.5 means a 1% increase in the input lowers the
+output by about 0.5%. The relax solver stops within 0.1% of the
+cruise thrust and climb torque balances but only within 1% of the hover
+thrust, which swamps a 1% step, so the newton solver, which converges
+much more tightly, is the default here
+
+released under GPLv3
+'''
+
+import optparse
+import csv
+import numpy as np
+import batch
+import vtol_model
+from util import *
+
+parameter_names = batch.parameter_names
+
+def perturbed_batch(config, names, step):
+    '''
+    return a config_batch of the base configuration followed by the
+    configuration with each named input scaled by 1+step and then 1-step
+    '''
+    for name in names:
+        if name not in parameter_names:
+            raise model_error("Unknown parameter %s. Choices are %s" % (name, parameter_names))
+    b = batch.config_batch([config] * (2 * len(names) + 1))
+    for k, name in enumerate(names):
+        column = getattr(b, name)
+        column[2*k+1] *= 1.0 + step
+        column[2*k+2] *= 1.0 - step
+    b.update()
+    return b
+
+def analyse(config, names=None, step=0.01):
+    '''
+    return the base value of every batch.output_fields output and the
+    normalized sensitivity coefficients of each to each named input,
+    as an array of shape (inputs, outputs). Coefficients are NaN where
+    a perturbed configuration fails or the base output or input is zero.
+    Raises model_error if the base configuration fails
+    '''
+    if names is None:
+        names = parameter_names
+    if not 0 < step < 1:
+        raise model_error("step must be between 0 and 1, not %s" % step)
+    b = perturbed_batch(config, names, step)
+    inputs = np.array([getattr(b, name)[0] for name in names])
+    r = batch.evaluate(b)
+    if not r.ok[0]:
+        raise model_error(r.errors[0])
+    values = np.column_stack([f(r) for (name, f) in batch.output_fields])
+    base = values[0]
+    plus, minus = values[1::2], values[2::2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coefficients = (plus - minus) / (2.0 * step * base)
+    failed = ~(r.ok[1::2] & r.ok[2::2]) | (inputs == 0)
+    coefficients[failed] = np.nan
+    return struct(parameters = list(names),
+                  inputs = inputs,
+                  outputs = [name for (name, f) in batch.output_fields],
+                  base = base,
+                  coefficients = coefficients,
+                  configs = b.size)
+
+def print_report(s, top):
+    '''print each output's base value and the inputs it is most sensitive to'''
+    print('%-24s %12s  %s' % ('output', 'base', 'largest normalized sensitivities'))
+    for j, output in enumerate(s.outputs):
+        c = s.coefficients[:,j]
+        order = sorted(np.flatnonzero(np.isfinite(c) & (c != 0)), key=lambda k: -abs(c[k]))[:top]
+        print('%-24s %12.4f  %s' % (output, s.base[j], '  '.join('%s %+.3f' % (s.parameters[k], c[k]) for k in order) or '-'))
+    print('evaluated %u configurations in one batch' % s.configs)
+
+def write_csv(s, filename):
+    '''write the full table of coefficients, one row per input and one column per output'''
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['parameter', 'value'] + s.outputs)
+        for k, name in enumerate(s.parameters):
+            writer.writerow([name, s.inputs[k]] + [None if np.isnan(c) else c for c in s.coefficients[k]])
+
+def main():
+    parser = optparse.OptionParser("sensitivity.py [options]")
+    vtol_model.add_options(parser)
+    parser.set_defaults(solver='newton')
+    parser.add_option("--parameters", default=None, help='comma separated inputs to vary, from %s [default: all]' % parameter_names)
+    parser.add_option("--step", type='float', default=0.01, help='relative step of the central differences [default: %default]')
+    parser.add_option("--top", type='int', default=5, help='inputs shown per output [default: %default]')
+    parser.add_option("--csv", default=None, help='file to write every coefficient to as CSV')
+    opts, args = parser.parse_args()
+
+    config = vtol_model.vtol_config(**dict((name, getattr(opts, name)) for name in vtol_model.option_names))
+    names = opts.parameters.split(',') if opts.parameters else None
+    try:
+        s = analyse(config, names, opts.step)
+    except model_error as e:
+        error(str(e))
+    print_report(s, opts.top)
+    if opts.csv is not None:
+        write_csv(s, opts.csv)
+
+if __name__ == '__main__':
+    main()
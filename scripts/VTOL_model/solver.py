@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''
+safeguarded Newton root finding for the VTOL model solvers
+
+the residual functions in the model are monotonic in the solved
+variable (thrust rises with RPM, excess torque falls with RPM), so
+each evaluation tells us which side of the root we are on. That keeps
+the root bracketed, and any Newton step that leaves the bracket, or
+that has a derivative of the wrong sign, is replaced by bisection
+'''
+
+import numpy as np
+from util import model_error
+import telemetry
+
+solvers = ['relax', 'newton']
+
+def newton_step(x, f, df, lower, upper, increasing):
+    '''
+    return the next safeguarded Newton iterate and the updated bracket
+    as (x, lower, upper). upper may be infinite, in which case the
+    bracket is expanded instead of bisected
+    '''
+    if (f > 0) == increasing:
+        upper = x
+    else:
+        lower = x
+    if df != 0 and (df > 0) == increasing:
+        x_new = x - f / df
+        if lower < x_new < upper:
+            return x_new, lower, upper
+    if upper == float('inf'):
+        return lower + 2 * (x - lower), lower, upper
+    return 0.5 * (lower + upper), lower, upper
+
+def newton_step_array(x, f, df, lower, upper, increasing):
+    '''
+    vectorized newton_step for arrays of independent problems. lower
+    and upper are updated in place, and the next iterates are returned
+    '''
+    above = (f > 0) == increasing
+    upper[above] = x[above]
+    lower[~above] = x[~above]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_new = x - f / df
+    good = (df != 0) & ((df > 0) == increasing) & (x_new > lower) & (x_new < upper)
+    bisect = np.where(np.isinf(upper), lower + 2 * (x - lower), 0.5 * (lower + upper))
+    return np.where(good, x_new, bisect)
+
+def newton(func, x, increasing, max_iterations, msg, lower=0.0, upper=float('inf'), name='newton'):
+    '''
+    solve func(x) = 0 starting from x. func returns the tuple
+    (residual, derivative, tolerance), where the residual is monotonic
+    in x (increasing or decreasing) and iteration stops when its
+    magnitude is below tolerance. Raises model_error(msg) if it does not
+    converge within max_iterations. The call is recorded under name in
+    the active telemetry recorder, if any
+    returns (x, iterations)
+    '''
+    rec = telemetry.active
+    history = [] if rec is not None and rec.history else None
+    for iteration in range(1, max_iterations+1):
+        f, df, tolerance = func(x)
+        if history is not None:
+            history.append(f)
+        if abs(f) < tolerance:
+            if rec is not None:
+                rec.solver(name, 'newton', iteration, f, tolerance, True, history)
+            return x, iteration
+        x, lower, upper = newton_step(x, f, df, lower, upper, increasing)
+    if rec is not None:
+        rec.solver(name, 'newton', max_iterations, f, tolerance, False, history)
+    raise model_error(msg)
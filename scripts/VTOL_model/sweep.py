@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+'''
+VTOL design-space sweep
+
+evaluates the cartesian product of lists and ranges of every
+vtol_model.py option, spreading the work over a process pool in
+chunks and writing one CSV row per configuration
+
+list options take comma separated values, or 'all' for every entry
+in the catalogue. Numeric options take comma separated values and
+start:stop:step ranges (inclusive of stop), for example
+  sweep.py --prop-model all --wing-span 2.5:3.5:0.25 --cell-series 10,12,14
+
+released under GPLv3
+'''
+
+import optparse
+import multiprocessing
+import csv
+import sys
+import motor
+import battery
+import propeller
+import prop_share
+import prop_store
+import prop_index
+import solver
+import thermal
+import atmosphere
+import batch
+import vtol_model
+from util import *
+
+# catalogues used to expand 'all' and check names
+catalogues = {
+    'prop_model' : propeller.prop_models(),
+    'motor_type' : motor.motors,
+    'battery_model' : battery.batteries,
+    'solver' : solver.solvers,
+}
+
+def parse_values(name, otype, spec):
+    '''parse a comma separated list of values and start:stop:step ranges'''
+    if spec == 'all' and name in catalogues:
+        return sorted(catalogues[name])
+    values = []
+    for item in spec.split(','):
+        if otype is str:
+            if name in catalogues and item not in catalogues[name]:
+                error("Unknown %s %s. Choices are %s" % (name, item, sorted(catalogues[name])))
+            values.append(item)
+            continue
+        if ':' not in item:
+            values.append(otype(item))
+            continue
+        r = item.split(':')
+        if len(r) != 3:
+            error("bad range %s for %s, expected start:stop:step" % (item, name))
+        start, stop, step = [otype(x) for x in r]
+        if step <= 0:
+            error("range step must be positive for %s" % name)
+        # count steps rather than accumulating, to avoid rounding drift
+        count = int((stop - start) / float(step) + 1.0e-9) + 1
+        values.extend([start + k*step for k in range(count)])
+    return values
+
+# the sweep grid, set in each worker by init_worker
+grid = None
+
+def init_worker(sweep_grid, prop_cache, prop_shm=None):
+    '''process pool initialiser'''
+    global grid
+    grid = sweep_grid
+    if prop_cache is not None:
+        propeller.fits.set_file(prop_cache)
+    if prop_shm is not None:
+        propeller.use_catalogue(prop_share.attach_shared(prop_shm))
+
+def config_values(index):
+    '''return the parameter values of configuration number index of the grid'''
+    values = []
+    for v in reversed(grid.values):
+        index, k = divmod(index, len(v))
+        values.append(v[k])
+    values.reverse()
+    return values
+
+def evaluate_configs(configs):
+    '''evaluate a list of configurations as one batch, returning ok, error and output values for each'''
+    b = batch.config_batch(configs)
+    r = batch.evaluate(b, grid.sag)
+    outputs = batch.output_rows(r, batch.result_fields(grid.sag))
+    if grid.thermal:
+        t = thermal.check_batch(b, r, atmosphere.temperature(b.altitude, b.temp_offset))
+        for k in range(len(configs)):
+            outputs[k] += [float(t.winding_max[k]), float(t.esc_max[k]), int(t.ok[k])] if r.ok[k] else [None] * 3
+    return [[int(r.ok[k]), r.errors[k] or ''] + outputs[k] for k in range(len(configs))]
+
+def evaluate_chunk(chunk):
+    '''evaluate the configurations numbered [start, end), returning CSV rows'''
+    start, end = chunk
+    inputs = [config_values(i) for i in range(start, end)]
+    configs = [vtol_model.vtol_config(**dict(zip(grid.names, v))) for v in inputs]
+    width = len(batch.result_fields(grid.sag)) + (3 if grid.thermal else 0)
+    results = [None] * len(configs)
+    # a bad grid value, like too few prop table points, fails the whole
+    # batch, so split failing batches in half until the bad
+    # configurations are on their own, as vtol_model.evaluate_lines does
+    groups = [list(range(len(configs)))] if configs else []
+    while groups:
+        group = groups.pop()
+        try:
+            rows = evaluate_configs([configs[k] for k in group])
+        except Exception as e:
+            if len(group) == 1:
+                results[group[0]] = [0, str(e) or type(e).__name__] + [None] * width
+            else:
+                groups.extend([group[len(group)//2:], group[:len(group)//2]])
+            continue
+        for k, row in zip(group, rows):
+            results[k] = row
+    return [inputs[k] + results[k] for k in range(len(inputs))]
+
+def main():
+    parser = optparse.OptionParser("sweep.py [options]")
+    for (name, otype, default, help_text) in vtol_model.options:
+        parser.add_option("--" + name.replace('_', '-'), default=str(default),
+                          help=help_text + ' values [default: %default]')
+    parser.add_option("--output", default=None, help='output CSV file [default: stdout]')
+    parser.add_option("--processes", type='int', default=multiprocessing.cpu_count(), help='number of worker processes [default: %default]')
+    parser.add_option("--prop-cache", default=None, help='file to keep fitted prop polynomials in between runs')
+    parser.add_option("--prop-store", default=None, help='compiled prop store file to take prop data from, see prop_store.py')
+    parser.add_option("--prop-where", default=None, help='keep only the prop models matching prop_index.py conditions, like diameter_in=9:12,ETA_max=0.7:')
+    parser.add_option("--chunk-size", type='int', default=1000, help='configurations per work chunk [default: %default]')
+    parser.add_option("--thermal", action='store_true', default=False, help='add peak motor winding and ESC temperatures over a flight, and whether they are within limits')
+    parser.add_option("--sag", action='store_true', default=False, help='add the cruise endurance with voltage sag')
+    opts, args = parser.parse_args()
+
+    if opts.prop_store is not None:
+        propeller.use_store(prop_store.prop_store(opts.prop_store))
+        catalogues['prop_model'] = propeller.prop_models()
+
+    names = vtol_model.option_names
+    values = [parse_values(name, otype, getattr(opts, name)) for (name, otype, default, help_text) in vtol_model.options]
+    if opts.prop_where is not None:
+        k = names.index('prop_model')
+        try:
+            matching = set(prop_index.get_index().query(**prop_index.parse_where(opts.prop_where)))
+        except model_error as e:
+            error(str(e))
+        values[k] = [m for m in values[k] if m in matching]
+        if not values[k]:
+            error("no prop models match %s" % opts.prop_where)
+    sweep_grid = struct(names = names, values = values, thermal = opts.thermal, sag = opts.sag)
+
+    total = 1
+    for v in values:
+        total *= len(v)
+    chunks = [(start, min(start + opts.chunk_size, total)) for start in range(0, total, opts.chunk_size)]
+
+    header = names + ['ok', 'error'] + [f[0] for f in batch.result_fields(opts.sag)]
+    if opts.thermal:
+        header += ['winding_temp_max', 'esc_temp_max', 'thermal_ok']
+
+    out = open(opts.output, 'w') if opts.output else sys.stdout
+    shm = pool = None
+    try:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        if opts.processes <= 1:
+            init_worker(sweep_grid, opts.prop_cache)
+            results = map(evaluate_chunk, chunks)
+        else:
+            # workers share one packed copy of the fitted prop catalogue
+            shm = prop_share.create_shared()
+            pool = multiprocessing.Pool(opts.processes, initializer=init_worker, initargs=(sweep_grid, opts.prop_cache, shm.name))
+            results = pool.imap(evaluate_chunk, chunks)
+        for rows in results:
+            writer.writerows(rows)
+        if pool is not None:
+            # let the workers exit normally, saving their prop fit caches
+            pool.close()
+            pool.join()
+            pool = None
+    finally:
+        # on an error stop the workers before releasing the shared catalogue
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+'''
+solver convergence telemetry for the VTOL model
+
+a recorder collects one record per solver call (iteration count, final
+residual and tolerance, whether it converged and optionally the
+residual at every iteration) and the wall time of each stage of
+vtol_model.evaluate. Recording is off unless a recorder is made
+active, for example
+
+  rec = telemetry.recorder(history=True)
+  with telemetry.recording(rec):
+      vtol_model.evaluate(config)
+  print(rec.summary())
+
+when no recorder is active the solvers only test a None reference once
+per call, and stage timing uses a shared do-nothing context
+'''
+
+import time
+import json
+
+# the active recorder, or None when telemetry is off
+active = None
+
+class recorder(object):
+    '''
+    collect solver records and stage times. callback, if given, is
+    called with each solver record as it is made
+    '''
+
+    def __init__(self, history=False, callback=None):
+        self.history = history
+        self.callback = callback
+        self.records = []
+        self.stages = {}
+
+    def solver(self, name, method, iterations, residual, tolerance, converged, history=None):
+        '''record one solver call'''
+        record = { 'solver' : name,
+                   'method' : method,
+                   'iterations' : iterations,
+                   'residual' : residual,
+                   'tolerance' : tolerance,
+                   'converged' : converged }
+        if history is not None:
+            record['history'] = history
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def stage_time(self, name, seconds):
+        '''add the wall time of one run of a stage'''
+        s = self.stages.setdefault(name, { 'calls' : 0, 'seconds' : 0.0 })
+        s['calls'] += 1
+        s['seconds'] += seconds
+
+    def stage(self, name):
+        '''return a context manager timing a stage'''
+        return stage_timer(self, name)
+
+    def summary(self):
+        '''return per solver totals of the records'''
+        solvers = {}
+        for r in self.records:
+            s = solvers.setdefault(r['solver'], { 'calls' : 0, 'iterations' : 0, 'max_iterations' : 0, 'failures' : 0 })
+            s['calls'] += 1
+            s['iterations'] += r['iterations']
+            s['max_iterations'] = max(s['max_iterations'], r['iterations'])
+            if not r['converged']:
+                s['failures'] += 1
+        return solvers
+
+    def to_dict(self):
+        '''return everything recorded as a dictionary suitable for JSON'''
+        return { 'stages' : self.stages,
+                 'solvers' : self.summary(),
+                 'calls' : self.records }
+
+    def save(self, filename):
+        '''write everything recorded to a JSON file'''
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+class stage_timer(object):
+    '''context manager adding the time spent in a block to a recorder stage'''
+
+    def __init__(self, rec, name):
+        self.rec = rec
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.rec.stage_time(self.name, time.perf_counter() - self.t0)
+        return False
+
+class null_stage(object):
+    '''context manager that does nothing, used when no recorder is active'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null = null_stage()
+
+def stage(name):
+    '''return a context manager timing a stage in the active recorder, if any'''
+    if active is None:
+        return null
+    return active.stage(name)
+
+class recording(object):
+    '''context manager making a recorder active for a block'''
+
+    def __init__(self, rec):
+        self.rec = rec
+
+    def __enter__(self):
+        global active
+        self.previous = active
+        active = self.rec
+        return self.rec
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global active
+        active = self.previous
+        return False
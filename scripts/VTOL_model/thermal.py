@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+'''
+transient motor and ESC thermal model
+
+each motor winding and ESC is a lumped heat capacity cooled through a
+thermal resistance to the ambient air. The winding is heated by I^2 R
+losses, with the copper resistance rising with temperature, and by the
+no-load (iron and friction) losses. The ESC is heated by its conduction
+losses. For a constant current both are linear first order equations,
+so each step of a flight timeline is integrated exactly, however long
+it is, with arrays over many configurations at once:
+
+  t = thermal.thermal_batch(['MT3520-11-400kV', 'U5-400'])
+  r = t.run(current, rpm, dt)   # arrays of shape (steps, configurations)
+  print(r.winding_max, r.ok)
+
+check_result() and check_batch() fly a vtol_result or a batch.evaluate()
+result through a takeoff hover, climb, cruise and landing hover
+
+released under GPLv3
+'''
+
+import numpy as np
+import motor
+from util import model_error, struct
+
+# copper resistance temperature coefficient, per deg C, and the
+# temperature the motor esr is given at
+copper_alpha = 0.00393
+reference_temp = 25.0
+
+# ambient temperature when none is given, deg C, and height climbed in
+# fixed wing flight after the takeoff hover, m. The tools fly at the air
+# temperature of each configuration's site instead
+ambient_temp = 25.0
+climb_height = 100.0
+
+def exact_step(T, C, k, A, dt):
+    '''
+    return T after dt seconds of C dT/dt = A - k T, for arrays of any of
+    the arguments. k may be zero or negative (thermal runaway)
+    '''
+    x = k * dt / C
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phi = np.where(np.abs(x) > 1.0e-12, -np.expm1(-x) / x, 1.0)
+    return T + (A - k * T) * dt / C * phi
+
+class thermal_batch(object):
+    '''thermal parameters of a list of motor types, one per configuration'''
+
+    def __init__(self, motor_types):
+        for motor_type in motor_types:
+            if motor_type not in motor.motors:
+                raise model_error("Unknown motor type %s. Choices are %s" % (motor_type, motor.motors.keys()))
+        data = [motor.motors[t] for t in motor_types]
+        def column(name):
+            return np.array([getattr(d, name) for d in data], dtype=float)
+        self.size = len(data)
+        self.esr = column('esr')
+        self.i0_current = column('i0_current')
+        self.i0_voltage = column('i0_voltage')
+        self.kV = column('kV')
+        self.winding_heat_capacity = column('winding_heat_capacity')
+        self.winding_thermal_resistance = column('winding_thermal_resistance')
+        self.winding_temp_max = column('winding_temp_max')
+        self.esc_resistance = column('esc_resistance')
+        self.esc_heat_capacity = column('esc_heat_capacity')
+        self.esc_thermal_resistance = column('esc_thermal_resistance')
+        self.esc_temp_max = column('esc_temp_max')
+
+    def step(self, T_winding, T_esc, current, rpm, dt, ambient):
+        '''return the winding and ESC temperatures after dt seconds at a constant current and RPM'''
+        # no-load losses, with i0 rising linearly with back emf as in the model
+        emf = rpm / self.kV
+        P_i0 = self.i0_current * emf / self.i0_voltage * emf
+        # winding: C dT/dt = I^2 esr (1 + alpha (T - Tref)) + P_i0 - (T - ambient) / R
+        I2R = current**2 * self.esr
+        k = 1.0 / self.winding_thermal_resistance - I2R * copper_alpha
+        A = I2R * (1.0 - copper_alpha * reference_temp) + P_i0 + ambient / self.winding_thermal_resistance
+        T_winding = exact_step(T_winding, self.winding_heat_capacity, k, A, dt)
+        # ESC: C dT/dt = I^2 R - (T - ambient) / R_th
+        k = 1.0 / self.esc_thermal_resistance
+        A = current**2 * self.esc_resistance + ambient * k
+        T_esc = exact_step(T_esc, self.esc_heat_capacity, k, A, dt)
+        return T_winding, T_esc
+
+    def run(self, current, rpm, dt, ambient=ambient_temp, T_start=None):
+        '''
+        integrate the temperatures over a flight timeline, with current
+        (Amps per motor), rpm and dt (s) arrays of shape (steps,
+        configurations), or anything that broadcasts to it, constant over
+        each step. Temperatures start at ambient, or T_start as a
+        (winding, ESC) pair. As the temperature moves monotonically
+        towards equilibrium within a step the peaks are at step ends
+
+        returns the winding and ESC temperatures at the end of each step,
+        their peaks and whether each configuration stays within limits
+        '''
+        current = np.asarray(current, dtype=float)
+        steps = current.shape[0]
+        shape = (steps, self.size)
+        current = np.broadcast_to(current, shape)
+        rpm = np.broadcast_to(np.asarray(rpm, dtype=float), shape)
+        dt = np.broadcast_to(np.asarray(dt, dtype=float), shape)
+        ambient = np.broadcast_to(np.asarray(ambient, dtype=float), (self.size,))
+        if T_start is None:
+            T_w, T_e = ambient, ambient
+        else:
+            T_w, T_e = [np.broadcast_to(np.asarray(T, dtype=float), (self.size,)) for T in T_start]
+        winding = np.empty(shape)
+        esc = np.empty(shape)
+        for k in range(steps):
+            T_w, T_e = self.step(T_w, T_e, current[k], rpm[k], dt[k], ambient)
+            winding[k] = T_w
+            esc[k] = T_e
+        winding_max = np.maximum(np.max(winding, axis=0, initial=-np.inf), T_w if steps == 0 else -np.inf)
+        esc_max = np.maximum(np.max(esc, axis=0, initial=-np.inf), T_e if steps == 0 else -np.inf)
+        with np.errstate(invalid='ignore'):
+            winding_ok = winding_max <= self.winding_temp_max
+            esc_ok = esc_max <= self.esc_temp_max
+        return struct(winding = winding,
+                      esc = esc,
+                      winding_max = winding_max,
+                      esc_max = esc_max,
+                      winding_ok = winding_ok,
+                      esc_ok = esc_ok,
+                      ok = winding_ok & esc_ok)
+
+def flight_profile(shared, hover_time, climb_rate, endurance_minutes,
+                   hover_current, hover_rpm, climb_current, climb_rpm, cruise_current, cruise_rpm):
+    '''
+    return (current, rpm, dt) arrays of shape (4, 2n) for n
+    configurations, flying a takeoff hover, a fixed wing climb of
+    climb_height, cruise for the rest of the endurance and a landing
+    hover. The hover time is split between the two hovers. Columns
+    [0, n) are the cruise motors and [n, 2n) the hover motors. Where
+    shared is True the same motors hover and cruise, and both columns
+    carry every phase; otherwise a motor set is unpowered outside its
+    own phases, and cools
+    '''
+    shared = np.asarray(shared, dtype=bool)
+    zero = np.zeros(shared.shape)
+    hover_s = 30.0 * np.asarray(hover_time, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        climb_s = np.where(climb_rate > 0, climb_height / climb_rate, 0.0)
+    cruise_s = np.maximum(60.0 * np.asarray(endurance_minutes, dtype=float) - climb_s, 0.0)
+    def phases(hover, climb, cruise):
+        return np.array([hover, climb, cruise, hover])
+    cruise_hover_current = np.where(shared, hover_current, zero)
+    cruise_hover_rpm = np.where(shared, hover_rpm, zero)
+    hover_fw = np.where(shared, 1.0, 0.0)
+    current = np.hstack([phases(cruise_hover_current, climb_current, cruise_current),
+                         phases(hover_current, climb_current * hover_fw, cruise_current * hover_fw)])
+    rpm = np.hstack([phases(cruise_hover_rpm, climb_rpm, cruise_rpm),
+                     phases(hover_rpm, climb_rpm * hover_fw, cruise_rpm * hover_fw)])
+    dt = np.tile(phases(hover_s, climb_s, cruise_s), (1, 2))
+    return current, rpm, dt
+
+def combine(motor_types, current, rpm, dt, ambient):
+    '''run a two motor set flight profile, returning the peaks of whichever set runs hotter'''
+    n = len(motor_types)
+    t = thermal_batch(list(motor_types) * 2)
+    r = t.run(current, rpm, dt, np.tile(np.broadcast_to(ambient, (n,)), 2))
+    return struct(winding_max = np.maximum(r.winding_max[:n], r.winding_max[n:]),
+                  esc_max = np.maximum(r.esc_max[:n], r.esc_max[n:]),
+                  winding_temp_max = t.winding_temp_max[:n],
+                  esc_temp_max = t.esc_temp_max[:n],
+                  ok = r.ok[:n] & r.ok[n:])
+
+def check_result(r, ambient=ambient_temp):
+    '''return peak winding and ESC temperatures of a vtol_result over a flight, with their limits'''
+    c = r.config
+    profile = flight_profile([c.num_motors_total < c.num_motors_cruise + c.num_motors_hover], [c.hover_time],
+                             np.array([r.climb_min.climb_rate]), [r.hover.corrected_endurance_minutes],
+                             [r.hover.motor_current], [r.hover.RPM],
+                             [r.climb_min.motor_current], [r.climb_min.RPM],
+                             [r.cruise.motor_current], [r.cruise.RPM])
+    t = combine([c.motor_type], *(profile + (ambient,)))
+    return struct(winding_max = float(t.winding_max[0]),
+                  esc_max = float(t.esc_max[0]),
+                  winding_temp_max = float(t.winding_temp_max[0]),
+                  esc_temp_max = float(t.esc_temp_max[0]),
+                  ok = bool(t.ok[0]))
+
+def check_batch(b, r, ambient=ambient_temp):
+    '''
+    return arrays of peak winding and ESC temperatures over a flight
+    for a batch.config_batch and its batch.evaluate() result. Failed
+    configurations get NaN temperatures and ok False
+    '''
+    profile = flight_profile(b.num_motors_total < b.num_motors_cruise + b.num_motors_hover, b.hover_time,
+                             r.climb_min.climb_rate, r.hover.corrected_endurance_minutes,
+                             r.hover.motor_current, r.hover.RPM,
+                             r.climb_min.motor_current, r.climb_min.RPM,
+                             r.cruise.motor_current, r.cruise.RPM)
+    with np.errstate(invalid='ignore', over='ignore'):
+        t = combine(b.motor_type, *(profile + (ambient,)))
+    failed = ~r.ok
+    t.winding_max = np.where(failed, np.nan, t.winding_max)
+    t.esc_max = np.where(failed, np.nan, t.esc_max)
+    t.ok = t.ok & r.ok
+    return t
@@ -4,13 +4,17 @@ import sys
 
 # physical constants
 gravity = 9.80665 # acceleration due to gravity (m/s^2)
-rho = 1.225 # air density Kg/m^3
+rho = 1.225 # sea level ISA air density Kg/m^3, see atmosphere.py for other altitudes
 
 def error(msg):
     '''display an error and exit'''
     print("Error: %s" % msg)
     sys.exit(1)
 
+class model_error(Exception):
+    '''an error evaluating a model, raised by the importable API'''
+    pass
+
 # a simple structure class
 # see https://stackoverflow.com/questions/2280334/shortest-way-of-creating-an-object-with-arbitrary-attributes-in-python
 class struct:
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+'''
+client for the resident VTOL model server
+
+sends configurations to vtol_server.py over its Unix domain socket and
+returns the results. Only the standard library is used, so it starts
+quickly:
+
+  ./vtol_client.py wing_span=2.5 prop_diameter=12
+  ./vtol_client.py - < configs.jsonl
+
+or from Python
+
+  c = vtol_client.client()
+  results = c.evaluate([{ 'wing_span' : 2.5 }, { 'wing_span' : 3.0 }])
+
+released under GPLv3
+'''
+
+import optparse
+import socket
+import json
+import sys
+
+default_socket = '/tmp/vtol_model.sock'
+
+class client(object):
+    '''a connection to a vtol_server, sending JSON request lines and reading JSON result lines'''
+
+    def __init__(self, path=default_socket):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, values):
+        '''send one request dictionary without waiting for the result'''
+        self.send_line(json.dumps(values))
+
+    def send_line(self, line):
+        '''send one JSON request line without waiting for the result'''
+        self.file.write(line.strip().encode('utf-8') + b'\n')
+
+    def result(self):
+        '''return the next result dictionary'''
+        line = self.file.readline()
+        if not line:
+            raise IOError("server closed the connection")
+        return json.loads(line)
+
+    def evaluate(self, configs):
+        '''
+        evaluate a list of dictionaries of option values, returning a
+        list of result dictionaries in the same order. The requests are
+        all sent before reading the results, so the server can batch them
+        '''
+        for values in configs:
+            self.request(values)
+        self.file.flush()
+        return [self.result() for values in configs]
+
+    def stats(self):
+        '''return the server's request and batch counts'''
+        self.request({ 'command' : 'stats' })
+        self.file.flush()
+        return self.result()
+
+    def close(self):
+        '''close the connection'''
+        self.file.close()
+        self.sock.close()
+
+def parse_value(value):
+    '''return a command line value as a number if it looks like one'''
+    for otype in (int, float):
+        try:
+            return otype(value)
+        except ValueError:
+            pass
+    return value
+
+def main():
+    parser = optparse.OptionParser("vtol_client.py [options] [name=value ...|-]")
+    parser.add_option("--socket", default=default_socket, help='server socket path [default: %default]')
+    parser.add_option("--stats", action='store_true', default=False, help='print the server statistics')
+    opts, args = parser.parse_args()
+
+    try:
+        c = client(opts.socket)
+    except (IOError, OSError) as e:
+        print("Error: can't connect to %s: %s" % (opts.socket, e))
+        sys.exit(1)
+    if opts.stats:
+        print(json.dumps(c.stats()))
+    elif args == ['-']:
+        # send every line before reading the results, so the server can batch them
+        count = 0
+        for line in sys.stdin:
+            if line.strip():
+                c.send_line(line)
+                count += 1
+        c.file.flush()
+        for k in range(count):
+            print(json.dumps(c.result()))
+    else:
+        values = {}
+        for arg in args:
+            if '=' not in arg:
+                print("Error: expected name=value, not %s" % arg)
+                sys.exit(1)
+            name, value = arg.split('=', 1)
+            values[name.replace('-', '_')] = parse_value(value)
+        print(json.dumps(c.evaluate([values])[0], indent=1))
+    c.close()
+
+if __name__ == '__main__':
+    main()
@@ -5,58 +5,63 @@ Based on a matlab script by Paul Riseborough
 converted to python by Andrew Tridgell
 
 released under GPLv3
+
+can be used from the command line, or imported and called with
+evaluate(), for example:
+
+  import vtol_model
+  result = vtol_model.evaluate(vtol_model.vtol_config(wing_span=2.5))
+  print(result.cruise.endurance_minutes)
 '''
 
 import optparse
+import itertools
+import json
+import sys
 from util import *
 import propeller
+import prop_store
 import battery
 import motor
 import wing
+import atmosphere
+import backend
+from motor import torque_balance, torque_slope
+import solver
+import telemetry
+import thermal
 import util
 from math import *
 
-parser = optparse.OptionParser("vtol_model.py")
-parser.add_option("--prop-model", default='APC11x7', help='prop model name [default: %default]')
-parser.add_option("--prop-diameter", type='float', default=11.0, help='prop diameter inches [default: %default]')
-parser.add_option("--battery-model", default='5Ah_6S_Nanotech', help='battery model name [default: %default]')
-parser.add_option("--cell-series", type='int', default=12, help='cell series count [default: %default]')
-parser.add_option("--cell-parallel", type='int', default=2, help='cell parallel count [default: %default]')
-parser.add_option("--motor-type", default='MT3520-11-400kV', help='motor type [default: %default]')
-parser.add_option("--wing-span", type='float', default=3.0, help='wing span in meters [default: %default]')
-parser.add_option("--aspect-ratio", type='float', default=8.0, help='wing aspect ratio [default: %default]')
-parser.add_option("--mission-speed", type='float', default=28.0, help='mission min speed in m/s [default: %default]')
-parser.add_option("--hover-time", type='float', default=5.0, help='hover time in minutes [default: %default]')
-parser.add_option("--mass-payload", type='float', default=0.5, help='payload mass in Kg [default: %default]')
-parser.add_option("--mass-avionics", type='float', default=0.15, help='avionics mass in Kg [default: %default]')
-parser.add_option("--mass-structure", type='float', default=4.15, help='structure mass in Kg [default: %default]')
-parser.add_option("--num-motors-cruise", type='int', default=2, help='number of motors in cruise [default: %default]')
-parser.add_option("--num-motors-hover", type='int', default=2, help='number of motors in cruise [default: %default]')
-parser.add_option("--num-motors-total", type='int', default=2, help='number of motors total [default: %default]')
-
-opts, args = parser.parse_args()
-
-# get prop, battery, motor and wing models
-prop = propeller.propeller(opts.prop_model, opts.prop_diameter)
-battery = battery.battery(opts.battery_model, opts.cell_series, opts.cell_parallel)
-motor = motor.motor(opts.motor_type)
-
-# get requred performance
-mission_speed_min = opts.mission_speed # min mission speed (m/s)
-mission_hover_time = opts.hover_time # mission hover time (minutes)
-
-# mass properties
-mass_payload = opts.mass_payload # payload mass (Kg) - allowance for camera and TX module
-mass_avionics = opts.mass_avionics # mass of autopilot, C2 link, power supply and wiring (doesn't include servos)
-mass_structure = opts.mass_structure # airframe mass including servos and linkages (or None)
-structure_mass_frac = None # fraction of AUW that is structure plus servos (or None)
-
-# define motor parameters assuming a T-motor MT-3520-11
-n_motors_cruise = opts.num_motors_cruise # number of motor/prop units used during cruise
-n_motors_hover = opts.num_motors_hover # number of motor/prop units used during hover
-n_motors_total = opts.num_motors_total # total number of mtors
-if n_motors_total > n_motors_hover + n_motors_cruise:
-    error("Total number of motors higher than sum of cruise and hover")
+# model options as (name, type, default, help). These are the command
+# line options and the attributes of vtol_config
+options = [
+    ('prop_model', str, 'APC11x7', 'prop model name'),
+    ('prop_diameter', float, 11.0, 'prop diameter inches'),
+    ('battery_model', str, '5Ah_6S_Nanotech', 'battery model name'),
+    ('cell_series', int, 12, 'cell series count'),
+    ('cell_parallel', int, 2, 'cell parallel count'),
+    ('motor_type', str, 'MT3520-11-400kV', 'motor type'),
+    ('wing_span', float, 3.0, 'wing span in meters'),
+    ('aspect_ratio', float, 8.0, 'wing aspect ratio'),
+    ('mission_speed', float, 28.0, 'mission min speed in m/s'),
+    ('hover_time', float, 5.0, 'hover time in minutes'),
+    ('mass_payload', float, 0.5, 'payload mass in Kg'),
+    ('mass_avionics', float, 0.15, 'avionics mass in Kg'),
+    ('mass_structure', float, 4.15, 'structure mass in Kg'),
+    ('num_motors_cruise', int, 2, 'number of motors in cruise'),
+    ('num_motors_hover', int, 2, 'number of motors in hover'),
+    ('num_motors_total', int, 2, 'number of motors total'),
+    ('solver', str, 'relax', 'solver type, one of %s' % solver.solvers),
+    ('prop_table_points', int, 0, 'J points in dense CT/CP/ETA prop tables, 0 to use the fitted polynomials'),
+    ('altitude', float, 0.0, 'pressure altitude of the site in meters'),
+    ('temp_offset', float, 0.0, 'air temperature offset from the ISA temperature in degrees C'),
+]
+
+option_names = [o[0] for o in options]
+
+# fraction of AUW that is structure plus servos, used when mass_structure is None
+structure_mass_frac = None
 
 # Correction coefficients from static thrust validation test
 CP_correction_factor = 1.00 # CP data from the prop database is multiplied by this factor
@@ -65,37 +70,77 @@ CT_correction_factor = 1.00 # CT data from the prop database is multiplied by th
 # assumed avionics parastic electrical power draw (W)
 avionics_power = 10.0
 
-# calculate mass of battery
-mass_batt = battery.get_mass()
+class vtol_config(object):
+    '''a configuration to evaluate, with one attribute per entry in options'''
+
+    def __init__(self, **kwargs):
+        for (name, otype, default, help_text) in options:
+            setattr(self, name, default)
+        for name, value in kwargs.items():
+            if name not in option_names:
+                raise model_error("Unknown option %s. Choices are %s" % (name, option_names))
+            setattr(self, name, value)
 
-# calculate propulsion mass which is mass of props, motors and esc's
-mass_propulsion = n_motors_total*(motor.get_mass()+prop.get_mass())
+class vtol_result(object):
+    '''the result of evaluating a vtol_config'''
 
-# calculate all up mass
-if mass_structure is not None:
-    mass_auw = mass_batt + mass_avionics + mass_payload + mass_propulsion + mass_structure
-elif structure_mass_frac is not None:
-    mass_auw = (mass_batt + mass_avionics + mass_payload + mass_propulsion) / (1.0 - structure_mass_frac)
-    mass_structure = structure_mass_frac * mass_auw
-else:
-    error('supply either structure_mass or structure_mass_frac data')
+    def __init__(self, config, prop, battery, motor, wing, mass, drag, speed_mission,
+                 cruise, climb_max, climb_min, hover):
+        self.config = config               # the evaluated vtol_config
+        self.prop = prop                   # propeller.propeller
+        self.battery = battery             # battery.battery
+        self.motor = motor                 # motor.motor
+        self.wing = wing                   # wing.wing
+        self.mass = mass                   # mass breakdown, from calc_mass()
+        self.drag = drag                   # drag polar, from wing.calc_drag()
+        self.speed_mission = speed_mission # mission speed (m/s)
+        self.cruise = cruise               # cruise performance, from calc_cruise_RPM() and calc_cruise_data()
+        self.climb_max = climb_max         # climb performance fully charged, from calc_climb()
+        self.climb_min = climb_min         # climb performance fully discharged, from calc_climb()
+        self.hover = hover                 # hover performance fully discharged, from calc_hover()
 
-wing = wing.wing(opts.wing_span, opts.aspect_ratio, mass_auw)
+def calc_mass(config, prop, battery, motor):
+    '''
+    calculate the mass breakdown
+    '''
+    if config.num_motors_total > config.num_motors_hover + config.num_motors_cruise:
+        raise model_error("Total number of motors higher than sum of cruise and hover")
 
-# Calculate mission speed and drag
-speed_max_endurance = max(wing.lift_coef_stall_margin * wing.get_speed_stall(), wing.get_speed_min_pwr())
+    # calculate mass of battery
+    mass_batt = battery.get_mass()
 
-# calculate our mission speed as the maximum of the max endurance speed
-# and the desired min mission speed
-speed_mission = max(speed_max_endurance,mission_speed_min)
+    # calculate propulsion mass which is mass of props, motors and esc's
+    mass_propulsion = config.num_motors_total*(motor.get_mass()+prop.get_mass())
 
-# calculate drag parameters
-drag = wing.calc_drag(mass_auw, speed_mission)
+    # calculate all up mass
+    mass_structure = config.mass_structure
+    mass_others = mass_batt + config.mass_avionics + config.mass_payload + mass_propulsion
+    if mass_structure is not None:
+        mass_auw = mass_others + mass_structure
+    elif structure_mass_frac is not None:
+        mass_auw = mass_others / (1.0 - structure_mass_frac)
+        mass_structure = structure_mass_frac * mass_auw
+    else:
+        raise model_error('supply either structure_mass or structure_mass_frac data')
 
-def calc_cruise_RPM():
+    return struct(auw = mass_auw,
+                  batt = mass_batt,
+                  propulsion = mass_propulsion,
+                  structure = mass_structure,
+                  avionics = config.mass_avionics,
+                  payload = config.mass_payload)
+
+def calc_speed_mission(w, mission_speed_min):
+    '''
+    calculate our mission speed as the maximum of the max endurance speed
+    and the desired min mission speed
+    '''
+    return wing.speed_mission(backend.scalar, w.get_speed_stall(), w.get_speed_min_pwr(), mission_speed_min)
+
+def calc_cruise_RPM(prop, speed_mission, drag, n_motors_cruise, rho, rpm_start=None):
     '''
     calculate the RPM required to provide the required thrust for the
-    specified prop
+    specified prop in air of density rho, starting from rpm_start if given
     return a structure containing the outputs
     '''
     # find best efficiency operating condition and use as a starting condition
@@ -103,7 +148,11 @@ def calc_cruise_RPM():
 
     best_nD = speed_mission / best_prop_j
     best_prop_rpm = 60 * best_nD / prop.get_diameter_m()
+    if rpm_start is not None:
+        best_prop_rpm = rpm_start
 
+    rec = telemetry.active
+    history = [] if rec is not None and rec.history else None
     solution_converged = False
     counter = 0
     while not solution_converged:
@@ -112,23 +161,30 @@ def calc_cruise_RPM():
         prop_j = speed_mission / best_nD
         prop_j=min(prop_j,prop.get_J_max())
         prop_j=max(prop_j,prop.get_J_min())
-        
+
         # get thrust coefficient
         CT = prop.get_CT(prop_j)
-        thrust = CT * (rho * best_nD**2 * prop.get_diameter_m()**2)
+        thrust = propeller.thrust(CT, best_nD, prop.get_diameter_m(), rho)
         thrust_error = n_motors_cruise * thrust - drag.drag_max_endurance
         best_prop_rpm = best_prop_rpm * (1.0 - 0.01 * thrust_error / thrust)
-        
+        if history is not None:
+            history.append(thrust_error)
+
         # check for convergence
         counter += 1
         if abs(thrust_error) < (0.001 * drag.drag_max_endurance):
             solution_converged = True
         elif counter > 10000:
-            error('endurance prop calculation could not converge')
+            if rec is not None:
+                rec.solver('cruise_RPM', 'relax', counter, thrust_error, 0.001 * drag.drag_max_endurance, False, history)
+            raise model_error('endurance prop calculation could not converge')
+
+    if rec is not None:
+        rec.solver('cruise_RPM', 'relax', counter, thrust_error, 0.001 * drag.drag_max_endurance, True, history)
 
     # calculate power required
     CP = prop.get_CP(prop_j)
-    power = rho * CP * best_nD**3 * prop.get_diameter_m()**2
+    power = propeller.power(CP, best_nD, prop.get_diameter_m(), rho)
 
     # return a structure containing the outputs
     return struct(RPM = best_prop_rpm,
@@ -136,16 +192,14 @@ def calc_cruise_RPM():
                   J = prop_j,
                   thrust = thrust,
                   CP = CP,
-                  CT = CT)
+                  CT = CT,
+                  iterations = counter)
 
-def calc_cruise_data(cruise):
+def calc_cruise_data(prop, motor, battery, cruise, speed_mission, drag, n_motors_cruise, rho):
     '''
     calculate cruise power and voltage
     '''
 
-    # calcuate torque required
-    best_motor_torque = cruise.power / (2.0 * pi * cruise.RPM / 60)
-
     # Endurance Calculations using simple fixed efficiency values
 
     # calculate propeller inflow_factor
@@ -160,57 +214,92 @@ def calc_cruise_data(cruise):
     endurance_hours_initial = battery.get_watt_hours() / power_batt
 
     # update endurance using DC motor theory and manufacturer data
+    c = cruise_power(backend.scalar, cruise.power, cruise.RPM, cruise.thrust, speed_mission, n_motors_cruise,
+                     motor.get_kV(), motor.get_esr(), motor.get_supply_esr(), motor.get_i0_current(),
+                     motor.get_i0_voltage(), motor.get_torque_constant(), battery.get_watt_hours())
+
+    # check if required supply voltage exceeds battery rating.
+    if c.motor_voltage > battery.get_voltage_min():
+        raise model_error('insufficient battery voltage or prop too small')
+
+    cruise.batt_power = c.batt_power
+    cruise.endurance_minutes = c.endurance_minutes
+    cruise.range_still_air = c.range_still_air
+    cruise.thrust_power = c.thrust_power
+    cruise.motor_power_out = c.motor_power_out
+    cruise.motor_power_in = c.motor_power_in
+    cruise.motor_current = c.motor_current
+    cruise.motor_current_best_eff = c.motor_current_best_eff
+    cruise.sag = calc_cruise_sag(battery, cruise)
+
+def cruise_power(xp, power, rpm, thrust, speed_mission, n_motors_cruise, kV, esr, supply_esr,
+                 i0_current, i0_voltage, torque_constant, watt_hours):
+    '''
+    motor current and supply voltage, battery power, endurance and still
+    air range at the solved cruise power and RPM, on backend xp
+    '''
+    # calcuate torque required
+    best_motor_torque = power / (2.0 * pi * rpm / 60)
 
     # calculate motor current at best endurance condition, scaling motor zero
     # load current linearly with RPM
-    motor_current = (best_motor_torque / motor.get_torque_constant())
-    motor_current += motor.get_io_current_rpm(cruise.RPM)
+    io_current = motor.io_current(rpm, i0_current, i0_voltage, kV)
+    motor_current = best_motor_torque / torque_constant + io_current
 
     # calculate back emf
-    motor_emf = cruise.RPM / motor.get_kV()
+    motor_emf = rpm / kV
 
     # calculate initial motor supply voltage
-    motor_voltage_endurance = motor_emf
-    motor_voltage_endurance += motor.get_esr() * motor_current
-    motor_voltage_endurance += motor.get_supply_esr() * motor_current * n_motors_cruise
-
-    # check if required supply voltage exceeds battery rating.
-    if motor_voltage_endurance > battery.get_voltage_min():
-        error('insufficient battery voltage or prop too small')
+    motor_voltage = motor_emf
+    motor_voltage = motor_voltage + esr * motor_current
+    motor_voltage = motor_voltage + supply_esr * motor_current * n_motors_cruise
 
     # optimum current = sqrt(Io*V/R)
-    motor_current_best_eff = sqrt((motor.get_io_current_rpm(cruise.RPM) * motor_voltage_endurance) / motor.get_esr())
+    motor_current_best_eff = xp.sqrt((io_current * motor_voltage) / esr)
 
     # calculate total batery power at best endurance flight condition
-    cruise.batt_power = n_motors_cruise * motor_current * motor_voltage_endurance + avionics_power
+    batt_power = n_motors_cruise * motor_current * motor_voltage + avionics_power
 
     # calculate endurance
-    cruise.endurance_minutes = 60 * battery.get_watt_hours() / cruise.batt_power
-
-    # calculate still air range at mission speed
-    cruise.range_still_air = 60 * cruise.endurance_minutes * speed_mission
-
-    cruise.thrust_power = speed_mission * cruise.thrust
-    cruise.motor_power_out = (2.0*pi*cruise.RPM/60) * best_motor_torque
-    cruise.motor_power_in = motor_voltage_endurance * motor_current
-    cruise.motor_current = motor_current
-    cruise.motor_current_best_eff = motor_current_best_eff
+    endurance_minutes = 60 * watt_hours / batt_power
 
-# calculate cruise RPM
-cruise = calc_cruise_RPM()
+    return struct(motor_current = motor_current,
+                  motor_voltage = motor_voltage,
+                  motor_current_best_eff = motor_current_best_eff,
+                  batt_power = batt_power,
+                  endurance_minutes = endurance_minutes,
+                  # still air range at mission speed
+                  range_still_air = 60 * endurance_minutes * speed_mission,
+                  thrust_power = speed_mission * thrust,
+                  motor_power_out = (2.0*pi*rpm/60) * best_motor_torque,
+                  motor_power_in = motor_voltage * motor_current)
 
-# and calculate cruise data
-calc_cruise_data(cruise)
 
+def calc_cruise_sag(battery, cruise):
+    '''
+    calculate cruise endurance by discharging the battery at cruise
+    power with the state of charge model, so accounting for voltage
+    sag. Returns a structure with the endurance, the battery voltage at
+    the start and end and the state of charge left
+    '''
+    sag = battery.sag_endurance(cruise.batt_power)
+    return struct(endurance_minutes = sag.seconds / 60.0,
+                  voltage_start = sag.voltage_start,
+                  voltage_end = sag.voltage_end,
+                  soc_end = sag.soc_end)
 
-def calc_climb(battery_voltage):
+def calc_climb(prop, motor, cruise, speed_mission, drag, mass_auw, n_motors_cruise, battery_voltage, rho, rpm_start=None):
     '''
-    calculate max sustained climb rate for given battery voltage
-    perform iterative solution to calculate thrust at with specified supply voltage
-    TODO - add a basic thermal model
+    calculate max sustained climb rate for given battery voltage and air density
+    perform iterative solution to calculate thrust at with specified supply voltage,
+    starting from the cruise RPM or rpm_start if given
+    motor and ESC temperatures over a flight are found by thermal.py
     '''
-    rpm = cruise.RPM
+    rpm = cruise.RPM if rpm_start is None else rpm_start
     supply_voltage = battery_voltage
+    esr = motor.get_esr() + n_motors_cruise * motor.get_supply_esr()
+    rec = telemetry.active
+    history = [] if rec is not None and rec.history else None
     solution_converged = False
     counter = 0
     while not solution_converged:
@@ -220,110 +309,123 @@ def calc_climb(battery_voltage):
         J_climb=min(J_climb,prop.get_J_max())
         J_climb=max(J_climb,prop.get_J_min())
         CP_climb = prop.get_CP(J_climb)
-        prop_power_climb = CP_climb * (rho * nD_climb**3 * prop.get_diameter_m()**2)
-        prop_torque_climb = prop_power_climb / (2.0 * pi * rpm / 60)
-    
-        # calculate motor torque
-        emf_climb = rpm / motor.get_kV()
-        motor_current_climb = (supply_voltage - emf_climb) / (motor.get_esr() + n_motors_cruise * motor.get_supply_esr())
-    
-        # limit motor current if necessary by adjusting supply voltage downwards
-        if motor_current_climb > motor.get_current_lim():
-            motor_current_climb = motor.get_current_lim()
-    
-        # calculate excess torque - assume motor i0 varies linearly with back emf
-        excess_torque = (motor_current_climb - motor.get_i0_current() * emf_climb / motor.get_i0_voltage()) * motor.get_torque_constant() - prop_torque_climb
-        excess_CQ = excess_torque / (rho * nD_climb**2 * prop.get_diameter_m()**2)
-    
+
+        # calculate motor torque, limiting motor current if necessary, and excess torque
+        t = calc_motor_torque(prop, motor, rpm, CP_climb, supply_voltage, esr, rho)
+        emf_climb = t.emf
+        motor_current_climb = t.motor_current
+        prop_torque_climb = t.prop_torque
+        excess_torque = t.excess_torque
+        excess_CQ = t.excess_CQ
+
+        if history is not None:
+            history.append(excess_torque / prop_torque_climb)
+
         # check for convergence
         counter += 1
         if abs(excess_torque / prop_torque_climb) < 0.001:
             solution_converged = True
         elif counter > 1000:
-            error('full battery climb calculation failed to converge')
-    
+            if rec is not None:
+                rec.solver('climb', 'relax', counter, excess_torque / prop_torque_climb, 0.001, False, history)
+            raise model_error('full battery climb calculation failed to converge')
+
         # increment RPM proportional to excess torque coefficient
         rpm = rpm + 1000 * (speed_mission / prop.get_diameter_m()) * excess_CQ
 
+    if rec is not None:
+        rec.solver('climb', 'relax', counter, excess_torque / prop_torque_climb, 0.001, True, history)
+
     # record power supply requirements for climb
     motor_current = motor_current_climb
-    motor_voltage = motor_current_climb * (motor.get_esr() + n_motors_cruise * motor.get_supply_esr()) + emf_climb
+    motor_voltage = motor_current_climb * esr + emf_climb
     motor_power = motor_current * motor_voltage
 
     # calculate climb rate using mission speed
     CT = prop.get_CT(J_climb)
-    thrust_climb = n_motors_cruise * CT * (rho * nD_climb**2 * prop.get_diameter_m()**2)
-    if thrust_climb <= (drag.drag_max_endurance + (mass_auw * gravity)):
-        excess_thrust_power = (thrust_climb - drag.drag_max_endurance) * speed_mission
-        climb_rate = excess_thrust_power / (mass_auw * gravity)
-    else:
-        climb_rate = speed_mission
+    thrust_climb = n_motors_cruise * propeller.thrust(CT, nD_climb, prop.get_diameter_m(), rho)
+    climb_rate = calc_climb_rate(backend.scalar, thrust_climb, drag.drag_max_endurance, mass_auw, speed_mission)
 
     return struct(RPM = rpm,
                   climb_rate = climb_rate,
-                  motor_current = motor_current)
-                  
+                  motor_current = motor_current,
+                  motor_power = motor_power,
+                  iterations = counter)
 
-# calculate max and min climb
-climb_max = calc_climb(battery.get_voltage_max())
-climb_min = calc_climb(battery.get_voltage_min())
 
-def calc_hover(battery_voltage):
+def calc_hover(prop, motor, battery, cruise, speed_mission, mass_auw, n_motors_hover, mission_hover_time, battery_voltage,
+               rho, start=None):
     '''
     Hover condition
     perform iterative solution to calculate specified supply voltage and
-    armature current required to hover with given battery voltage
-    TODO - add a basic thermal model
+    armature current required to hover with given battery voltage and air density,
+    starting from the (supply voltage, RPM) pair start if given
+    motor and ESC temperatures over a flight are found by thermal.py
     '''
     supply_voltage = battery_voltage
     thrust_converged = False
     thrust_loop_counter = 0
+    torque_iterations = 0
     CP_test = prop.get_CP(0)
     CT_test = prop.get_CT(0)
     rpm_test = (2/3.0) * supply_voltage * motor.get_kV()
+    if start is not None:
+        supply_voltage, rpm_test = start
+    rec = telemetry.active
+    record_history = rec is not None and rec.history
+    thrust_history = [] if record_history else None
     while not thrust_converged:
         torque_converged = False
         torque_loop_counter = 0
+        torque_history = [] if record_history else None
         while not torque_converged:
-            # calculate propeller torque load
-            nD_test = (rpm_test / 60) * prop.get_diameter_m()
-            prop_power_test = CP_test * (rho * nD_test**3 * prop.get_diameter_m()**2)
-            prop_torque_test = prop_power_test / (2 * pi * rpm_test / 60)
-        
-            # calculate motor torque
-            emf_test = rpm_test / motor.get_kV()
-            motor_current = (supply_voltage - emf_test) / motor.get_esr()
-        
-            # limit motor current if necessary by adjusting supply voltage downwards
-            if motor_current > motor.get_current_lim():
-                motor_current = motor.get_current_lim()
-        
-            # calculate excess torque - assume motor i0 varies linearly with back emf
-            excess_torque = (motor_current - motor.get_i0_current() * emf_test / motor.get_i0_voltage()) * motor.get_torque_constant() - prop_torque_test
-            excess_CQ = excess_torque / (rho * nD_test**2 * prop.get_diameter_m()**2)
-        
+            # calculate motor torque, limiting motor current if necessary, and excess torque
+            t = calc_motor_torque(prop, motor, rpm_test, CP_test, supply_voltage, motor.get_esr(), rho)
+            nD_test = t.nD
+            emf_test = t.emf
+            motor_current = t.motor_current
+            prop_torque_test = t.prop_torque
+            excess_torque = t.excess_torque
+            excess_CQ = t.excess_CQ
+
+            if torque_history is not None:
+                torque_history.append(excess_torque / prop_torque_test)
+
             # check for convergence
             torque_loop_counter += 1
+            torque_iterations += 1
             if abs(excess_torque / prop_torque_test) < 0.001:
                 torque_converged = 1
             elif torque_loop_counter > 1000:
-                error('hover test torque failed to converge')
-        
+                if rec is not None:
+                    rec.solver('hover_torque', 'relax', torque_loop_counter, excess_torque / prop_torque_test, 0.001, False, torque_history)
+                raise model_error('hover test torque failed to converge')
+
             # increment RPM proportional to excess torque coefficient
             rpm_test = rpm_test + 1000 * (speed_mission / prop.get_diameter_m()) * excess_CQ
-    
+
+        if rec is not None:
+            rec.solver('hover_torque', 'relax', torque_loop_counter, excess_torque / prop_torque_test, 0.001, True, torque_history)
+
         # calculate thrust from test
-        thrust_test = CT_test * (rho * nD_test**2 * prop.get_diameter_m()**2)
-    
+        thrust_test = propeller.thrust(CT_test, nD_test, prop.get_diameter_m(), rho)
+
         thrust_error = (thrust_test * n_motors_hover) - (mass_auw * gravity)
         supply_voltage = supply_voltage * (1.0 - 0.1*thrust_error/(mass_auw * gravity))
-    
+        if thrust_history is not None:
+            thrust_history.append(thrust_error)
+
         # check for convergence
         thrust_loop_counter += 1
         if abs(thrust_error) < (0.01 * mass_auw * gravity):
             thrust_converged = True
         elif thrust_loop_counter > 1000:
-            error('hover test thrust failed to converge')
+            if rec is not None:
+                rec.solver('hover_thrust', 'relax', thrust_loop_counter, thrust_error, 0.01 * mass_auw * gravity, False, thrust_history)
+            raise model_error('hover test thrust failed to converge')
+
+    if rec is not None:
+        rec.solver('hover_thrust', 'relax', thrust_loop_counter, thrust_error, 0.01 * mass_auw * gravity, True, thrust_history)
 
     # record power supply requirements for test
     motor_voltage = motor_current * motor.get_esr() + emf_test
@@ -331,101 +433,609 @@ def calc_hover(battery_voltage):
 
     thrust_grams = thrust_test / gravity * 1000
 
-    batt_watt_corrected_hours = battery.get_watt_hours() - motor_power * n_motors_hover * mission_hover_time / 60.0
-    corrected_endurance_minutes = 60 * batt_watt_corrected_hours / cruise.batt_power
-    corrected_range = 60 * corrected_endurance_minutes * speed_mission
+    hover = struct(RPM = rpm_test,
+                   thrust_grams = thrust_grams,
+                   voltage = supply_voltage,
+                   motor_voltage = motor_voltage,
+                   motor_current = motor_current,
+                   motor_power = motor_power,
+                   iterations = thrust_loop_counter,
+                   torque_iterations = torque_iterations)
+    calc_hover_endurance(hover, battery, cruise, speed_mission, n_motors_hover, mission_hover_time)
+    return hover
 
-    return struct(RPM = rpm_test,
-                  thrust_grams = thrust_grams,
-                  voltage = supply_voltage,
-                  motor_voltage = motor_voltage,
+def calc_hover_endurance(hover, battery, cruise, speed_mission, n_motors_hover, mission_hover_time):
+    '''
+    calculate endurance and range at cruise after using battery energy
+    to hover for mission_hover_time minutes, adding them to hover
+    '''
+    hover.corrected_endurance_minutes, hover.corrected_range = hover_endurance(
+        battery.get_watt_hours(), hover.motor_power, n_motors_hover, mission_hover_time, cruise.batt_power, speed_mission)
+
+def hover_endurance(watt_hours, motor_power, n_motors_hover, mission_hover_time, batt_power, speed_mission):
+    '''
+    return the endurance in minutes and range at cruise after hovering
+    for mission_hover_time minutes, on any backend
+    '''
+    batt_watt_corrected_hours = watt_hours - motor_power * n_motors_hover * mission_hover_time / 60.0
+    corrected_endurance_minutes = 60 * batt_watt_corrected_hours / batt_power
+    return corrected_endurance_minutes, 60 * corrected_endurance_minutes * speed_mission
+
+def calc_climb_rate(xp, thrust_climb, drag, mass_auw, speed_mission):
+    '''
+    climb rate at mission speed from the excess of thrust over drag, on
+    backend xp, limited to the mission speed when thrust exceeds drag plus weight
+    '''
+    weight = mass_auw * gravity
+    excess_thrust_power = (thrust_climb - drag) * speed_mission
+    return xp.where(thrust_climb <= (drag + weight), excess_thrust_power / weight, speed_mission)
+
+def calc_cruise_RPM_newton(prop, speed_mission, drag, n_motors_cruise, rho, rpm_start=None):
+    '''
+    calc_cruise_RPM using safeguarded Newton iteration on the thrust
+    balance, with the derivative of thrust taken from the CT polynomial
+    '''
+    D = prop.get_diameter_m()
+    state = struct()
+
+    def thrust_error(rpm):
+        # calculate advance ratio, J falls as RPM rises
+        nD = (rpm / 60) * D
+        J = speed_mission / nD
+        dCT = prop.get_CT_deriv(J) if prop.get_J_min() <= J <= prop.get_J_max() else 0.0
+        J = min(J, prop.get_J_max())
+        J = max(J, prop.get_J_min())
+
+        CT = prop.get_CT(J)
+        thrust = propeller.thrust(CT, nD, D, rho)
+        dthrust = propeller.thrust(2.0 * CT - J * dCT, nD, D, rho) / rpm
+        state.__dict__.update(nD=nD, J=J, CT=CT, thrust=thrust)
+        return (n_motors_cruise * thrust - drag.drag_max_endurance,
+                n_motors_cruise * dthrust,
+                0.001 * drag.drag_max_endurance)
+
+    # start from the best efficiency operating condition
+    if rpm_start is None:
+        rpm_start = 60 * (speed_mission / prop.find_best_ETA(0.01)) / D
+    rpm, iterations = solver.newton(thrust_error, rpm_start, True, 10000,
+                                    'endurance prop calculation could not converge', name='cruise_RPM')
+
+    # calculate power required
+    CP = prop.get_CP(state.J)
+    power = propeller.power(CP, state.nD, D, rho)
+
+    return struct(RPM = rpm,
+                  power = power,
+                  J = state.J,
+                  thrust = state.thrust,
+                  CP = CP,
+                  CT = state.CT,
+                  iterations = iterations)
+
+def calc_motor_torque(prop, motor, rpm, CP, supply_voltage, esr, rho):
+    '''
+    calculate the excess of motor torque over prop torque at the given
+    RPM with motor.torque_balance(), esr including any supply resistance
+    '''
+    return torque_balance(backend.scalar, rpm, prop.get_diameter_m(), CP, rho, supply_voltage, motor.get_kV(), esr,
+                          motor.get_current_lim(), motor.get_i0_current(), motor.get_i0_voltage(),
+                          motor.get_torque_constant())
+
+def calc_torque_balance(prop, motor, rpm, CP, JdCP, supply_voltage, esr, rho):
+    '''
+    calculate the excess of motor torque over prop torque at the given
+    RPM, and its derivative with respect to RPM. JdCP is J times the
+    derivative of CP with respect to J, or zero when J is fixed
+    '''
+    t = calc_motor_torque(prop, motor, rpm, CP, supply_voltage, esr, rho)
+    t.dexcess_torque = torque_slope(backend.scalar, t, rpm, prop.get_diameter_m(), CP, JdCP, rho, motor.get_kV(), esr,
+                                    motor.get_i0_current(), motor.get_i0_voltage(), motor.get_torque_constant())
+    return t
+
+def calc_climb_newton(prop, motor, cruise, speed_mission, drag, mass_auw, n_motors_cruise, battery_voltage, rho, rpm_start=None):
+    '''
+    calc_climb using safeguarded Newton iteration on the torque balance,
+    starting from the cruise RPM or rpm_start if given
+    '''
+    D = prop.get_diameter_m()
+    esr = motor.get_esr() + n_motors_cruise * motor.get_supply_esr()
+    state = struct()
+
+    def torque_error(rpm):
+        J = speed_mission / ((rpm / 60) * D)
+        JdCP = J * prop.get_CP_deriv(J) if prop.get_J_min() <= J <= prop.get_J_max() else 0.0
+        J = min(J, prop.get_J_max())
+        J = max(J, prop.get_J_min())
+        t = calc_torque_balance(prop, motor, rpm, prop.get_CP(J), JdCP, battery_voltage, esr, rho)
+        state.__dict__.update(J=J, t=t)
+        return (t.excess_torque, t.dexcess_torque, 0.001 * abs(t.prop_torque))
+
+    rpm, iterations = solver.newton(torque_error, cruise.RPM if rpm_start is None else rpm_start, False, 1000,
+                                    'full battery climb calculation failed to converge', name='climb')
+
+    # calculate climb rate using mission speed
+    CT = prop.get_CT(state.J)
+    thrust_climb = n_motors_cruise * propeller.thrust(CT, state.t.nD, D, rho)
+    climb_rate = calc_climb_rate(backend.scalar, thrust_climb, drag.drag_max_endurance, mass_auw, speed_mission)
+
+    # record power supply requirements for climb
+    motor_current = state.t.motor_current
+    motor_power = motor_current * (motor_current * esr + state.t.emf)
+
+    return struct(RPM = rpm,
+                  climb_rate = climb_rate,
                   motor_current = motor_current,
                   motor_power = motor_power,
-                  corrected_endurance_minutes = corrected_endurance_minutes,
-                  corrected_range = corrected_range)
-                       
-
-# calculate hover parameters for min voltage
-hover = calc_hover(battery.get_voltage_min())
-
-# print report
-print('############################################################')
-print('# Dimensions                                               #')
-print('############################################################')
-print('wing span = %.1f m,  AR = %.1f' % (wing.get_wing_span(), wing.get_aspect_ratio()))
-print('wing chord = %.3f m, AR = %.1f' % (wing.get_MAC(),wing.get_aspect_ratio()))
-
-print(' ')
-print('############################################################')
-print('# Mass                                                     #')
-print('############################################################')
-print('total mass = %.2f Kg' % mass_auw)
-print('airframe structure mass = %.2f Kg' % mass_structure)
-print('avionics mass = %.2f Kg' % mass_avionics)
-print('propulsion mass = %.2f Kg' % mass_propulsion)
-print('battery mass = %.2f Kg' % mass_batt)
-print('payload mass = %.2f Kg' % mass_payload)
-print('non-battery mass = %.2f Kg' % (mass_auw - mass_batt))
-
-print(' ')
-print('############################################################')
-print('# Aerodynamic Performance                                  #')
-print('############################################################')
-print('stall speed = %.2f m/s' % wing.get_speed_stall())
-print('minimum power speed = %.2f m/s' % wing.get_speed_min_pwr())
-print('minimum drag speed = %.2f m/s' % wing.get_speed_min_drag())
-print('mission speed = %.1f m/s' % speed_mission)
-print('Reynolds number = %.2e m/s' % (69000 * wing.get_MAC() * speed_mission))
-print('L/D max = %.3f at %.2f m/s' % (drag.LD_max, wing.get_speed_min_drag()))
-print('L/D at mission speed  = %.2f' % drag.LD_mission)
-
-print(' ')
-print('############################################################')
-print('# Propulsion                                               #')
-print('############################################################')
-print('Battery type = %s' % battery.get_description())
-print('Motor type = %s' % motor.get_type())
-print('prop shape used = %s' % prop.get_prop_model())
-print("num motors cruise = %u" % n_motors_cruise)
-print("num motors hover = %u" % n_motors_hover)
-print("num motors total = %u" % n_motors_total)
-print('prop diameter specified = %.1f in' % (prop.get_diameter_in()))
-print('prop pitch specified = %.1f in' % prop.get_pitch_in())
-print('power used by specified prop = %.0f' % cruise.power)
-print('mission RPM = %.0f' % cruise.RPM)
-print('mission advance ratio = %.3f' % cruise.J)
-print('mission CT = %.4f' % cruise.CT)
-print('mission CP = %.4f' % cruise.CP)
-
-print(' ')
-print('############################################################')
-print('# Flight Performance                                       #')
-print('############################################################')
-print('mission speed = %.1f m/s' % speed_mission)
-print('endurance = %.1f min (no hover)' % cruise.endurance_minutes)
-print('endurance = %.1f min (with hover)' % hover.corrected_endurance_minutes)
-print('still air range = %.2f km (no hover)' % (cruise.range_still_air/1000.0))
-print('still air range = %.2f km (with hover)' % (hover.corrected_range/1000.0))
-print('batt power draw = %.0f W' % cruise.batt_power)
-print('prop efficiency = %.1f %%' % (100*cruise.thrust_power/cruise.motor_power_out))
-print('motor efficiency = %.1f %%' % (100*cruise.motor_power_out/cruise.motor_power_in))
-print('motor current = %.1f Amps' % cruise.motor_current)
-print('ideal motor current = %.1f Amps' % cruise.motor_current_best_eff)
-print('fully charged climb rate = %.2f m/s at %.1f motor Amps' % (climb_max.climb_rate, climb_max.motor_current))
-print('fully discharged climb rate = %.2f m/s at %.1f motor Amps' % (climb_min.climb_rate, climb_min.motor_current))
-
-print(' ')
-print('############################################################')
-print('# Hover Performance Prediction - Fully Discharged          #')
-print('############################################################')
-print('wind tunnel data set used = %s' % prop.get_prop_model())
-print('prop diameter used = %.1f in' % prop.get_diameter_in())
-print('prop pitch used = %.2f in' % prop.get_pitch_in())
-print('ESC throttle = %.1f %%' % (100*hover.voltage/battery.get_voltage_min()))
-print('motor current = %.1f Amps' % (hover.motor_current))
-print('battery power = %.0f Watts' % (hover.motor_power*n_motors_hover))
-print('cell current = %.2f Amps' % battery.get_cell_current(hover.motor_power*n_motors_hover, battery.get_voltage_min()))
-print('prop speed = %.0f RPM' % hover.RPM)
-print('prop speed safety limit = %.0f RPM' % (145000/(prop.get_diameter_in())))
-print('prop thrust = %.0f g' % hover.thrust_grams)
-print('mission radius adjusted for %.1f min hover time %.3f km' % (mission_hover_time,0.5*hover.corrected_range/1000))
+                  iterations = iterations)
+
+def calc_hover_newton(prop, motor, battery, cruise, speed_mission, mass_auw, n_motors_hover, mission_hover_time, battery_voltage,
+                      rho, start=None):
+    '''
+    calc_hover using nested safeguarded Newton iterations, on supply
+    voltage for the thrust balance and on RPM for the torque balance.
+    The thrust derivative with respect to voltage comes from the
+    sensitivity of the torque balance to supply voltage. Starts from the
+    (supply voltage, RPM) pair start if given
+    '''
+    D = prop.get_diameter_m()
+    weight = mass_auw * gravity
+    CP_test = prop.get_CP(0)
+    CT_test = prop.get_CT(0)
+    state = struct(rpm = (2/3.0) * battery_voltage * motor.get_kV(), torque_iterations = 0)
+    voltage_start = battery_voltage
+    if start is not None:
+        voltage_start, state.rpm = start
+
+    def thrust_error(supply_voltage):
+        def torque_error(rpm):
+            t = calc_torque_balance(prop, motor, rpm, CP_test, 0.0, supply_voltage, motor.get_esr(), rho)
+            state.t = t
+            return (t.excess_torque, t.dexcess_torque, 0.001 * abs(t.prop_torque))
+
+        # warm start from the RPM found at the previous voltage
+        state.rpm, iterations = solver.newton(torque_error, state.rpm, False, 1000,
+                                              'hover test torque failed to converge', name='hover_torque')
+        state.torque_iterations += iterations
+        t = state.t
+        state.thrust = propeller.thrust(CT_test, t.nD, D, rho)
+
+        # once the motor current is limited more voltage gives no more
+        # thrust, so there is no hover solution
+        if t.current_limited and state.thrust * n_motors_hover - weight < -0.01 * weight:
+            raise model_error('hover test thrust failed to converge')
+
+        # d(rpm)/d(voltage) holding the torque balance at zero
+        dexcess_dvoltage = 0.0 if t.current_limited else motor.get_torque_constant() / motor.get_esr()
+        drpm_dvoltage = -dexcess_dvoltage / t.dexcess_torque
+        dthrust = 2.0 * state.thrust / state.rpm * drpm_dvoltage
+        return (state.thrust * n_motors_hover - weight,
+                dthrust * n_motors_hover,
+                0.01 * weight)
+
+    supply_voltage, iterations = solver.newton(thrust_error, voltage_start, True, 1000,
+                                               'hover test thrust failed to converge', name='hover_thrust')
+
+    # record power supply requirements for test
+    motor_current = state.t.motor_current
+    motor_voltage = motor_current * motor.get_esr() + state.t.emf
+    motor_power = motor_current * motor_voltage
+
+    hover = struct(RPM = state.rpm,
+                   thrust_grams = state.thrust / gravity * 1000,
+                   voltage = supply_voltage,
+                   motor_voltage = motor_voltage,
+                   motor_current = motor_current,
+                   motor_power = motor_power,
+                   iterations = iterations,
+                   torque_iterations = state.torque_iterations)
+    calc_hover_endurance(hover, battery, cruise, speed_mission, n_motors_hover, mission_hover_time)
+    return hover
+
+# cruise RPM, climb and hover solver functions by solver type
+solver_functions = {
+    'relax' : (calc_cruise_RPM, calc_climb, calc_hover),
+    'newton' : (calc_cruise_RPM_newton, calc_climb_newton, calc_hover_newton),
+}
+
+def get_solver_functions(solver_type):
+    '''return the cruise RPM, climb and hover solver functions for a solver type'''
+    if solver_type not in solver_functions:
+        raise model_error("Unknown solver %s. Choices are %s" % (solver_type, solver.solvers))
+    return solver_functions[solver_type]
+
+def calc_density(config):
+    '''return the air density at the altitude and temperature offset of a configuration'''
+    if not atmosphere.in_range(config.altitude, config.temp_offset):
+        raise model_error(atmosphere.range_error)
+    return atmosphere.density(backend.scalar, config.altitude, config.temp_offset)
+
+def calc_wing(config, mass_auw, rho):
+    '''return the wing, mission speed and drag polar for a configuration, all up mass and air density'''
+    w = wing.wing(config.wing_span, config.aspect_ratio, mass_auw, rho)
+    speed_mission = calc_speed_mission(w, config.mission_speed)
+    return w, speed_mission, w.calc_drag(mass_auw, speed_mission)
+
+# a memo.stage_memo remembering stage results between evaluations, set
+# with set_memo()
+memo = None
+
+def set_memo(m):
+    '''remember wing, cruise, climb and hover results in a memo.stage_memo, or None to stop'''
+    global memo
+    memo = m
+
+def memo_call(stage, key, func, *args):
+    '''return func(*args), remembered by key in the stage memo if one is set'''
+    if memo is None:
+        return func(*args)
+    return memo.call(stage, key, func, *args)
+
+# memo keys hold everything a stage depends on, including the solver
+# starting point, as a solver can converge differently or fail from
+# another start
+
+def prop_memo_key(config, rho):
+    '''return the memo key of the prop solutions'''
+    return (config.solver, config.prop_model, config.prop_diameter, config.prop_table_points,
+            CT_correction_factor, CP_correction_factor, rho)
+
+def memo_cruise_RPM(solve_cruise_RPM, config, prop, speed_mission, drag, rho, start=None):
+    '''return the cruise RPM solution, remembered in the stage memo'''
+    key = prop_memo_key(config, rho) + (speed_mission, drag.drag_max_endurance, config.num_motors_cruise, start)
+    cruise = memo_call('cruise_RPM', key, solve_cruise_RPM, prop, speed_mission, drag, config.num_motors_cruise, rho, start)
+    if memo is not None:
+        # calc_cruise_data adds to the remembered structure
+        cruise = struct(**cruise.__dict__)
+    return cruise
+
+def memo_climb(solve_climb, config, prop, mot, cruise, speed_mission, drag, mass_auw, voltage, rho, start=None):
+    '''return the climb solution at a battery voltage, remembered in the stage memo'''
+    key = prop_memo_key(config, rho) + (config.motor_type, speed_mission, mass_auw, cruise.RPM,
+                                        drag.drag_max_endurance, config.num_motors_cruise, voltage, start)
+    return memo_call('climb', key, solve_climb, prop, mot, cruise, speed_mission, drag, mass_auw,
+                     config.num_motors_cruise, voltage, rho, start)
+
+def memo_hover(solve_hover, config, prop, mot, batt, cruise, speed_mission, mass_auw, voltage, rho, start=None):
+    '''return the hover solution at a battery voltage, remembered in the stage memo'''
+    key = prop_memo_key(config, rho) + (config.motor_type, speed_mission, mass_auw, config.num_motors_hover, voltage, start)
+    hover = memo_call('hover', key, solve_hover, prop, mot, batt, cruise, speed_mission, mass_auw,
+                      config.num_motors_hover, config.hover_time, voltage, rho, start)
+    if memo is not None:
+        # the remembered hover solution may be for another battery or hover time
+        hover = struct(**hover.__dict__)
+        calc_hover_endurance(hover, batt, cruise, speed_mission, config.num_motors_hover, config.hover_time)
+    return hover
+
+def warm_start(prop, start):
+    '''
+    return cruise RPM, max and min climb RPM and hover (supply voltage,
+    RPM) starting points from start, a vtol_result for a similar
+    configuration, or None for each if start is None. The RPMs are
+    scaled for a change in prop diameter to keep the advance ratio in
+    cruise and climb and the static thrust in hover
+    '''
+    if start is None:
+        return None, None, None, None
+    scale = start.prop.get_diameter_m() / prop.get_diameter_m()
+    return (start.cruise.RPM * scale,
+            start.climb_max.RPM * scale,
+            start.climb_min.RPM * scale,
+            (start.hover.voltage, start.hover.RPM * scale**2))
+
+def evaluate(config, start=None):
+    '''
+    evaluate a vtol_config, returning a vtol_result
+    the cruise and hover solvers start from the converged solution of
+    start, a vtol_result for a nearby configuration, if given. A start
+    too far from the solution can make a solver fail where the usual
+    starting points converge, so a failed warm start is retried from them
+    raises model_error if the configuration can't be evaluated
+    '''
+    if start is not None:
+        try:
+            return evaluate_from(config, start)
+        except model_error:
+            pass
+    return evaluate_from(config, None)
+
+def evaluate_from(config, start):
+    '''evaluate a vtol_config with the solvers started from start, a vtol_result or None'''
+    # get prop, battery and motor models
+    with telemetry.stage('models'):
+        prop = propeller.propeller(config.prop_model, config.prop_diameter, config.prop_table_points,
+                                   CT_correction_factor, CP_correction_factor)
+        batt = battery.battery(config.battery_model, config.cell_series, config.cell_parallel)
+        mot = motor.motor(config.motor_type)
+
+    with telemetry.stage('mass'):
+        mass = calc_mass(config, prop, batt, mot)
+    rho = calc_density(config)
+
+    # calculate mission speed and drag parameters
+    with telemetry.stage('wing'):
+        w, speed_mission, drag = memo_call('wing', (config.wing_span, config.aspect_ratio, mass.auw, config.mission_speed, rho),
+                                           calc_wing, config, mass.auw, rho)
+
+    # pick the solvers
+    solve_cruise_RPM, solve_climb, solve_hover = get_solver_functions(config.solver)
+    cruise_start, climb_max_start, climb_min_start, hover_start = warm_start(prop, start)
+
+    # calculate cruise RPM and cruise data
+    with telemetry.stage('cruise'):
+        cruise = memo_cruise_RPM(solve_cruise_RPM, config, prop, speed_mission, drag, rho, cruise_start)
+        calc_cruise_data(prop, mot, batt, cruise, speed_mission, drag, config.num_motors_cruise, rho)
+
+    # calculate max and min climb
+    with telemetry.stage('climb'):
+        climb_max = memo_climb(solve_climb, config, prop, mot, cruise, speed_mission, drag, mass.auw,
+                               batt.get_voltage_max(), rho, climb_max_start)
+        climb_min = memo_climb(solve_climb, config, prop, mot, cruise, speed_mission, drag, mass.auw,
+                               batt.get_voltage_min(), rho, climb_min_start)
+
+    # calculate hover parameters for min voltage
+    with telemetry.stage('hover'):
+        hover = memo_hover(solve_hover, config, prop, mot, batt, cruise, speed_mission, mass.auw,
+                           batt.get_voltage_min(), rho, hover_start)
+
+    return vtol_result(config = config,
+                       prop = prop,
+                       battery = batt,
+                       motor = mot,
+                       wing = w,
+                       mass = mass,
+                       drag = drag,
+                       speed_mission = speed_mission,
+                       cruise = cruise,
+                       climb_max = climb_max,
+                       climb_min = climb_min,
+                       hover = hover)
+
+def print_report(r):
+    '''print a human readable report of a vtol_result'''
+    config = r.config
+    prop = r.prop
+    battery = r.battery
+    motor = r.motor
+    wing = r.wing
+    cruise = r.cruise
+    hover = r.hover
+    speed_mission = r.speed_mission
+    n_motors_hover = config.num_motors_hover
+
+    print('############################################################')
+    print('# Dimensions                                               #')
+    print('############################################################')
+    print('wing span = %.1f m,  AR = %.1f' % (wing.get_wing_span(), wing.get_aspect_ratio()))
+    print('wing chord = %.3f m, AR = %.1f' % (wing.get_MAC(),wing.get_aspect_ratio()))
+
+    print(' ')
+    print('############################################################')
+    print('# Mass                                                     #')
+    print('############################################################')
+    print('total mass = %.2f Kg' % r.mass.auw)
+    print('airframe structure mass = %.2f Kg' % r.mass.structure)
+    print('avionics mass = %.2f Kg' % r.mass.avionics)
+    print('propulsion mass = %.2f Kg' % r.mass.propulsion)
+    print('battery mass = %.2f Kg' % r.mass.batt)
+    print('payload mass = %.2f Kg' % r.mass.payload)
+    print('non-battery mass = %.2f Kg' % (r.mass.auw - r.mass.batt))
+
+    print(' ')
+    print('############################################################')
+    print('# Aerodynamic Performance                                  #')
+    print('############################################################')
+    print('air density = %.4f Kg/m^3 at %.0f m, ISA%+.0f C (%.0f C), density altitude %.0f m' % (
+        wing.rho, config.altitude, config.temp_offset, atmosphere.temperature(config.altitude, config.temp_offset),
+        atmosphere.density_altitude(wing.rho)))
+    print('stall speed = %.2f m/s' % wing.get_speed_stall())
+    print('minimum power speed = %.2f m/s' % wing.get_speed_min_pwr())
+    print('minimum drag speed = %.2f m/s' % wing.get_speed_min_drag())
+    print('mission speed = %.1f m/s' % speed_mission)
+    print('Reynolds number = %.2e m/s' % (69000 * wing.get_MAC() * speed_mission))
+    print('L/D max = %.3f at %.2f m/s' % (r.drag.LD_max, wing.get_speed_min_drag()))
+    print('L/D at mission speed  = %.2f' % r.drag.LD_mission)
+
+    print(' ')
+    print('############################################################')
+    print('# Propulsion                                               #')
+    print('############################################################')
+    print('Battery type = %s' % battery.get_description())
+    print('Motor type = %s' % motor.get_type())
+    print('prop shape used = %s' % prop.get_prop_model())
+    print("num motors cruise = %u" % config.num_motors_cruise)
+    print("num motors hover = %u" % config.num_motors_hover)
+    print("num motors total = %u" % config.num_motors_total)
+    print('prop diameter specified = %.1f in' % (prop.get_diameter_in()))
+    print('prop pitch specified = %.1f in' % prop.get_pitch_in())
+    if prop.table is not None:
+        table_error = prop.table.max_error(prop)
+        print('prop table points = %u' % prop.table.points)
+        print('prop table max error CT = %.2e CP = %.2e ETA = %.2e' % (table_error.CT, table_error.CP, table_error.ETA))
+    print('power used by specified prop = %.0f' % cruise.power)
+    print('mission RPM = %.0f' % cruise.RPM)
+    print('mission advance ratio = %.3f' % cruise.J)
+    print('mission CT = %.4f' % cruise.CT)
+    print('mission CP = %.4f' % cruise.CP)
+
+    print(' ')
+    print('############################################################')
+    print('# Flight Performance                                       #')
+    print('############################################################')
+    print('mission speed = %.1f m/s' % speed_mission)
+    print('endurance = %.1f min (no hover)' % cruise.endurance_minutes)
+    print('endurance = %.1f min (with hover)' % hover.corrected_endurance_minutes)
+    sag = cruise.sag
+    print('endurance = %.1f min (no hover, with voltage sag, %.1f V to %.1f V, %.0f %% charge left)' % (
+        sag.endurance_minutes, sag.voltage_start, sag.voltage_end, 100 * sag.soc_end))
+    print('still air range = %.2f km (no hover)' % (cruise.range_still_air/1000.0))
+    print('still air range = %.2f km (with hover)' % (hover.corrected_range/1000.0))
+    print('batt power draw = %.0f W' % cruise.batt_power)
+    print('prop efficiency = %.1f %%' % (100*cruise.thrust_power/cruise.motor_power_out))
+    print('motor efficiency = %.1f %%' % (100*cruise.motor_power_out/cruise.motor_power_in))
+    print('motor current = %.1f Amps' % cruise.motor_current)
+    print('ideal motor current = %.1f Amps' % cruise.motor_current_best_eff)
+    print('fully charged climb rate = %.2f m/s at %.1f motor Amps' % (r.climb_max.climb_rate, r.climb_max.motor_current))
+    print('fully discharged climb rate = %.2f m/s at %.1f motor Amps' % (r.climb_min.climb_rate, r.climb_min.motor_current))
+
+    print(' ')
+    print('############################################################')
+    print('# Hover Performance Prediction - Fully Discharged          #')
+    print('############################################################')
+    print('wind tunnel data set used = %s' % prop.get_prop_model())
+    print('prop diameter used = %.1f in' % prop.get_diameter_in())
+    print('prop pitch used = %.2f in' % prop.get_pitch_in())
+    print('ESC throttle = %.1f %%' % (100*hover.voltage/battery.get_voltage_min()))
+    print('motor current = %.1f Amps' % (hover.motor_current))
+    print('battery power = %.0f Watts' % (hover.motor_power*n_motors_hover))
+    print('cell current = %.2f Amps' % battery.get_cell_current(hover.motor_power*n_motors_hover, battery.get_voltage_min()))
+    print('prop speed = %.0f RPM' % hover.RPM)
+    print('prop speed safety limit = %.0f RPM' % (145000/(prop.get_diameter_in())))
+    print('prop thrust = %.0f g' % hover.thrust_grams)
+    print('mission radius adjusted for %.1f min hover time %.3f km' % (config.hover_time,0.5*hover.corrected_range/1000))
+    ambient = atmosphere.temperature(config.altitude, config.temp_offset)
+    heat = thermal.check_result(r, ambient)
+    print('peak motor winding temperature = %.0f C (limit %.0f C, hover, %.0f m climb and cruise at %.0f C ambient)' % (
+        heat.winding_max, heat.winding_temp_max, thermal.climb_height, ambient))
+    print('peak ESC temperature = %.0f C (limit %.0f C)' % (heat.esc_max, heat.esc_temp_max))
+
+def add_options(parser):
+    '''add the model options to an optparse parser'''
+    option_types = { str : 'string', float : 'float', int : 'int' }
+    for (name, otype, default, help_text) in options:
+        parser.add_option("--" + name.replace('_', '-'), type=option_types[otype], default=default,
+                          help=help_text + ' [default: %default]')
+
+def parse_config_line(line):
+    '''
+    parse a JSON line of option values into a vtol_config, with options
+    not given left at their defaults. An "id" value is passed through
+    to the result. Returns (config, id), raising model_error if the line
+    is not valid
+    '''
+    try:
+        values = json.loads(line)
+    except ValueError as e:
+        raise model_error("bad JSON: %s" % e)
+    if not isinstance(values, dict):
+        raise model_error("expected a JSON object of option values")
+    config_id = values.pop('id', None)
+    option_types = dict((name, otype) for (name, otype, default, help_text) in options)
+    for name, value in values.items():
+        if name not in option_types:
+            raise model_error("Unknown option %s. Choices are %s" % (name, option_names))
+        try:
+            values[name] = option_types[name](value)
+        except (TypeError, ValueError):
+            raise model_error("bad value %r for option %s" % (value, name))
+    return vtol_config(**values), config_id
+
+def json_value(v):
+    '''return v with non-finite floats as None, as JSON has no NaN or infinity'''
+    if isinstance(v, float) and not isfinite(v):
+        return None
+    return v
+
+def evaluate_lines(lines, chunk_size=1000, sag=False):
+    '''
+    evaluate an iterable of JSON configuration lines in vectorized
+    chunks, yielding one result dictionary per line in order, with the
+    endurance with voltage sag if sag is True. Lines are
+    numbered from 1, and blank lines are skipped but counted. Results
+    of a chunk are yielded as soon as it is evaluated, so only one chunk
+    is held in memory at a time
+    '''
+    # imported here as batch.py imports this module
+    import batch
+    fields = batch.result_fields(sag)
+    output_names = [f[0] for f in fields]
+    if chunk_size < 1:
+        raise model_error("chunk size must be at least 1")
+    lines = ((number, line) for (number, line) in enumerate(lines, 1) if line.strip())
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            break
+        results = []
+        configs = []
+        for (line_number, line) in chunk:
+            result = { 'line' : line_number }
+            try:
+                config, config_id = parse_config_line(line)
+                if config_id is not None:
+                    result['id'] = config_id
+                configs.append((result, config))
+            except model_error as e:
+                result.update(ok = False, error = str(e))
+            results.append(result)
+        # a bad catalogue name, or a value too large to evaluate, fails
+        # the whole batch, so split failing batches in half until the
+        # bad configurations are on their own
+        groups = [configs] if configs else []
+        while groups:
+            group = groups.pop()
+            try:
+                r = batch.evaluate(batch.config_batch([c for (result, c) in group]), sag)
+            except Exception as e:
+                if len(group) == 1:
+                    group[0][0].update(ok = False, error = str(e) or type(e).__name__)
+                else:
+                    groups.extend([group[len(group)//2:], group[:len(group)//2]])
+                continue
+            rows = batch.output_rows(r, fields)
+            for k, (result, config) in enumerate(group):
+                result.update(ok = bool(r.ok[k]), error = r.errors[k])
+                result.update(zip(output_names, [json_value(v) for v in rows[k]]))
+        for result in results:
+            yield result
+
+def run_batch(infile, outfile, chunk_size, sag=False):
+    '''evaluate JSON configuration lines from infile, writing JSON result lines to outfile'''
+    for k, result in enumerate(evaluate_lines(infile, chunk_size, sag), 1):
+        outfile.write(json.dumps(result) + '\n')
+        if k % chunk_size == 0:
+            outfile.flush()
+    outfile.flush()
+
+def main():
+    parser = optparse.OptionParser("vtol_model.py")
+    add_options(parser)
+    parser.add_option("--prop-cache", default=None, help='file to keep fitted prop polynomials in between runs')
+    parser.add_option("--prop-store", default=None, help='compiled prop store file to take prop data from, see prop_store.py')
+    parser.add_option("--profile", default=None, help='JSON file to write solver iterations, residuals and stage times to')
+    parser.add_option("--profile-history", action='store_true', default=False, help='include the residual at every solver iteration in the profile')
+    parser.add_option("--batch", default=None, help='evaluate JSON lines of option values from a file, or - for stdin, writing JSON result lines to stdout')
+    parser.add_option("--chunk-size", type='int', default=1000, help='configurations evaluated together in batch mode [default: %default]')
+    parser.add_option("--sag", action='store_true', default=False, help='add the cruise endurance with voltage sag to batch mode results')
+    opts, args = parser.parse_args()
+
+    if opts.prop_cache is not None:
+        propeller.fits.set_file(opts.prop_cache)
+    if opts.prop_store is not None:
+        propeller.use_store(prop_store.prop_store(opts.prop_store))
+
+    if opts.batch is not None:
+        if opts.chunk_size < 1:
+            error("chunk size must be at least 1")
+        if opts.batch == '-':
+            run_batch(sys.stdin, sys.stdout, opts.chunk_size, opts.sag)
+        else:
+            with open(opts.batch) as f:
+                run_batch(f, sys.stdout, opts.chunk_size, opts.sag)
+        return
+
+    config = vtol_config(**dict((name, getattr(opts, name)) for name in option_names))
+    rec = None
+    if opts.profile is not None:
+        rec = telemetry.recorder(history=opts.profile_history)
+    try:
+        with telemetry.recording(rec):
+            result = evaluate(config)
+    except model_error as e:
+        error(str(e))
+    finally:
+        if rec is not None:
+            rec.save(opts.profile)
+    print_report(result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+'''
+resident VTOL model evaluation server
+
+keeps the catalogues and fitted props loaded and answers evaluation
+requests over a Unix domain socket, so each request costs only the
+evaluation. The protocol is JSON lines, as for vtol_model.py --batch:
+each request line is an object of option values with an optional "id",
+and each gets one result line, in order on its connection. The line
+{"command": "stats"} returns the request and batch counts.
+
+Requests from all clients are gathered for up to --batch-window
+seconds, or until --max-batch are waiting, and evaluated together as
+one vectorized batch:
+
+  ./vtol_server.py --socket /tmp/vtol_model.sock &
+  ./vtol_client.py --socket /tmp/vtol_model.sock wing_span=2.5
+
+released under GPLv3
+'''
+
+import optparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+import propeller
+import prop_store
+import vtol_model
+import vtol_client
+from util import *
+
+class server(object):
+    '''an evaluation server gathering requests from every connection into batches'''
+
+    def __init__(self, path, batch_window=0.002, max_batch=1000, sag=False):
+        self.path = path
+        self.sag = sag
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.queue = None
+        # one evaluation thread, so batches run in turn while the event loop keeps serving
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.connections = 0
+        self.requests = 0
+        self.batches = 0
+
+    def warm(self):
+        '''fit every prop in the catalogue and find its best ETA, so requests don't pay for it'''
+        for m in propeller.prop_models():
+            propeller.propeller(m, 1.0).find_best_ETA(0.01)
+
+    def stats(self):
+        '''return the request and batch counts'''
+        return { 'connections' : self.connections,
+                 'requests' : self.requests,
+                 'batches' : self.batches,
+                 'mean_batch' : self.requests / float(self.batches) if self.batches else 0.0 }
+
+    def evaluate(self, lines):
+        '''evaluate a list of JSON request lines, returning the result lines'''
+        results = []
+        for result in vtol_model.evaluate_lines(lines, len(lines), self.sag):
+            del result['line']
+            results.append(json.dumps(result))
+        return results
+
+    async def batcher(self):
+        '''gather queued requests into batches and evaluate them'''
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(items) < self.max_batch:
+                if not self.queue.empty():
+                    items.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self.requests += len(items)
+            try:
+                results = await loop.run_in_executor(self.executor, self.evaluate, [line for (line, future) in items])
+            except Exception as e:
+                # fail this batch but keep serving, so no request waits forever
+                traceback.print_exc(file=sys.stderr)
+                failed = json.dumps({ 'ok' : False, 'error' : 'evaluation failed: %s' % (str(e) or type(e).__name__) })
+                results = [failed] * len(items)
+            for (line, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def send_results(self, pending, writer):
+        '''write the results of a connection's requests in the order they arrived'''
+        while True:
+            future = await pending.get()
+            if future is None:
+                break
+            writer.write((await future).encode('utf-8') + b'\n')
+            await writer.drain()
+
+    async def handle(self, reader, writer):
+        '''read request lines from a connection, queueing them for evaluation'''
+        loop = asyncio.get_running_loop()
+        self.connections += 1
+        pending = asyncio.Queue()
+        sender = asyncio.ensure_future(self.send_results(pending, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                future = loop.create_future()
+                if line.startswith('{"command"'):
+                    try:
+                        command = json.loads(line).get('command')
+                    except ValueError:
+                        command = None
+                    if command == 'stats':
+                        future.set_result(json.dumps(self.stats()))
+                    else:
+                        future.set_result(json.dumps({ 'ok' : False, 'error' : 'Unknown command %s' % command }))
+                else:
+                    self.queue.put_nowait((line, future))
+                pending.put_nowait(future)
+            pending.put_nowait(None)
+            await sender
+        except (ConnectionError, asyncio.CancelledError):
+            sender.cancel()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        '''serve until interrupted'''
+        self.queue = asyncio.Queue()
+        remove_stale_socket(self.path)
+        s = await asyncio.start_unix_server(self.handle, path=self.path)
+        batcher = asyncio.ensure_future(self.batcher())
+        stop = asyncio.get_running_loop().create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+        try:
+            await stop
+        finally:
+            s.close()
+            batcher.cancel()
+            self.executor.shutdown(wait=False)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+def remove_stale_socket(path):
+    '''remove a socket file left by a server that has exited, raising model_error if one is still running'''
+    if not os.path.exists(path):
+        return
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    finally:
+        s.close()
+    raise model_error("a server is already listening on %s" % path)
+
+def main():
+    parser = optparse.OptionParser("vtol_server.py [options]")
+    parser.add_option("--socket", default=vtol_client.default_socket, help='socket path to listen on [default: %default]')
+    parser.add_option("--batch-window", type='float', default=0.002, help='seconds to gather requests into a batch [default: %default]')
+    parser.add_option("--max-batch", type='int', default=1000, help='most requests evaluated together [default: %default]')
+    parser.add_option("--prop-cache", default=None, help='file to keep fitted prop polynomials in between runs')
+    parser.add_option("--prop-store", default=None, help='compiled prop store file to take prop data from, see prop_store.py')
+    parser.add_option("--sag", action='store_true', default=False, help='add the cruise endurance with voltage sag to results')
+    opts, args = parser.parse_args()
+
+    if opts.prop_cache is not None:
+        propeller.fits.set_file(opts.prop_cache)
+    if opts.prop_store is not None:
+        propeller.use_store(prop_store.prop_store(opts.prop_store))
+    s = server(opts.socket, opts.batch_window, opts.max_batch, opts.sag)
+    s.warm()
+    try:
+        asyncio.run(s.serve())
+    except model_error as e:
+        error(str(e))
+
+if __name__ == '__main__':
+    main()
@@ -6,36 +6,84 @@ wing model class
 
 from util import *
 from math import *
+import backend
+
+lift_coef_stall_margin = 1.5 # margin between level flight stall speed and mission speed
+CL_max = 1.2 # maximum lift coefficient
+span_efficiency = 0.85 # span efficiency factor
+CD0_wing = 0.015 # typical zero lift drag coefficient for a wing section at a Reynolds number around 300000
+fus_front_area = 0.1*0.1 # frontal area of the fuselage and motor pods(m^2)
+fus_drag_coef = 0.7 # assume front faired bluff body drag
+
+def polar(xp, wing_span, aspect_ratio, mass_auw, rho, CD0_wing, fus_drag_coef, CL_max, span_efficiency):
+    '''
+    wing area, stall speed and drag polar coefficients, with drag =
+    coef_A*speed^2 + coef_B/speed^2, in air of density rho on backend
+    xp. The wing and fuselage coefficients are usually the module defaults
+    '''
+    # x_cg = 0.33 * MAC
+    # x_ac = 0.25 * MAC
+    # Re = 69000*wing_span/aspect_ratio*speed_stall*1.5 # Wing Reynolds number at typical mission endurance speed
+    area = wing_span*wing_span / aspect_ratio
+    CD0 = CD0_wing + fus_drag_coef*(fus_front_area/area) # zero lift drag coefficient of wing + body + tail
+    speed_stall = xp.sqrt((2 * mass_auw * gravity)/(rho * area * CL_max)) # minimum flying speed
+    weight = mass_auw * gravity
+    coef_A = 0.5 * rho * CD0 * area
+    coef_B = 1.0 / (pi * (wing_span*wing_span) * span_efficiency) * (weight*weight) / (0.5 * rho)
+    speed_min_drag = xp.sqrt(xp.sqrt(coef_B/coef_A))
+    return struct(area = area,
+                  CD0 = CD0,
+                  speed_stall = speed_stall,
+                  coef_A = coef_A,
+                  coef_B = coef_B,
+                  speed_min_drag = speed_min_drag,
+                  speed_min_pwr = 0.76 * speed_min_drag)
+
+def speed_mission(xp, speed_stall, speed_min_pwr, mission_speed_min):
+    '''
+    mission speed as the maximum of the max endurance speed and the
+    desired min mission speed, on backend xp
+    '''
+    speed_max_endurance = xp.maximum(lift_coef_stall_margin * speed_stall, speed_min_pwr)
+    return xp.maximum(speed_max_endurance, mission_speed_min)
+
+def drag_polar(xp, coef_A, coef_B, speed_min_drag, mass_auw, speed_mission):
+    '''drag and lift to drag ratios at best L/D and at mission speed, on backend xp'''
+    # sanity check for best L/D
+    drag_best_LD = coef_A*(speed_min_drag*speed_min_drag) + coef_B/(speed_min_drag*speed_min_drag)
+    drag_max_endurance = coef_A*(speed_mission*speed_mission) + coef_B/(speed_mission*speed_mission)
+    return struct(drag_best_LD = drag_best_LD,
+                  LD_max = mass_auw*gravity/drag_best_LD,
+                  drag_max_endurance = drag_max_endurance,
+                  LD_mission = mass_auw*gravity/drag_max_endurance)
 
 class wing(object):
     '''model a wing'''
 
-    def __init__(self, wing_span, aspect_ratio, mass_auw):
+    def __init__(self, wing_span, aspect_ratio, mass_auw, rho):
         self.wing_span = wing_span
         self.aspect_ratio = aspect_ratio
-        self.lift_coef_stall_margin = 1.5 # margin between level flight stall speed and mission speed
-        self.CL_max = 1.2 # maximum lift coefficient
-        self.span_efficiency = 0.85 # span efficiency factor
-        self.CD0_wing = 0.015 # typical zero lift drag coefficient for a wing section at a Reynolds number around 300000
-        self.fus_front_area = 0.1*0.1 # frontal area of the fuselage and motor pods(m^2)
-        self.fus_drag_coef = 0.7 # assume front faired bluff body drag
-
-        # x_cg = 0.33 * MAC
-        # x_ac = 0.25 * MAC
-        # Re = 69000*wing_span/aspect_ratio*speed_stall*1.5 # Wing Reynolds number at typical mission endurance speed
-        self.CD0 = self.CD0_wing + self.fus_drag_coef*(self.fus_front_area/self.get_wing_area()) # zero lift drag coefficient of wing + body + tail
-        self.speed_stall = sqrt((2 * mass_auw * gravity)/(rho * self.get_wing_area() * self.CL_max)) # minimum flying speed
-
-        self.coef_A = 0.5 * rho * self.CD0 * self.get_wing_area()
-        self.coef_B = 1.0 / (pi * self.wing_span**2 * self.span_efficiency) * (mass_auw * gravity)**2 / (0.5 * rho)
-
-        self.speed_min_drag = (self.coef_B/self.coef_A)**0.25
-        self.speed_min_pwr = 0.76 * self.speed_min_drag
+        self.rho = rho # air density (Kg/m^3)
+        self.lift_coef_stall_margin = lift_coef_stall_margin
+        self.CL_max = CL_max
+        self.span_efficiency = span_efficiency
+        self.CD0_wing = CD0_wing
+        self.fus_front_area = fus_front_area
+        self.fus_drag_coef = fus_drag_coef
+
+        p = polar(backend.scalar, wing_span, aspect_ratio, mass_auw, rho,
+                  self.CD0_wing, self.fus_drag_coef, self.CL_max, self.span_efficiency)
+        self.CD0 = p.CD0
+        self.speed_stall = p.speed_stall
+        self.coef_A = p.coef_A
+        self.coef_B = p.coef_B
+        self.speed_min_drag = p.speed_min_drag
+        self.speed_min_pwr = p.speed_min_pwr
         self.mass_auw = mass_auw
 
     def get_wing_area(self):
         '''return wing areas in m^2'''
-        return self.wing_span**2 / self.aspect_ratio
+        return self.wing_span*self.wing_span / self.aspect_ratio
 
     def get_wing_span(self):
         '''return wing span in meters'''
@@ -64,18 +112,4 @@ class wing(object):
     def calc_drag(self, mass_auw, speed_mission):
         '''Drag Polar Calculations given weight and mission speed'''
 
-        # drag = coef_A*speed^2 + coef_B/speed^2
-
-        # sanity check for best L/D
-        drag_best_LD = self.coef_A*self.speed_min_drag**2 + self.coef_B/self.speed_min_drag**2
-        LD_max = mass_auw*gravity/drag_best_LD
-
-        drag_max_endurance = self.coef_A*speed_mission**2 + self.coef_B/speed_mission**2
-
-        LD_mission = self.mass_auw*gravity/(self.coef_A*speed_mission**2 + self.coef_B/speed_mission**2)
-
-        return struct(drag_best_LD = drag_best_LD,
-                      LD_max = LD_max,
-                      drag_max_endurance = drag_max_endurance,
-                      LD_mission = LD_mission)
-
+        return drag_polar(backend.scalar, self.coef_A, self.coef_B, self.speed_min_drag, mass_auw, speed_mission)